@@ -0,0 +1,6 @@
+"""
+Benchmarks for PDF Tool API
+Deterministic synthetic corpus (corpus.py), a runner for functions.py (runner.py)
+and an HTTP load test for dapi:app (loadtest.py).
+Run with: python -m benchmarks --help / python -m benchmarks.loadtest --help
+"""
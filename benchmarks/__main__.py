@@ -0,0 +1,54 @@
+"""
+Command line entry point: python -m benchmarks
+
+Examples:
+    python -m benchmarks --scale small --save-baseline benchmarks/baseline.json
+    python -m benchmarks --scale small --baseline benchmarks/baseline.json
+    python -m benchmarks --only compress pdf_to_images --repeats 5
+"""
+import argparse
+import os
+import sys
+
+from benchmarks.corpus import SCALES, generate_corpus
+from benchmarks.runner import compare_to_baseline, environment_info, run_benchmarks, save_results
+
+DEFAULT_CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".corpus")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark functions.py on a synthetic PDF corpus")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small", help="Corpus size")
+    parser.add_argument("--seed", type=int, default=1234, help="Corpus seed")
+    parser.add_argument("--corpus-dir", default=DEFAULT_CORPUS_DIR, help="Where to generate the corpus")
+    parser.add_argument("--regenerate", action="store_true", help="Regenerate the corpus even if cached")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per case (median is reported)")
+    parser.add_argument("--only", nargs="*", help="Run only cases whose name contains one of these strings")
+    parser.add_argument("--output", help="Write results JSON to this path")
+    parser.add_argument("--save-baseline", metavar="PATH", help="Write results as the new baseline")
+    parser.add_argument("--baseline", metavar="PATH", help="Compare results with this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Relative slowdown tolerated (default 0.10)")
+    args = parser.parse_args()
+
+    corpus_dir = os.path.join(args.corpus_dir, f"{args.scale}_{args.seed}")
+    print(f"Corpus: {corpus_dir}")
+    corpus = generate_corpus(corpus_dir, scale=args.scale, seed=args.seed, force=args.regenerate)
+
+    meta = environment_info(args.scale, args.seed)
+    print(f"Running benchmarks (repeats={args.repeats})")
+    results = run_benchmarks(corpus, repeats=args.repeats, only=args.only)
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        save_results(path, meta, results)
+        print(f"Results written to {path}")
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, meta, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) slower than baseline by more than {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
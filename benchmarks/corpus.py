@@ -0,0 +1,228 @@
+"""
+Deterministic synthetic corpus for benchmarks
+Generates PDFs with different cost profiles plus DOCX/XLSX/PNG inputs.
+The same seed and scale always produce the same documents.
+"""
+import hashlib
+import io
+import json
+import os
+import random
+from typing import Dict
+
+import fitz
+
+# Page counts / sizes per scale
+SCALES: Dict[str, Dict[str, int]] = {
+    "small": {"text_pages": 20, "scan_pages": 5, "vector_pages": 5, "small_pages": 100, "vector_shapes": 300, "rows": 500},
+    "medium": {"text_pages": 200, "scan_pages": 40, "vector_pages": 40, "small_pages": 1000, "vector_shapes": 1500, "rows": 5000},
+    "large": {"text_pages": 1000, "scan_pages": 200, "vector_pages": 150, "small_pages": 3000, "vector_shapes": 4000, "rows": 30000},
+}
+
+WORDS = (
+    "invoice contract amount total payment delivery customer account balance report "
+    "quarter revenue section clause party agreement schedule annex signature date "
+    "page document summary table figure reference number value item quantity price"
+).split()
+
+# Fixed metadata so repeated runs produce identical documents
+FIXED_METADATA = {
+    "creationDate": "D:20240101000000Z",
+    "modDate": "D:20240101000000Z",
+    "producer": "pydf-benchmarks",
+    "creator": "pydf-benchmarks",
+}
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _finish(doc: fitz.Document) -> bytes:
+    doc.set_metadata({**doc.metadata, **FIXED_METADATA})
+    data = doc.tobytes(garbage=3, deflate=True, no_new_id=True)
+    doc.close()
+    return data
+
+
+def text_heavy_pdf(rng: random.Random, scale: Dict[str, int]) -> bytes:
+    """Dense text pages, like contracts and reports"""
+    doc = fitz.open()
+    for _ in range(scale["text_pages"]):
+        page = doc.new_page(width=595, height=842)
+        lines = [_sentence(rng, rng.randint(8, 11)) for _ in range(66)]
+        page.insert_text((50, 60), lines, fontsize=9, fontname="helv")
+    return _finish(doc)
+
+
+def scanned_pdf(rng: random.Random, scale: Dict[str, int]) -> bytes:
+    """Image-only pages: rendered text with noise, embedded as 200 DPI RGB JPEGs"""
+    from PIL import Image
+    import numpy as np
+
+    np_rng = np.random.RandomState(rng.randint(0, 2 ** 31 - 1))
+    doc = fitz.open()
+    for _ in range(scale["scan_pages"]):
+        # Render a text page at 200 DPI, then degrade it like a scanner would
+        source = fitz.open()
+        src_page = source.new_page(width=612, height=792)
+        lines = [_sentence(rng, rng.randint(6, 10)) for _ in range(50)]
+        src_page.insert_text((60, 72), lines, fontsize=10, fontname="tiro")
+        pix = src_page.get_pixmap(dpi=200, colorspace=fitz.csGRAY)
+        source.close()
+
+        gray = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width).astype(np.int16)
+        gray = np.clip(gray - np_rng.randint(0, 25, gray.shape), 0, 255).astype(np.uint8)
+        img = Image.fromarray(gray, "L").convert("RGB")
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=85)
+
+        page = doc.new_page(width=612, height=792)
+        page.insert_image(page.rect, stream=buffer.getvalue())
+    return _finish(doc)
+
+
+def vector_heavy_pdf(rng: random.Random, scale: Dict[str, int]) -> bytes:
+    """Pages full of vector drawings, like CAD exports and charts"""
+    doc = fitz.open()
+    for _ in range(scale["vector_pages"]):
+        page = doc.new_page(width=842, height=595)
+        shape = page.new_shape()
+        for _ in range(scale["vector_shapes"]):
+            x0, y0 = rng.uniform(0, 800), rng.uniform(0, 560)
+            kind = rng.random()
+            if kind < 0.5:
+                shape.draw_line((x0, y0), (x0 + rng.uniform(-80, 80), y0 + rng.uniform(-80, 80)))
+            elif kind < 0.8:
+                shape.draw_rect(fitz.Rect(x0, y0, x0 + rng.uniform(2, 40), y0 + rng.uniform(2, 40)))
+            else:
+                shape.draw_circle((x0, y0), rng.uniform(1, 15))
+            shape.finish(color=(rng.random(), rng.random(), rng.random()), width=0.5)
+        shape.commit()
+    return _finish(doc)
+
+
+def many_small_pages_pdf(rng: random.Random, scale: Dict[str, int]) -> bytes:
+    """Many tiny pages with a line of text each, like receipts or labels"""
+    doc = fitz.open()
+    for idx in range(scale["small_pages"]):
+        page = doc.new_page(width=210, height=298)
+        page.insert_text((15, 30), f"#{idx + 1} {_sentence(rng, 4)}", fontsize=7)
+    return _finish(doc)
+
+
+def huge_page_pdf(rng: random.Random, scale: Dict[str, int]) -> bytes:
+    """A single very large page (poster / engineering drawing)"""
+    doc = fitz.open()
+    page = doc.new_page(width=7200, height=7200)  # 100 x 100 inches
+    shape = page.new_shape()
+    for _ in range(scale["vector_shapes"] * 4):
+        x0, y0 = rng.uniform(0, 7100), rng.uniform(0, 7100)
+        shape.draw_rect(fitz.Rect(x0, y0, x0 + rng.uniform(5, 100), y0 + rng.uniform(5, 100)))
+        shape.finish(color=(0, 0, 0), fill=(rng.random(), rng.random(), rng.random()), width=1)
+    shape.commit()
+    for row in range(40):
+        page.insert_text((100, 150 + row * 170), _sentence(rng, 12), fontsize=48)
+    return _finish(doc)
+
+
+def sample_docx(rng: random.Random, scale: Dict[str, int]) -> bytes:
+    from docx import Document
+
+    document = Document()
+    document.core_properties.author = "pydf-benchmarks"
+    for _ in range(scale["rows"] // 5):
+        document.add_paragraph(_sentence(rng, rng.randint(6, 14)))
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def sample_xlsx(rng: random.Random, scale: Dict[str, int]) -> bytes:
+    import openpyxl
+
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["id", "item", "quantity", "price", "note"])
+    for idx in range(scale["rows"]):
+        sheet.append([idx, rng.choice(WORDS), rng.randint(1, 500), round(rng.uniform(1, 999), 2), _sentence(rng, 3)])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def sample_png(rng: random.Random, scale: Dict[str, int]) -> bytes:
+    from PIL import Image
+    import numpy as np
+
+    np_rng = np.random.RandomState(rng.randint(0, 2 ** 31 - 1))
+    # Smooth gradient plus noise: compresses like a photo, not like flat art
+    height, width = 1600, 1200
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    noise = np_rng.randint(0, 40, (height, width, 3))
+    pixels = np.clip(gradient + noise, 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels, "RGB").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+# name -> (filename, generator)
+GENERATORS: Dict[str, tuple] = {
+    "text_heavy": ("text_heavy.pdf", text_heavy_pdf),
+    "scanned": ("scanned.pdf", scanned_pdf),
+    "vector_heavy": ("vector_heavy.pdf", vector_heavy_pdf),
+    "many_small_pages": ("many_small_pages.pdf", many_small_pages_pdf),
+    "huge_page": ("huge_page.pdf", huge_page_pdf),
+    "docx": ("sample.docx", sample_docx),
+    "xlsx": ("sample.xlsx", sample_xlsx),
+    "png": ("sample.png", sample_png),
+}
+
+
+def generate_corpus(output_dir: str, scale: str = "small", seed: int = 1234, force: bool = False) -> Dict[str, dict]:
+    """
+    Generate the corpus into output_dir and write a manifest.json.
+
+    Files are reused when a manifest with the same scale and seed exists,
+    unless force is True.
+
+    Returns:
+        Manifest mapping corpus name -> {path, bytes, sha256, pages}
+    """
+    if scale not in SCALES:
+        raise ValueError(f"Unknown scale '{scale}'. Choose one of: {', '.join(SCALES)}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, "manifest.json")
+    if not force and os.path.exists(manifest_path):
+        with open(manifest_path) as fh:
+            manifest = json.load(fh)
+        if manifest.get("scale") == scale and manifest.get("seed") == seed and all(
+            os.path.exists(entry["path"]) for entry in manifest["files"].values()
+        ):
+            return manifest["files"]
+
+    files: Dict[str, dict] = {}
+    for name, (filename, generator) in GENERATORS.items():
+        # Independent stream per document so adding a generator doesn't shift the others
+        rng = random.Random(f"{seed}:{name}")
+        data = generator(rng, SCALES[scale])
+        path = os.path.join(output_dir, filename)
+        with open(path, "wb") as fh:
+            fh.write(data)
+
+        pages = None
+        if filename.endswith(".pdf"):
+            with fitz.open(stream=data, filetype="pdf") as doc:
+                pages = doc.page_count
+        files[name] = {
+            "path": path,
+            "bytes": len(data),
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "pages": pages,
+        }
+        print(f"Generated {filename}: {len(data) / 1024:.0f} KB" + (f", {pages} pages" if pages else ""))
+
+    with open(manifest_path, "w") as fh:
+        json.dump({"scale": scale, "seed": seed, "files": files}, fh, indent=2)
+    return files
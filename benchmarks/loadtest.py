@@ -0,0 +1,381 @@
+"""
+HTTP load test for dapi:app
+Drives the real app with a weighted mix of endpoints over the synthetic corpus
+and reports throughput, latency percentiles, error rate and worker RSS over time.
+
+Targets:
+    in-process (default)  httpx ASGITransport, one event loop, like a single worker
+    --workers N           spawns `uvicorn dapi:app --workers N` on a free local port
+    --url URL             an already running server (RSS is not sampled)
+
+Examples:
+    python -m benchmarks.loadtest --duration 30 --concurrency 8
+    python -m benchmarks.loadtest --workers 1 2 4 --concurrency 16 --duration 60
+    python -m benchmarks.loadtest --mix compress=5 merge=1 metadata=10 --output /tmp/load.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.corpus import SCALES, generate_corpus
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CORPUS_DIR = os.path.join(REPO_ROOT, "benchmarks", ".corpus")
+MB = 1024 * 1024
+
+# Scenario name -> (default weight, path, [(form field, corpus input, mime type)], form data)
+SCENARIOS: Dict[str, Tuple[int, str, List[Tuple[str, str, str]], Dict[str, str]]] = {
+    "metadata": (6, "/get_pdf_metadata", [("file", "text_heavy", "application/pdf")], {}),
+    "compress_text": (4, "/compress", [("files", "text_heavy", "application/pdf")], {"compression_level": "50"}),
+    "compress_scan": (2, "/compress", [("files", "scanned", "application/pdf")], {"compression_level": "75"}),
+    "merge": (3, "/merge_pdfs", [("files", "many_small_pages", "application/pdf"), ("files", "text_heavy", "application/pdf")], {}),
+    "split": (2, "/split_by_page_count", [("file", "many_small_pages", "application/pdf")], {"pages_per_split": "25"}),
+    "extract": (2, "/extract", [("file", "text_heavy", "application/pdf")], {"pages_to_extract": "1,2,3"}),
+    "page_numbers": (2, "/add_page_numbers", [("file", "text_heavy", "application/pdf")], {}),
+    "repair": (1, "/repair", [("file", "vector_heavy", "application/pdf")], {}),
+    "flatten": (1, "/flatten_pdf", [("file", "vector_heavy", "application/pdf")], {}),
+    "blank_pages": (1, "/detect_blank_pages", [("file", "text_heavy", "application/pdf")], {}),
+    "to_images": (1, "/pdf_to_images", [("file", "scanned", "application/pdf")], {"dpi": "100", "image_format": "jpg"}),
+    "huge_page": (1, "/pdf_to_images", [("file", "huge_page", "application/pdf")], {"dpi": "72", "image_format": "jpg"}),
+    "word": (1, "/wordtopdf", [("file", "docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document")], {}),
+    "excel": (1, "/exceltopdf", [("file", "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")], {}),
+    "image": (1, "/jpegtopdf", [("file", "png", "image/png")], {}),
+}
+
+# Upload filenames for the non-PDF corpus inputs (validation checks extensions)
+EXTENSIONS = {"docx": ".docx", "xlsx": ".xlsx", "png": ".png"}
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def _rss_of(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _children_of(pid: int) -> List[int]:
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as fh:
+                # The ppid follows the parenthesised command name, which may contain spaces
+                fields = fh.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+class RssSampler:
+    """Samples the RSS of a process and its direct children in a background thread"""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[dict] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started = 0.0
+
+    def start(self) -> None:
+        self._started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            workers = {pid: _rss_of(pid) for pid in _children_of(self.pid)}
+            self.samples.append({
+                "t": round(time.monotonic() - self._started, 2),
+                "parent_mb": round(_rss_of(self.pid) / MB, 1),
+                "workers_mb": {str(pid): round(rss / MB, 1) for pid, rss in workers.items()},
+            })
+            self._stop.wait(self.interval)
+
+    def summary(self) -> dict:
+        if not self.samples:
+            return {}
+        totals = [s["parent_mb"] + sum(s["workers_mb"].values()) for s in self.samples]
+        per_worker = [rss for s in self.samples for rss in s["workers_mb"].values()]
+        return {
+            "total_mb_start": totals[0],
+            "total_mb_end": totals[-1],
+            "total_mb_max": max(totals),
+            "worker_mb_max": max(per_worker) if per_worker else None,
+        }
+
+
+def _build_mix(overrides: Optional[List[str]]) -> List[Tuple[str, int]]:
+    weights = {name: spec[0] for name, spec in SCENARIOS.items()}
+    if overrides:
+        # An explicit mix replaces the defaults: unlisted scenarios are not sent
+        weights = {}
+        for item in overrides:
+            name, _, weight = item.partition("=")
+            if name not in SCENARIOS:
+                raise SystemExit(f"Unknown scenario '{name}'. Choose from: {', '.join(SCENARIOS)}")
+            weights[name] = int(weight or 1)
+    return [(name, weight) for name, weight in weights.items() if weight > 0]
+
+
+def _load_files(corpus: Dict[str, dict]) -> Dict[str, bytes]:
+    names = {spec for _, _, uploads, _ in SCENARIOS.values() for _, spec, _ in uploads}
+    files = {}
+    for name in names:
+        with open(corpus[name]["path"], "rb") as fh:
+            files[name] = fh.read()
+    return files
+
+
+async def _virtual_user(client, user: int, mix, files, deadline: float, warmup_until: float, records: list, seed: int) -> None:
+    import httpx
+
+    rng = random.Random(f"{seed}:{user}")
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    while time.monotonic() < deadline:
+        name = rng.choices(names, weights)[0]
+        _, path, uploads, form = SCENARIOS[name]
+        multipart = [
+            (field, (spec + EXTENSIONS.get(spec, ".pdf"), files[spec], mime))
+            for field, spec, mime in uploads
+        ]
+        started = time.monotonic()
+        status, sent, received = 0, sum(len(files[spec]) for _, spec, _ in uploads), 0
+        try:
+            response = await client.post(path, data=form, files=multipart)
+            status = response.status_code
+            received = len(response.content)
+        except httpx.HTTPError:
+            status = 0
+        if started >= warmup_until:
+            records.append({
+                "scenario": name,
+                "status": status,
+                "latency": time.monotonic() - started,
+                "end": time.monotonic(),
+                "bytes_out": sent,
+                "bytes_in": received,
+            })
+
+
+async def _drive(base_url: Optional[str], concurrency: int, duration: float, warmup: float, mix, files, seed: int) -> Tuple[list, float]:
+    import httpx
+
+    timeout = httpx.Timeout(300.0)
+    clients = []
+    if base_url:
+        shared = httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=httpx.Limits(max_connections=concurrency))
+        clients = [shared] * concurrency
+    else:
+        from dapi import app
+        # A distinct client address per virtual user, as real traffic would have
+        for user in range(concurrency):
+            transport = httpx.ASGITransport(app=app, client=(f"10.0.{user // 250}.{user % 250 + 1}", 40000 + user))
+            clients.append(httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=timeout))
+
+    records: list = []
+    started = time.monotonic()
+    warmup_until = started + warmup
+    deadline = warmup_until + duration
+    try:
+        await asyncio.gather(*(
+            _virtual_user(clients[user], user, mix, files, deadline, warmup_until, records, seed)
+            for user in range(concurrency)
+        ))
+    finally:
+        for client in set(clients):
+            await client.aclose()
+    # Requests still in flight at the deadline finish late; measure over the real window
+    elapsed = max((r["end"] for r in records), default=deadline) - warmup_until
+    return records, elapsed
+
+
+def summarize(records: list, elapsed: float) -> dict:
+    """Aggregate per-scenario and overall throughput, latency and error figures"""
+    def block(rows: list) -> dict:
+        latencies = [r["latency"] * 1000 for r in rows]
+        errors = sum(1 for r in rows if r["status"] < 200 or r["status"] >= 400)
+        return {
+            "requests": len(rows),
+            "errors": errors,
+            "error_rate": round(errors / len(rows), 4) if rows else 0.0,
+            "rps": round(len(rows) / elapsed, 2) if elapsed > 0 else 0.0,
+            "mb_per_s": round(sum(r["bytes_out"] for r in rows) / MB / elapsed, 2) if elapsed > 0 else 0.0,
+            "p50_ms": round(_percentile(latencies, 50), 1),
+            "p90_ms": round(_percentile(latencies, 90), 1),
+            "p99_ms": round(_percentile(latencies, 99), 1),
+            "max_ms": round(max(latencies), 1) if latencies else 0.0,
+            "mean_ms": round(statistics.fmean(latencies), 1) if latencies else 0.0,
+            "statuses": {str(code): sum(1 for r in rows if r["status"] == code) for code in sorted({r["status"] for r in rows})},
+        }
+
+    scenarios = {}
+    for name in sorted({r["scenario"] for r in records}):
+        scenarios[name] = block([r for r in records if r["scenario"] == name])
+    return {"elapsed_s": round(elapsed, 2), "overall": block(records), "scenarios": scenarios}
+
+
+def _print_summary(label: str, summary: dict, rss: dict) -> None:
+    print(f"\n== {label} ({summary['elapsed_s']}s measured)")
+    print(f"{'scenario':<16} {'reqs':>6} {'err%':>6} {'rps':>7} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    rows = list(summary["scenarios"].items()) + [("TOTAL", summary["overall"])]
+    for name, row in rows:
+        print(f"{name:<16} {row['requests']:>6} {row['error_rate'] * 100:>5.1f}% {row['rps']:>7.2f} "
+              f"{row['p50_ms']:>7.0f}ms {row['p90_ms']:>7.0f}ms {row['p99_ms']:>7.0f}ms {row['max_ms']:>7.0f}ms")
+    non_ok = {code: n for code, n in summary["overall"]["statuses"].items() if code != "200"}
+    if non_ok:
+        print(f"Non-200 responses: {non_ok}")
+    if rss:
+        worker = f", largest worker {rss['worker_mb_max']} MB" if rss.get("worker_mb_max") is not None else ""
+        print(f"RSS: {rss['total_mb_start']} MB -> {rss['total_mb_end']} MB (max {rss['total_mb_max']} MB{worker})")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _server_env(keep_rate_limit: bool) -> Dict[str, str]:
+    env = {}
+    if not keep_rate_limit:
+        # Per-IP limits would turn the whole run into 429s from a single client address
+        env["RATE_LIMIT_ENABLED"] = "False"
+    return env
+
+
+def _start_server(workers: int, keep_rate_limit: bool) -> Tuple[subprocess.Popen, str]:
+    port = _free_port()
+    env = {**os.environ, **_server_env(keep_rate_limit)}
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "dapi:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"uvicorn exited with code {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                # Let every worker finish importing before the clock starts
+                time.sleep(1.0 + 0.5 * workers)
+                return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit("uvicorn did not start listening within 60s")
+
+
+def run_load(target: Optional[str], workers: Optional[int], args, mix, files) -> dict:
+    """Run one load test against a URL, a spawned uvicorn, or the app in-process"""
+    process = None
+    sampler = None
+    if workers:
+        process, target = _start_server(workers, args.keep_rate_limit)
+        sampler = RssSampler(process.pid, args.sample_interval)
+    elif not target:
+        os.environ.update(_server_env(args.keep_rate_limit))
+        sys.path.insert(0, REPO_ROOT)
+        sampler = RssSampler(os.getpid(), args.sample_interval)
+
+    try:
+        if sampler:
+            sampler.start()
+        # The app logs with print(); keep it out of the report
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            records, elapsed = asyncio.run(_drive(target, args.concurrency, args.duration, args.warmup, mix, files, args.seed))
+    finally:
+        if sampler:
+            sampler.stop()
+        if process:
+            process.terminate()
+            process.wait(timeout=30)
+
+    summary = summarize(records, elapsed)
+    rss = sampler.summary() if sampler else {}
+    return {
+        "target": "in-process" if not (workers or target) else (f"uvicorn --workers {workers}" if workers else target),
+        "workers": workers,
+        "concurrency": args.concurrency,
+        "summary": summary,
+        "rss": rss,
+        "rss_samples": sampler.samples if sampler else [],
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load test dapi:app with a weighted endpoint mix")
+    parser.add_argument("--url", help="Target an already running server instead of the in-process app")
+    parser.add_argument("--workers", type=int, nargs="*", help="Spawn uvicorn with each of these worker counts in turn")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="Measured seconds per run")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Seconds of load before measuring")
+    parser.add_argument("--mix", nargs="*", metavar="NAME=WEIGHT", help=f"Scenario weights (default: all). Scenarios: {', '.join(SCENARIOS)}")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small", help="Corpus size")
+    parser.add_argument("--seed", type=int, default=1234, help="Corpus and request-mix seed")
+    parser.add_argument("--corpus-dir", default=DEFAULT_CORPUS_DIR, help="Where the corpus is generated")
+    parser.add_argument("--sample-interval", type=float, default=0.5, help="RSS sampling interval in seconds")
+    parser.add_argument("--keep-rate-limit", action="store_true", help="Leave the per-IP rate limiter enabled")
+    parser.add_argument("--output", help="Write full results (including RSS timeline) as JSON")
+    args = parser.parse_args()
+
+    if args.url and args.workers:
+        parser.error("--url and --workers are mutually exclusive")
+
+    corpus = generate_corpus(os.path.join(args.corpus_dir, f"{args.scale}_{args.seed}"), scale=args.scale, seed=args.seed)
+    files = _load_files(corpus)
+    mix = _build_mix(args.mix)
+    print(f"Mix: {', '.join(f'{name}={weight}' for name, weight in mix)}")
+
+    runs = []
+    for workers in (args.workers or [None]):
+        result = run_load(args.url, workers, args, mix, files)
+        _print_summary(f"{result['target']}, concurrency {args.concurrency}", result["summary"], result["rss"])
+        runs.append(result)
+
+    if len(runs) > 1:
+        print(f"\n{'workers':>7} {'rps':>8} {'p50':>9} {'p99':>9} {'err%':>6} {'max RSS':>9}")
+        for run in runs:
+            overall = run["summary"]["overall"]
+            print(f"{run['workers']:>7} {overall['rps']:>8.2f} {overall['p50_ms']:>7.0f}ms {overall['p99_ms']:>7.0f}ms "
+                  f"{overall['error_rate'] * 100:>5.1f}% {run['rss'].get('total_mb_max', 0):>7.0f}MB")
+
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump({"mix": dict(mix), "scale": args.scale, "seed": args.seed, "runs": runs}, fh, indent=2)
+        print(f"Results written to {args.output}")
+
+    return 1 if any(run["summary"]["overall"]["requests"] == 0 for run in runs) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""
+Benchmark runner for functions.py
+Times every public operation on the synthetic corpus and reports wall time,
+throughput (pages/s and MB/s) and peak memory, optionally against a baseline.
+"""
+import contextlib
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+MB = 1024 * 1024
+
+# Libraries functions.py imports on first use; loaded up front so import time
+# is not charged to whichever case happens to run first
+LAZY_MODULES = ("PIL.Image", "numpy", "docx", "openpyxl", "reportlab.pdfgen.canvas", "reportlab.lib.utils")
+
+
+def _upload(data: bytes, filename: str = "input.pdf"):
+    from fastapi import UploadFile
+    return UploadFile(file=io.BytesIO(data), filename=filename)
+
+
+def _stream(data: bytes) -> io.BytesIO:
+    return io.BytesIO(data)
+
+
+def _encrypted(data: bytes) -> bytes:
+    import functions
+    return functions.add_password_to_pdf(io.BytesIO(data), "bench").getvalue()
+
+
+# Each case: (name, corpus inputs, page multiplier, callable taking the input bytes)
+def _cases() -> List[Tuple[str, str, int, Callable[[bytes], object]]]:
+    import functions as f
+
+    return [
+        ("compress_pdfs_api/text_heavy", "text_heavy", 1, lambda d: f.compress_pdfs_api([_upload(d)], 50, 150)),
+        ("compress_pdfs_api/scanned", "scanned", 1, lambda d: f.compress_pdfs_api([_upload(d)], 75, 150)),
+        ("compress_pdfs_api/vector_heavy", "vector_heavy", 1, lambda d: f.compress_pdfs_api([_upload(d)], 50, 150)),
+        ("merge_pdfs_api/many_small_pages", "many_small_pages", 2, lambda d: f.merge_pdfs_api([_upload(d), _upload(d)])),
+        ("split_pdfs_api/text_heavy", "text_heavy", 1, lambda d: f.split_pdfs_api(_upload(d), [(1, 1), (2, 5), (6, 10)])),
+        ("split_pdf_by_page_count/many_small_pages", "many_small_pages", 1, lambda d: f.split_pdf_by_page_count(_upload(d), 10)),
+        ("split_pdf_by_file_size/scanned", "scanned", 1, lambda d: f.split_pdf_by_file_size(_upload(d), 1.0)),
+        ("extract_pages_as_separate_files/text_heavy", "text_heavy", 1, lambda d: f.extract_pages_as_separate_files(_upload(d), list(range(1, 11)))),
+        ("remove_pages_from_pdf/text_heavy", "text_heavy", 1, lambda d: f.remove_pages_from_pdf(_stream(d), [0, 1, 2])),
+        ("extract_pages_from_pdf/text_heavy", "text_heavy", 1, lambda d: f.extract_pages_from_pdf(_stream(d), [0, 2, 4])),
+        ("repair_pdf/vector_heavy", "vector_heavy", 1, lambda d: f.repair_pdf(_stream(d))),
+        ("add_watermark/text_heavy", "text_heavy", 1, lambda d: f.add_watermark(_stream(d), "CONFIDENTIAL", "middle-center")),
+        ("add_image_watermark/text_heavy", "text_heavy+png", 1, lambda d: f.add_image_watermark(_stream(d[0]), _stream(d[1]), "middle-center")),
+        ("add_page_numbers/many_small_pages", "many_small_pages", 1, lambda d: f.add_page_numbers(_stream(d), format_string="{page} of {total}")),
+        ("detect_blank_pages/text_heavy", "text_heavy", 1, lambda d: f.detect_blank_pages(_stream(d))),
+        ("remove_blank_pages/many_small_pages", "many_small_pages", 1, lambda d: f.remove_blank_pages(_stream(d))),
+        ("pdf_to_images/scanned", "scanned", 1, lambda d: f.pdf_to_images(_stream(d), 150, "png")),
+        ("pdf_to_images/huge_page", "huge_page", 1, lambda d: f.pdf_to_images(_stream(d), 72, "jpg")),
+        ("flatten_pdf/vector_heavy", "vector_heavy", 1, lambda d: f.flatten_pdf(_stream(d))),
+        ("add_password_to_pdf/text_heavy", "text_heavy", 1, lambda d: f.add_password_to_pdf(_stream(d), "secret")),
+        ("remove_password_from_pdf/text_heavy", "text_heavy:encrypted", 1, lambda d: f.remove_password_from_pdf(_stream(d), "bench")),
+        ("get_pdf_metadata/many_small_pages", "many_small_pages", 1, lambda d: f.get_pdf_metadata(_stream(d))),
+        ("update_pdf_metadata/text_heavy", "text_heavy", 1, lambda d: f.update_pdf_metadata(_stream(d), title="Benchmark")),
+        ("is_scanned_pdf/scanned", "scanned", 1, lambda d: f.is_scanned_pdf(_stream(d))),
+        ("convert_word_to_pdf/docx", "docx", 0, lambda d: f.convert_word_to_pdf(_stream(d))),
+        ("excel_to_pdf/xlsx", "xlsx", 0, lambda d: f.excel_to_pdf(_stream(d))),
+        ("image_to_pdf/png", "png", 0, lambda d: f.image_to_pdf(_stream(d))),
+    ]
+
+
+def _load_input(spec: str, corpus: Dict[str, dict]):
+    """Resolve a case input spec ('name', 'a+b' or 'name:encrypted') to bytes"""
+    def read(name: str) -> bytes:
+        with open(corpus[name]["path"], "rb") as fh:
+            return fh.read()
+
+    if "+" in spec:
+        return tuple(read(name) for name in spec.split("+"))
+    if spec.endswith(":encrypted"):
+        return _encrypted(read(spec.split(":", 1)[0]))
+    return read(spec)
+
+
+def _current_rss() -> int:
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _reset_peak_rss() -> None:
+    """Reset the kernel's RSS high-water mark (Linux 4.0+), so setup is not counted"""
+    try:
+        with open("/proc/self/clear_refs", "w") as fh:
+            fh.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss() -> int:
+    # VmHWM belongs to this address space; ru_maxrss survives exec and may
+    # report the parent's peak in a spawned child
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux reports KB
+
+
+def _run_case_in_child(name: str, corpus: Dict[str, dict], repeats: int) -> dict:
+    """Run one case in a fresh process so peak RSS belongs to that case alone"""
+    for module in LAZY_MODULES:
+        importlib.import_module(module)
+    cases = {case[0]: case for case in _cases()}
+    _, spec, page_multiplier, func = cases[name]
+    data = _load_input(spec, corpus)
+
+    base_spec = spec.split("+")[0].split(":")[0]
+    pages = (corpus[base_spec].get("pages") or 0) * page_multiplier
+    input_bytes = sum(len(part) for part in data) if isinstance(data, tuple) else len(data)
+
+    _reset_peak_rss()
+    rss_before = _current_rss()
+    timings = []
+    error = None
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeats):
+            start = time.perf_counter()
+            try:
+                func(data)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                break
+            timings.append(time.perf_counter() - start)
+
+    if error:
+        return {"error": error}
+
+    wall = statistics.median(timings)
+    return {
+        "wall_s": round(wall, 4),
+        "wall_min_s": round(min(timings), 4),
+        "pages": pages,
+        "pages_per_s": round(pages / wall, 1) if pages and wall > 0 else None,
+        "mb_per_s": round(input_bytes / MB / wall, 2) if wall > 0 else None,
+        "peak_rss_mb": round(max(0, _peak_rss() - rss_before) / MB, 1),
+        "repeats": repeats,
+    }
+
+
+def run_benchmarks(corpus: Dict[str, dict], repeats: int = 3, only: Optional[List[str]] = None) -> Dict[str, dict]:
+    """
+    Run every case (or those whose name contains one of `only`).
+
+    Returns:
+        Mapping case name -> result dict
+    """
+    context = multiprocessing.get_context("spawn")
+    results: Dict[str, dict] = {}
+    for name, _, _, _ in _cases():
+        if only and not any(pattern in name for pattern in only):
+            continue
+        with context.Pool(1) as pool:
+            result = pool.apply(_run_case_in_child, (name, corpus, repeats))
+        results[name] = result
+        if "error" in result:
+            print(f"  {name:<48} ERROR {result['error']}")
+        else:
+            pages_rate = f"{result['pages_per_s']:>9.1f} p/s" if result["pages_per_s"] else " " * 13
+            print(f"  {name:<48} {result['wall_s']:>8.3f}s {pages_rate} {result['mb_per_s']:>8.2f} MB/s {result['peak_rss_mb']:>8.1f} MB")
+    return results
+
+
+def environment_info(scale: str, seed: int) -> dict:
+    import fitz
+    return {
+        "scale": scale,
+        "seed": seed,
+        "python": platform.python_version(),
+        "pymupdf": getattr(fitz, "VersionBind", "unknown"),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def save_results(path: str, meta: dict, results: Dict[str, dict]) -> None:
+    with open(path, "w") as fh:
+        json.dump({"meta": meta, "results": results}, fh, indent=2)
+
+
+def compare_to_baseline(results: Dict[str, dict], baseline_path: str, meta: dict, tolerance: float = 0.10) -> List[str]:
+    """
+    Print a comparison with a saved baseline.
+
+    Args:
+        results: Current results
+        baseline_path: JSON file written by save_results
+        meta: Current environment info (used to warn about mismatched runs)
+        tolerance: Relative wall-time change treated as noise (0.10 = 10%)
+
+    Returns:
+        Names of cases that regressed beyond the tolerance
+    """
+    with open(baseline_path) as fh:
+        baseline = json.load(fh)
+
+    base_meta = baseline.get("meta", {})
+    for key in ("scale", "seed", "pymupdf", "cpu_count"):
+        if base_meta.get(key) != meta.get(key):
+            print(f"Warning: baseline {key}={base_meta.get(key)} differs from current {key}={meta.get(key)}")
+
+    regressions = []
+    print(f"\n{'case':<48} {'base':>9} {'now':>9} {'change':>8} {'mem now':>9}")
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous or "error" in previous or "error" in current:
+            print(f"{name:<48} {'-':>9} {current.get('wall_s', '-'):>9}")
+            continue
+        change = (current["wall_s"] - previous["wall_s"]) / previous["wall_s"] if previous["wall_s"] else 0.0
+        verdict = ""
+        if change > tolerance:
+            verdict = "  REGRESSION"
+            regressions.append(name)
+        elif change < -tolerance:
+            verdict = "  improved"
+        print(f"{name:<48} {previous['wall_s']:>8.3f}s {current['wall_s']:>8.3f}s {change * 100:>+7.1f}% "
+              f"{current['peak_rss_mb']:>7.1f}MB{verdict}")
+    return regressions
@@ -0,0 +1,168 @@
+"""
+Content-addressed blob store for PDF Tool API
+Keeps ingested uploads by SHA-256 under SPOOL_DIR so clients that send the
+same document again can pass its hash instead of the bytes. Blobs are hard
+links to the spool files they came from (no copy), the store is kept under
+BLOB_STORE_MAX_MB by evicting the least recently used blobs.
+
+Blobs belong to the client that uploaded them (API key, else IP, as in the
+scheduler): a hash only finds documents its own client has sent.
+"""
+import hashlib
+import os
+import re
+import shutil
+import uuid
+from contextvars import ContextVar
+from typing import Optional, Tuple
+
+from config import config
+from metrics import metrics
+from spool import upload_spool
+
+MB = 1024 * 1024
+
+_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+
+_owner: ContextVar[Optional[str]] = ContextVar("pydf_blob_owner", default=None)
+
+
+def set_owner(owner: str) -> None:
+    """Set the client whose blobs the current request stores and reads"""
+    _owner.set(owner)
+
+
+class BlobStore:
+    """
+    Blobs are files named by the hex SHA-256 of their owner and content
+    hash; the mtime is the last use and drives LRU eviction, so every worker
+    sees the same order.
+    """
+
+    def __init__(self, directory: str, budget_bytes: int):
+        self.directory = directory
+        self.budget_bytes = budget_bytes
+        self._ready = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget_bytes > 0
+
+    def _path(self, sha256: str) -> Optional[str]:
+        sha256 = (sha256 or "").lower()
+        owner = _owner.get()
+        if not _SHA256.match(sha256) or owner is None:
+            return None
+        name = hashlib.sha256(f"{owner}\0{sha256}".encode()).hexdigest()
+        return os.path.join(self.directory, name)
+
+    def _ensure_directory(self) -> None:
+        if not self._ready:
+            os.makedirs(self.directory, exist_ok=True)
+            self._ready = True
+
+    def lookup(self, sha256: str) -> Optional[int]:
+        """
+        Check whether a blob is stored and mark it as used.
+
+        Returns:
+            The blob's size in bytes, or None when it is not stored
+        """
+        path = self._path(sha256)
+        if not self.enabled or path is None:
+            return None
+        try:
+            os.utime(path)
+            size = os.stat(path).st_size
+        except FileNotFoundError:
+            metrics.inc("pydf_blob_store_lookups_total", labels={"result": "miss"})
+            return None
+        metrics.inc("pydf_blob_store_lookups_total", labels={"result": "hit"})
+        return size
+
+    def add(self, path: str, sha256: str) -> None:
+        """
+        Store the file at path under its hash, then evict down to the budget.
+
+        The file is hard-linked (copied only across filesystems), so adding a
+        spool file costs no I/O and the blob survives the spool's cleanup.
+        """
+        target = self._path(sha256)
+        if not self.enabled or target is None:
+            return
+        if os.path.exists(target):
+            os.utime(target)
+            return
+        self._ensure_directory()
+        staging = f"{target}.{uuid.uuid4().hex}.tmp"
+        try:
+            try:
+                os.link(path, staging)
+            except OSError:
+                shutil.copyfile(path, staging)
+            # Atomic: a concurrent add of the same content just replaces an identical file
+            os.replace(staging, target)
+        except OSError as e:
+            print(f"Warning: Could not store blob {sha256[:12]}: {e}")
+            upload_spool.discard(staging)
+            return
+        self.evict()
+
+    def checkout(self, sha256: str) -> Optional[Tuple[str, int]]:
+        """
+        Link a blob into the request's spool, where eviction cannot remove it
+        while the request uses it.
+
+        Returns:
+            (spool path, size) or None when the blob is not stored
+        """
+        source = self._path(sha256)
+        if not self.enabled or source is None:
+            return None
+        upload_spool.ensure_directory()
+        path = os.path.join(upload_spool.directory, f"{os.getpid()}_{uuid.uuid4().hex}.blob")
+        try:
+            os.link(source, path)
+            os.utime(source)
+        except FileNotFoundError:
+            metrics.inc("pydf_blob_store_lookups_total", labels={"result": "miss"})
+            return None
+        upload_spool.track(path)
+        metrics.inc("pydf_blob_store_lookups_total", labels={"result": "hit"})
+        return path, os.stat(path).st_size
+
+    def evict(self) -> int:
+        """Delete least recently used blobs until the store fits its budget"""
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.is_file() and _SHA256.match(entry.name)]
+        except FileNotFoundError:
+            return 0
+        blobs = []
+        for entry in entries:
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            blobs.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in blobs)
+        removed = 0
+        for _, size, path in sorted(blobs):
+            if total <= self.budget_bytes:
+                break
+            upload_spool.discard(path)
+            total -= size
+            removed += 1
+        if removed:
+            metrics.inc("pydf_blob_store_evictions_total", removed)
+        return removed
+
+
+# Create a singleton instance
+blob_store = BlobStore(
+    directory=os.path.join(config.SPOOL_DIR, "blobs"),
+    budget_bytes=config.BLOB_STORE_MAX_MB * MB,
+)
+
+metrics.describe("pydf_blob_store_lookups_total", "counter", "Blob store lookups by result (hit/miss)")
+metrics.describe("pydf_blob_store_evictions_total", "counter", "Blobs evicted to keep the store within its budget")
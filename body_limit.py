@@ -0,0 +1,146 @@
+"""
+Request body limits for PDF Tool API
+Rejects oversized uploads with 413 from the Content-Length header, or while
+the body is still streaming in, instead of after python-multipart has
+buffered the whole upload to disk. Limits are set per route.
+"""
+import json
+from typing import Dict
+
+from fastapi import HTTPException
+
+from config import config
+from metrics import metrics
+
+KB = 1024
+MB = 1024 * 1024
+
+# Responses to rejected requests close the connection so the rest of the body is never read
+CLOSE_HEADERS = {"Connection": "close"}
+
+
+def default_route_limits(max_body_size: int) -> Dict[str, int]:
+    """
+    Built-in limits in bytes for routes that differ from MAX_BODY_SIZE.
+
+    Routes that accept several files get room for a few full-size uploads;
+    routes that only read a little of the document get less.
+    """
+    multi_file = max_body_size * 4
+    return {
+        "/send-email": 64 * KB,
+        "/get_pdf_metadata": min(max_body_size, 25 * MB),
+        "/merge_pdfs": multi_file,
+        "/compress": multi_file,
+        "/rotatepdf": multi_file,
+        "/add_watermark": multi_file,
+    }
+
+
+class BodyTooLarge(HTTPException):
+    """Raised from receive() once a streamed body passes the route's limit"""
+
+    def __init__(self, limit: int):
+        super().__init__(
+            status_code=413,
+            detail=f"Request body exceeds maximum allowed size ({limit / MB:.1f}MB) for this endpoint",
+            headers=CLOSE_HEADERS,
+        )
+
+
+class BodyLimiter:
+    """Per-route body size limits (bytes); unknown routes get the default"""
+
+    def __init__(self, default_limit: int, route_limits: Dict[str, int]):
+        self.default_limit = default_limit
+        self.route_limits = dict(route_limits)
+
+    def limit_for(self, path: str) -> int:
+        return self.route_limits.get(path, self.default_limit)
+
+
+class BodyLimitMiddleware:
+    """
+    ASGI middleware that enforces the route's body limit.
+
+    A Content-Length over the limit is answered with 413 before any of the
+    body is read. Otherwise the bytes are counted as they arrive (this also
+    covers chunked uploads without a Content-Length) and the request fails
+    with 413 as soon as the count passes the limit. Either way the response
+    carries Connection: close, so the server drops the connection instead of
+    draining the rest of the upload.
+    """
+
+    def __init__(self, app, limiter: BodyLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope.get("path", "")
+        limit = self.limiter.limit_for(path)
+        headers = dict(scope.get("headers", []))
+        try:
+            declared = int(headers.get(b"content-length", b""))
+        except ValueError:
+            declared = None
+
+        if declared is not None and declared > limit:
+            metrics.inc("pydf_body_limit_rejected_total", labels={"route": path, "check": "content_length"})
+            await self._reject(send, BodyTooLarge(limit))
+            return
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    metrics.inc("pydf_body_limit_rejected_total", labels={"route": path, "check": "streamed"})
+                    raise BodyTooLarge(limit)
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except BodyTooLarge as e:
+            # FastAPI answers it while parsing the form; this covers code that reads the body itself
+            if response_started:
+                raise
+            await self._reject(send, e)
+
+    async def _reject(self, send, error: BodyTooLarge) -> None:
+        body = json.dumps({"detail": error.detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": error.status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def _route_limits() -> Dict[str, int]:
+    limits = default_route_limits(config.MAX_BODY_SIZE)
+    limits.update({route: int(limit_mb * MB) for route, limit_mb in config.BODY_LIMITS_MB.items()})
+    return limits
+
+
+# Create a singleton instance
+body_limiter = BodyLimiter(config.MAX_BODY_SIZE, _route_limits())
+
+metrics.describe("pydf_body_limit_rejected_total", "counter", "Requests rejected with 413 by the body size limit")
@@ -0,0 +1,182 @@
+"""
+Cooperative cancellation for PDF Tool API
+Long operations run in a thread (once the scheduler gives them a slot) while
+the request watches for the client to disconnect; page loops in functions.py
+call check_cancelled() and stop at the next page once the client is gone,
+instead of finishing a result nobody reads.
+"""
+import asyncio
+import threading
+import time
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Iterable, List, Optional, Sequence, TypeVar
+
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+
+from config import config
+from metrics import metrics
+from profiling import operation_profiles, run_profiled
+from scheduler import scheduler
+from timing import current_timings
+from workers import worker_pool, time_limits
+
+T = TypeVar("T")
+
+# Status logged for requests abandoned by the client (nginx convention)
+CLIENT_CLOSED_REQUEST = 499
+
+
+class OperationCancelled(HTTPException):
+    """Raised inside an operation whose client has disconnected"""
+
+    def __init__(self):
+        super().__init__(status_code=CLIENT_CLOSED_REQUEST, detail="Client disconnected, operation cancelled")
+
+
+class CancelToken:
+    """Set once by the request, read by the operation's thread"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self) -> None:
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+
+_current: ContextVar[Optional[CancelToken]] = ContextVar("pydf_cancel_token", default=None)
+
+
+def check_cancelled() -> None:
+    """
+    Hook for page loops: raise OperationCancelled if the current request's
+    client has gone away. A no-op outside run_cancellable.
+    """
+    token = _current.get()
+    if token is not None and token.cancelled:
+        raise OperationCancelled()
+
+
+async def run_cancellable(request: Request, func: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Run func in a worker process (or a thread when worker processes are
+    disabled), cancelling it if the client disconnects. With the scheduler
+    enabled, waits for a slot first (and gives up waiting if the client
+    disconnects).
+
+    Args:
+        request: The request the operation serves
+        func: Synchronous operation (calls check_cancelled() between pages)
+
+    Returns:
+        The operation's result
+
+    Raises:
+        OperationCancelled: The client disconnected before the operation finished
+        OperationTimedOut: The operation ran past its wall-clock timeout
+        OperationTooExpensive: The operation used up its CPU time budget
+    """
+    if not scheduler.enabled:
+        return await _run(request, func, *args, **kwargs)
+
+    job = await scheduler.submit(request, (*args, *kwargs.values()))
+    try:
+        while not job.ready.done():
+            await asyncio.wait({job.ready}, timeout=config.CANCEL_POLL_INTERVAL)
+            if not job.ready.done() and await request.is_disconnected():
+                metrics.inc("pydf_operations_cancelled_total", labels={"route": request.url.path})
+                print(f"Client disconnected while queued, dropping {request.url.path}")
+                raise OperationCancelled()
+        timings = current_timings()
+        if timings is not None:
+            timings.add("schedule", time.monotonic() - job.enqueued)
+        return await _run(request, func, *args, **kwargs)
+    finally:
+        scheduler.release(job)
+
+
+async def gather_cancellable(request: Request, func: Callable[..., T],
+                             arg_lists: Iterable[Sequence], **kwargs) -> List[T]:
+    """
+    Run func once per argument tuple, concurrently, each call taking its own
+    scheduler slot and worker.
+
+    Args:
+        request: The request the operations serve
+        func: Synchronous operation
+        arg_lists: Positional arguments of each call
+        **kwargs: Keyword arguments shared by all calls
+
+    Returns:
+        The results, in the order of arg_lists
+
+    Raises:
+        The first error of any call; the other calls are cancelled
+    """
+    return await gather_or_cancel([run_cancellable(request, func, *args, **kwargs) for args in arg_lists])
+
+
+async def gather_or_cancel(coroutines: Iterable[Awaitable[T]]) -> List[T]:
+    """
+    Await coroutines concurrently, like asyncio.gather, but cancel the others
+    (and wait for them to stop) as soon as one fails.
+
+    Returns:
+        The results, in the order of coroutines
+    """
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def _run(request: Request, func: Callable[..., T], *args, **kwargs) -> T:
+    profiles = operation_profiles()
+    if profiles is not None:
+        # The request's profiler only sees the event loop: profile the operation where it runs
+        func, args = run_profiled, (func,) + tuple(args)
+    token = CancelToken()
+    reset = _current.set(token)
+    try:
+        # The task (and the thread it starts) run with a copy of this context, token included
+        if worker_pool.enabled:
+            # The thread waits on the worker and kills it once check_cancelled() raises
+            wall_limit, cpu_limit = time_limits(request.url.path)
+            work = asyncio.ensure_future(run_in_threadpool(
+                worker_pool.run, func, args, kwargs, wall_limit, cpu_limit, check_cancelled, request.url.path
+            ))
+        else:
+            work = asyncio.ensure_future(run_in_threadpool(func, *args, **kwargs))
+    finally:
+        _current.reset(reset)
+
+    while True:
+        try:
+            done, _ = await asyncio.wait({work}, timeout=config.CANCEL_POLL_INTERVAL)
+        except asyncio.CancelledError:
+            # The awaiting task was cancelled (a sibling in gather_cancellable failed): stop the work too
+            token.cancel()
+            # Nobody awaits the work any more: retrieve its outcome so asyncio does not log it
+            work.add_done_callback(lambda task: task.cancelled() or task.exception())
+            raise
+        if done:
+            if profiles is None:
+                return work.result()
+            result, stats = work.result()
+            profiles.append(stats)
+            return result
+        if not token.cancelled and await request.is_disconnected():
+            token.cancel()
+            metrics.inc("pydf_operations_cancelled_total", labels={"route": request.url.path})
+            print(f"Client disconnected, cancelling {request.url.path}")
+
+
+metrics.describe("pydf_operations_cancelled_total", "counter", "Operations stopped because the client disconnected")
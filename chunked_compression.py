@@ -0,0 +1,67 @@
+"""
+Chunked compression for PDF Tool API
+A single large document is compressed by several worker processes at once:
+its unique images and its pages are split into chunks, each worker re-encodes
+one chunk of images and cleans one range of pages, and the results are written
+back into the document, which is saved once.
+"""
+import io
+from typing import Dict, Optional, Tuple
+
+from fastapi import Request
+
+from cancellation import gather_cancellable, run_cancellable
+from config import config
+from functions import (PdfSource, apply_compression_chunks, compress_chunk, compress_pdf_with_report,
+                       plan_compression_chunks)
+from metrics import metrics
+from workers import worker_pool
+
+
+def chunk_count() -> int:
+    """Workers a single document is split across (1 = no chunking)"""
+    if not worker_pool.enabled or config.COMPRESS_CHUNKED_MIN_PAGES <= 0:
+        return 1
+    return config.COMPRESS_CHUNKS or worker_pool.size
+
+
+async def compress_pdf_chunked(request: Request, pdf_file: PdfSource, compression_level: int = 50,
+                               target_dpi: int = 150, measure: bool = False,
+                               **structure) -> Tuple[io.BytesIO, Optional[Dict[str, int]]]:
+    """
+    Compress one PDF across the worker pool; small documents (fewer than
+    COMPRESS_CHUNKED_MIN_PAGES pages) are compressed by a single worker.
+
+    Args:
+        request: The request the compression serves
+        pdf_file: PDF to compress
+        compression_level: Compression level from 1-100 (higher = more compression)
+        target_dpi: Target DPI for images (72-300)
+        measure: Measure the bytes each step saves (see functions.compress_pdf_with_report)
+        **structure: object_streams, subset_fonts and remove_metadata (see functions._save_compressed)
+
+    Returns:
+        (compressed PDF as a BytesIO object or a spooled equivalent, bytes saved per step or None)
+    """
+    chunks = chunk_count()
+    plan = None
+    if chunks > 1:
+        plan = await run_cancellable(request, plan_compression_chunks, pdf_file, chunks,
+                                     config.COMPRESS_CHUNKED_MIN_PAGES)
+    if plan is None:
+        return await run_cancellable(request, compress_pdf_with_report, pdf_file, compression_level, target_dpi,
+                                     measure=measure, **structure)
+
+    image_chunks, page_chunks = plan
+    print(f"Compressing {getattr(pdf_file, 'filename', 'document')} in {chunks} chunks")
+    metrics.inc("pydf_compress_chunked_total")
+    results = await gather_cancellable(
+        request, compress_chunk,
+        [(pdf_file, xrefs, pages, compression_level, target_dpi)
+         for xrefs, pages in zip(image_chunks, page_chunks)]
+    )
+    return await run_cancellable(request, apply_compression_chunks, pdf_file, results, compression_level,
+                                 measure, **structure)
+
+
+metrics.describe("pydf_compress_chunked_total", "counter", "Documents compressed in chunks across worker processes")
@@ -3,7 +3,8 @@ Configuration management for PDF Tool API
 Loads all configuration from environment variables
 """
 import os
-from typing import List
+import tempfile
+from typing import Dict, List, Tuple
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -31,10 +32,136 @@ class Config:
         "application/pdf,image/jpeg,image/png,application/vnd.openxmlformats-officedocument.wordprocessingml.document"
     ).split(",")
     
+    # Request Body Limits (enforced while the body streams in; per-route overrides in MB)
+    BODY_LIMIT_ENABLED: bool = os.getenv("BODY_LIMIT_ENABLED", "True").lower() == "true"
+    MAX_BODY_SIZE: int = int(os.getenv("MAX_BODY_SIZE", str(MAX_FILE_SIZE + 1024 * 1024)))  # one file + form overhead
+    BODY_LIMITS_MB: Dict[str, float] = {
+        route.strip(): float(limit)
+        for route, _, limit in (item.partition("=") for item in os.getenv("BODY_LIMITS", "").split(","))
+        if route.strip()
+    }
+
+    # Upload Ingestion (uploads are hashed and spooled once; files live for one request)
+    SPOOL_DIR: str = os.getenv("SPOOL_DIR", os.path.join(tempfile.gettempdir(), "pydf_spool"))
+    SPOOL_MAX_AGE: int = int(os.getenv("SPOOL_MAX_AGE", "3600"))  # seconds before leftovers are swept
+    INGEST_CHUNK_SIZE: int = int(os.getenv("INGEST_CHUNK_SIZE", str(1024 * 1024)))  # bytes per read
+    BLOB_STORE_MAX_MB: int = int(os.getenv("BLOB_STORE_MAX_MB", "0"))  # uploads kept by SHA-256 per client; 0 = off
+
+    # Resumable Uploads (chunks written in place; completed uploads usable by id until TTL)
+    RESUMABLE_UPLOAD_DIR: str = os.getenv(
+        "RESUMABLE_UPLOAD_DIR",
+        os.path.join(tempfile.gettempdir(), "pydf_uploads")
+    )
+    RESUMABLE_UPLOAD_TTL: int = int(os.getenv("RESUMABLE_UPLOAD_TTL", "86400"))  # seconds since last use
+    RESUMABLE_CHUNK_SIZE: int = int(os.getenv("RESUMABLE_CHUNK_SIZE", str(8 * 1024 * 1024)))  # suggested to clients
+
+    # Cancellation (long operations stop at the next page once the client disconnects)
+    CANCEL_POLL_INTERVAL: float = float(os.getenv("CANCEL_POLL_INTERVAL", "0.25"))  # seconds between checks
+
+    # Scheduling (slots for long operations; waiting jobs ordered shortest-first, fair per client)
+    SCHEDULER_ENABLED: bool = os.getenv("SCHEDULER_ENABLED", "True").lower() == "true"
+    SCHEDULER_WORKERS: int = int(os.getenv("SCHEDULER_WORKERS", "0"))  # per process; 0 = CPUs / SERVER_WORKERS
+    SCHEDULER_CLIENT_HEADER: str = os.getenv("SCHEDULER_CLIENT_HEADER", "X-API-Key")  # else the client IP
+
+    # Worker Processes (operations run in killable processes with per-route time limits)
+    WORKER_PROCESSES_ENABLED: bool = os.getenv("WORKER_PROCESSES_ENABLED", "True").lower() == "true"
+    WORKER_START_METHOD: str = os.getenv("WORKER_START_METHOD", "forkserver")  # forkserver, spawn or fork
+    WORKER_PROCESS_MEMORY_MB: int = int(os.getenv("WORKER_PROCESS_MEMORY_MB", "256"))  # expected per-process peak
+    WORKER_PROCESS_BASELINE_MB: int = int(os.getenv("WORKER_PROCESS_BASELINE_MB", "64"))  # idle process, reserved per pool slot
+    OPERATION_WALL_TIMEOUT: float = float(os.getenv("OPERATION_WALL_TIMEOUT", "300"))  # seconds; 504 after
+    OPERATION_CPU_LIMIT: float = float(os.getenv("OPERATION_CPU_LIMIT", "120"))  # CPU seconds; 422 after
+    WORKER_SPOOL_MIN_BYTES: int = int(os.getenv("WORKER_SPOOL_MIN_BYTES", str(64 * 1024)))  # smaller buffers are pickled
+    COMPRESS_CHUNKED_MIN_PAGES: int = int(os.getenv("COMPRESS_CHUNKED_MIN_PAGES", "100"))  # 0 = never split a file
+    COMPRESS_CHUNKS: int = int(os.getenv("COMPRESS_CHUNKS", "0"))  # workers per large file; 0 = pool size
+    # Structure-level compression defaults (each can be overridden per /compress request)
+    COMPRESS_OBJECT_STREAMS: bool = os.getenv("COMPRESS_OBJECT_STREAMS", "True").lower() == "true"
+    COMPRESS_SUBSET_FONTS: bool = os.getenv("COMPRESS_SUBSET_FONTS", "True").lower() == "true"
+    COMPRESS_REMOVE_METADATA: bool = os.getenv("COMPRESS_REMOVE_METADATA", "False").lower() == "true"
+    COMPRESS_DETECT_SCANS: bool = os.getenv("COMPRESS_DETECT_SCANS", "True").lower() == "true"  # 1-bit/gray scans
+    COMPRESS_TARGET_PROBE_IMAGES: int = int(os.getenv("COMPRESS_TARGET_PROBE_IMAGES", "8"))  # images sampled per probe
+    COMPRESS_TARGET_MAX_PASSES: int = int(os.getenv("COMPRESS_TARGET_MAX_PASSES", "3"))  # full compressions per target
+    OPERATION_TIME_LIMITS: Dict[str, Tuple[float, float]] = {
+        route.strip(): (float(limits.partition(":")[0]), float(limits.partition(":")[2] or 0))
+        for route, _, limits in (item.partition("=") for item in os.getenv("OPERATION_TIME_LIMITS", "").split(","))
+        if route.strip()
+    }
+
+    # Progress Streaming (Accept: text/event-stream or application/x-ndjson, or ?progress=sse|ndjson)
+    PROGRESS_STREAMING_ENABLED: bool = os.getenv("PROGRESS_STREAMING_ENABLED", "True").lower() == "true"
+    PROGRESS_MIN_INTERVAL: float = float(os.getenv("PROGRESS_MIN_INTERVAL", "0.1"))  # seconds between page events
+
+    # Result Files (results are sent from disk; interrupted downloads resume with Range)
+    RESULT_DIR: str = os.getenv("RESULT_DIR", os.path.join(tempfile.gettempdir(), "pydf_results"))
+    RESULT_TTL: int = int(os.getenv("RESULT_TTL", "900"))  # seconds an unfinished download can resume
+
     # Rate Limiting Configuration
     RATE_LIMIT_ENABLED: bool = os.getenv("RATE_LIMIT_ENABLED", "True").lower() == "true"
     RATE_LIMIT_PER_MINUTE: int = int(os.getenv("RATE_LIMIT_PER_MINUTE", "30"))
-    
+    # "cost": work-unit buckets shared by all workers; "flat": RATE_LIMIT_PER_MINUTE per worker
+    RATE_LIMIT_STRATEGY: str = os.getenv("RATE_LIMIT_STRATEGY", "cost").lower()
+    RATE_LIMIT_UNITS_PER_MINUTE: float = float(os.getenv("RATE_LIMIT_UNITS_PER_MINUTE", "600"))
+    RATE_LIMIT_BURST_UNITS: float = float(os.getenv("RATE_LIMIT_BURST_UNITS", "1200"))
+    RATE_LIMIT_REQUEST_UNITS: float = float(os.getenv("RATE_LIMIT_REQUEST_UNITS", "1"))  # per request
+    RATE_LIMIT_UNITS_PER_MB: float = float(os.getenv("RATE_LIMIT_UNITS_PER_MB", "2"))  # per uploaded MB
+    RATE_LIMIT_DB_PATH: str = os.getenv(
+        "RATE_LIMIT_DB_PATH",
+        os.path.join(tempfile.gettempdir(), "pydf_rate_limit.sqlite3")
+    )
+
+    # Metrics Configuration
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "True").lower() == "true"
+    METRICS_DIR: str = os.getenv(
+        "METRICS_DIR",
+        os.path.join(tempfile.gettempdir(), "pydf_metrics")
+    )
+    METRICS_FLUSH_INTERVAL: float = float(os.getenv("METRICS_FLUSH_INTERVAL", "1.0"))  # seconds
+
+    # Request Timing Configuration
+    SERVER_TIMING_ENABLED: bool = os.getenv("SERVER_TIMING_ENABLED", "True").lower() == "true"
+    TIMING_LOG_ENABLED: bool = os.getenv("TIMING_LOG_ENABLED", "False").lower() == "true"
+
+    # Profiling Configuration (requests opt in with an X-Profile-Token header)
+    PROFILING_ENABLED: bool = os.getenv("PROFILING_ENABLED", "False").lower() == "true"
+    PROFILING_TOKEN: str = os.getenv("PROFILING_TOKEN", "")
+    PROFILING_DIR: str = os.getenv(
+        "PROFILING_DIR",
+        os.path.join(tempfile.gettempdir(), "pydf_profiles")
+    )
+    PROFILING_MAX_FILES: int = int(os.getenv("PROFILING_MAX_FILES", "20"))  # profiles kept
+
+    # Memory Admission Control (budget shared by all workers; 0 = 60% of container memory)
+    MEMORY_BUDGET_ENABLED: bool = os.getenv("MEMORY_BUDGET_ENABLED", "True").lower() == "true"
+    MEMORY_BUDGET_MB: int = int(os.getenv("MEMORY_BUDGET_MB", "0"))
+    MEMORY_QUEUE_LIMIT: int = int(os.getenv("MEMORY_QUEUE_LIMIT", "16"))  # waiting requests per worker
+    MEMORY_QUEUE_TIMEOUT: float = float(os.getenv("MEMORY_QUEUE_TIMEOUT", "30"))  # seconds
+    MEMORY_RETRY_AFTER: int = int(os.getenv("MEMORY_RETRY_AFTER", "5"))  # seconds, sent with 503
+    MEMORY_LEDGER_PATH: str = os.getenv(
+        "MEMORY_LEDGER_PATH",
+        os.path.join(tempfile.gettempdir(), "pydf_memory_ledger.json")
+    )
+
+    # Startup Import Report (heavy conversion libraries are imported on first use)
+    IMPORT_TIMING_ENABLED: bool = os.getenv("IMPORT_TIMING_ENABLED", "True").lower() == "true"
+    IMPORT_REPORT_TOP: int = int(os.getenv("IMPORT_REPORT_TOP", "10"))  # modules listed at startup
+    IMPORT_REPORT_MIN_MS: float = float(os.getenv("IMPORT_REPORT_MIN_MS", "5"))  # hide faster imports
+
+    # Server Configuration (python server.py: preloaded app, forked workers)
+    SERVER_HOST: str = os.getenv("SERVER_HOST", "0.0.0.0")
+    SERVER_PORT: int = int(os.getenv("SERVER_PORT", "8001"))
+    SERVER_WORKERS: int = int(os.getenv("SERVER_WORKERS", "0"))  # 0 = sized from CPUs and memory
+    SERVER_WORKER_MEMORY_MB: int = int(os.getenv("SERVER_WORKER_MEMORY_MB", "512"))  # expected per-worker peak
+    SERVER_MAX_REQUESTS: int = int(os.getenv("SERVER_MAX_REQUESTS", "1000"))  # 0 = never recycle
+    SERVER_MAX_REQUESTS_JITTER: int = int(os.getenv("SERVER_MAX_REQUESTS_JITTER", "100"))
+    SERVER_MAX_WORKER_RSS_MB: int = int(os.getenv("SERVER_MAX_WORKER_RSS_MB", "0"))  # 0 = no RSS limit
+    SERVER_GRACEFUL_TIMEOUT: int = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30"))  # seconds
+    SERVER_KEEPALIVE_TIMEOUT: int = int(os.getenv("SERVER_KEEPALIVE_TIMEOUT", "5"))  # seconds
+    SERVER_BACKLOG: int = int(os.getenv("SERVER_BACKLOG", "2048"))
+    SERVER_LOG_LEVEL: str = os.getenv("SERVER_LOG_LEVEL", "info")
+    SERVER_ACCESS_LOG: bool = os.getenv("SERVER_ACCESS_LOG", "True").lower() == "true"
+    SERVER_PRELOAD_MODULES: List[str] = [
+        name.strip() for name in os.getenv("SERVER_PRELOAD_MODULES", "").split(",") if name.strip()
+    ]
+
     # Email Configuration (existing)
     SMTP_SERVER: str = os.getenv("SMTP_SERVER", "smtp.gmail.com")
     SMTP_PORT: int = int(os.getenv("SMTP_PORT", "465"))
@@ -56,9 +183,93 @@ class Config:
         if cls.MAX_FILE_SIZE <= 0:
             errors.append("MAX_FILE_SIZE must be greater than 0")
         
+        # Validate body limits
+        if cls.MAX_BODY_SIZE <= 0:
+            errors.append("MAX_BODY_SIZE must be greater than 0")
+        if any(limit <= 0 for limit in cls.BODY_LIMITS_MB.values()):
+            errors.append("BODY_LIMITS entries must be greater than 0")
+
+        # Validate ingestion settings
+        if cls.INGEST_CHUNK_SIZE <= 0:
+            errors.append("INGEST_CHUNK_SIZE must be greater than 0")
+        if cls.BLOB_STORE_MAX_MB < 0:
+            errors.append("BLOB_STORE_MAX_MB must not be negative")
+
+        # Validate resumable upload settings
+        if cls.RESUMABLE_UPLOAD_TTL <= 0 or cls.RESUMABLE_CHUNK_SIZE <= 0:
+            errors.append("RESUMABLE_UPLOAD_TTL and RESUMABLE_CHUNK_SIZE must be greater than 0")
+
+        # Validate cancellation settings
+        if cls.CANCEL_POLL_INTERVAL <= 0:
+            errors.append("CANCEL_POLL_INTERVAL must be greater than 0")
+
+        # Validate scheduler settings
+        if cls.SCHEDULER_WORKERS < 0:
+            errors.append("SCHEDULER_WORKERS must not be negative")
+
+        # Validate worker settings
+        if cls.WORKER_START_METHOD not in ("forkserver", "spawn", "fork"):
+            errors.append("WORKER_START_METHOD must be forkserver, spawn or fork")
+        if cls.OPERATION_WALL_TIMEOUT < 0 or cls.OPERATION_CPU_LIMIT < 0:
+            errors.append("OPERATION_WALL_TIMEOUT and OPERATION_CPU_LIMIT must not be negative")
+        if cls.COMPRESS_CHUNKED_MIN_PAGES < 0 or cls.COMPRESS_CHUNKS < 0:
+            errors.append("COMPRESS_CHUNKED_MIN_PAGES and COMPRESS_CHUNKS must not be negative")
+        if cls.COMPRESS_TARGET_PROBE_IMAGES < 0 or cls.COMPRESS_TARGET_MAX_PASSES < 1:
+            errors.append("COMPRESS_TARGET_PROBE_IMAGES must not be negative and COMPRESS_TARGET_MAX_PASSES must be at least 1")
+        if cls.WORKER_SPOOL_MIN_BYTES < 0:
+            errors.append("WORKER_SPOOL_MIN_BYTES must not be negative")
+        if any(wall < 0 or cpu < 0 for wall, cpu in cls.OPERATION_TIME_LIMITS.values()):
+            errors.append("OPERATION_TIME_LIMITS must not be negative")
+
+        # Validate progress settings
+        if cls.PROGRESS_MIN_INTERVAL < 0:
+            errors.append("PROGRESS_MIN_INTERVAL must not be negative")
+
+        # Validate result settings
+        if cls.RESULT_TTL <= 0:
+            errors.append("RESULT_TTL must be greater than 0")
+
         # Validate rate limit
         if cls.RATE_LIMIT_ENABLED and cls.RATE_LIMIT_PER_MINUTE <= 0:
             errors.append("RATE_LIMIT_PER_MINUTE must be greater than 0")
+        if cls.RATE_LIMIT_STRATEGY not in ("cost", "flat"):
+            errors.append("RATE_LIMIT_STRATEGY must be 'cost' or 'flat'")
+        if cls.RATE_LIMIT_ENABLED and cls.RATE_LIMIT_STRATEGY == "cost" and (
+            cls.RATE_LIMIT_UNITS_PER_MINUTE <= 0 or cls.RATE_LIMIT_BURST_UNITS <= 0
+        ):
+            errors.append("RATE_LIMIT_UNITS_PER_MINUTE and RATE_LIMIT_BURST_UNITS must be greater than 0")
+
+        # Validate metrics flush interval
+        if cls.METRICS_ENABLED and cls.METRICS_FLUSH_INTERVAL <= 0:
+            errors.append("METRICS_FLUSH_INTERVAL must be greater than 0")
+
+        # Validate profiling settings
+        if cls.PROFILING_ENABLED and not cls.PROFILING_TOKEN:
+            errors.append("PROFILING_TOKEN must be set when PROFILING_ENABLED is true")
+        if cls.PROFILING_MAX_FILES <= 0:
+            errors.append("PROFILING_MAX_FILES must be greater than 0")
+        
+        # Validate memory admission settings
+        if cls.MEMORY_BUDGET_MB < 0:
+            errors.append("MEMORY_BUDGET_MB must not be negative")
+        if cls.MEMORY_QUEUE_LIMIT < 0:
+            errors.append("MEMORY_QUEUE_LIMIT must not be negative")
+
+        # Validate import report settings
+        if cls.IMPORT_REPORT_TOP < 0:
+            errors.append("IMPORT_REPORT_TOP must not be negative")
+
+        # Validate server settings
+        if cls.SERVER_WORKERS < 0:
+            errors.append("SERVER_WORKERS must not be negative")
+        if cls.SERVER_WORKER_MEMORY_MB <= 0:
+            errors.append("SERVER_WORKER_MEMORY_MB must be greater than 0")
+        if cls.WORKER_PROCESS_MEMORY_MB <= 0:
+            errors.append("WORKER_PROCESS_MEMORY_MB must be greater than 0")
+        if cls.WORKER_PROCESS_BASELINE_MB < 0:
+            errors.append("WORKER_PROCESS_BASELINE_MB must not be negative")
+        if cls.SERVER_MAX_REQUESTS < 0 or cls.SERVER_MAX_REQUESTS_JITTER < 0:
+            errors.append("SERVER_MAX_REQUESTS and SERVER_MAX_REQUESTS_JITTER must not be negative")
         
         if errors:
             raise ValueError(f"Configuration validation failed: {', '.join(errors)}")
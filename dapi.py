@@ -1,10 +1,18 @@
 # import sys
 # sys.path.insert(0, "python_libs")
 
+from config import config
+from startup import import_timer
+
+# Time imports from here on so the startup report covers the heavy ones
+if config.IMPORT_TIMING_ENABLED:
+    import_timer.install()
+
 from typing import Union
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request, Depends, Header
+from fastapi.responses import FileResponse, Response
+from starlette.concurrency import run_in_threadpool
 import fitz
 import os
 from functions import *
@@ -21,14 +29,31 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
 # Import configuration and validation
-from config import config
-from validation import validator
+from validation import validator, UploadDescriptor
+from metrics import metrics, MetricsMiddleware
+from timing import span, ServerTimingMiddleware
+from profiling import profile_store, ProfilingMiddleware
+from memory_budget import memory_budget, MemoryBudgetMiddleware
+from rate_limit import cost_limiter, CostRateLimitMiddleware
+from spool import upload_spool, SpoolCleanupMiddleware
+from body_limit import body_limiter, BodyLimitMiddleware
+from resumable import resumable_uploads, upload_input, upload_inputs
+from blob_store import blob_store, set_owner
+from scheduler import client_key
+from results import result_store, result_response, ResultFileResponse
+from cancellation import run_cancellable, gather_cancellable, gather_or_cancel
+from chunked_compression import compress_pdf_chunked
+from target_size import compress_to_size
+from progress import ProgressMiddleware
 
 # Validate configuration on startup
 config.validate()
 
-# Initialize rate limiter
-limiter = Limiter(key_func=get_remote_address)
+# Initialize rate limiter (per-worker request counts; used when RATE_LIMIT_STRATEGY=flat)
+limiter = Limiter(
+    key_func=get_remote_address,
+    enabled=config.RATE_LIMIT_ENABLED and config.RATE_LIMIT_STRATEGY == "flat",
+)
 
 app = FastAPI()
 
@@ -36,7 +61,25 @@ app = FastAPI()
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
+# Progress events for clients that ask for a stream (innermost: sees the operation's own response)
+if config.PROGRESS_STREAMING_ENABLED:
+    app.add_middleware(ProgressMiddleware, min_interval=config.PROGRESS_MIN_INTERVAL)
+
+# Memory admission control: queue or reject uploads that would exceed the budget
+if config.MEMORY_BUDGET_ENABLED:
+    app.add_middleware(MemoryBudgetMiddleware, manager=memory_budget, retry_after=config.MEMORY_RETRY_AFTER)
+
+# Cost-weighted rate limiting, checked before a request waits for memory
+if config.RATE_LIMIT_ENABLED and config.RATE_LIMIT_STRATEGY == "cost":
+    app.add_middleware(CostRateLimitMiddleware, limiter=cost_limiter)
+
+# Per-route body size limits, enforced before the upload is buffered and before an
+# oversized request is charged or waits for memory (added last: outermost of the three)
+if config.BODY_LIMIT_ENABLED:
+    app.add_middleware(BodyLimitMiddleware, limiter=body_limiter)
+
 # Update CORS to use specific origins from config
+# (outside the admission checks so their 413/429/503 answers carry CORS headers too)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=config.ALLOWED_ORIGINS,
@@ -45,6 +88,127 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request instrumentation (served at /metrics)
+if config.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware, registry=metrics)
+
+# Per-stage timing breakdown (Server-Timing header, optional JSON log line)
+if config.SERVER_TIMING_ENABLED:
+    app.add_middleware(ServerTimingMiddleware, log_enabled=config.TIMING_LOG_ENABLED)
+
+# On-demand cProfile capture for requests carrying a valid X-Profile-Token
+if config.PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware, token=config.PROFILING_TOKEN, store=profile_store)
+
+# Delete each request's spooled uploads once its response has been sent
+app.add_middleware(SpoolCleanupMiddleware, spool=upload_spool)
+# Metrics of a previous run would otherwise be merged into this one's
+metrics.clear_stale()
+swept = upload_spool.sweep(config.SPOOL_MAX_AGE)
+if swept:
+    print(f"Removed {swept} stale spool file(s) from {config.SPOOL_DIR}")
+swept = resumable_uploads.sweep()
+if swept:
+    print(f"Removed {swept} expired upload(s) from {config.RESUMABLE_UPLOAD_DIR}")
+
+# Report import times for this worker; later first-time imports are logged as lazy
+if config.IMPORT_TIMING_ENABLED:
+    import_timer.report()
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Prometheus metrics merged across all worker processes.
+    """
+    if not config.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.post("/uploads", status_code=201)
+@limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
+async def create_upload_endpoint(
+    request: Request,
+    filename: str = Form(...),
+    size: int = Form(...),
+    sha256: Optional[str] = Form(None)
+):
+    """
+    Start a resumable upload of `size` bytes.
+    Send the bytes with PATCH /uploads/{upload_id}, then POST /uploads/{upload_id}/complete.
+    """
+    return await run_in_threadpool(resumable_uploads.create, filename, size, sha256)
+
+
+@app.patch("/uploads/{upload_id}")
+async def upload_chunk_endpoint(
+    request: Request,
+    upload_id: str,
+    upload_offset: int = Header(..., alias="Upload-Offset")
+):
+    """
+    Write the raw request body at Upload-Offset. Chunks may arrive in any
+    order and in parallel; the response lists the ranges still missing.
+    """
+    return await resumable_uploads.write_chunk(upload_id, upload_offset, request.stream())
+
+
+@app.get("/uploads/{upload_id}")
+async def upload_status_endpoint(upload_id: str):
+    """
+    Received and missing byte ranges, to resume an interrupted upload.
+    """
+    return await run_in_threadpool(resumable_uploads.status, upload_id)
+
+
+@app.post("/uploads/{upload_id}/complete")
+@limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
+async def complete_upload_endpoint(
+    request: Request,
+    upload_id: str,
+    sha256: Optional[str] = Form(None)
+):
+    """
+    Verify the assembled file against its SHA-256. Once complete, pass
+    upload_id (or upload_ids) to any operation instead of uploading the file.
+    """
+    set_owner(client_key(request))
+    # Hashes the whole file: keep it off the event loop
+    return await run_in_threadpool(resumable_uploads.complete, upload_id, sha256)
+
+
+@app.delete("/uploads/{upload_id}")
+async def delete_upload_endpoint(upload_id: str):
+    await run_in_threadpool(resumable_uploads.delete, upload_id)
+    return {"deleted": upload_id}
+
+
+@app.get("/blobs/{sha256}")
+async def blob_status_endpoint(request: Request, sha256: str):
+    """
+    Check whether this client has already sent a document with this SHA-256.
+    If it has, pass blob_sha256 (or blob_sha256s) to any operation instead of uploading the file.
+    """
+    if not blob_store.enabled:
+        raise HTTPException(status_code=404, detail="Blob store is disabled")
+    set_owner(client_key(request))
+    size = blob_store.lookup(sha256)
+    if size is None:
+        raise HTTPException(status_code=404, detail="Blob not found")
+    return {"sha256": sha256.lower(), "size": size}
+
+
+@app.get("/results/{result_id}")
+async def result_endpoint(result_id: str):
+    """
+    Download (or resume, with a Range header) a result whose first download did not finish.
+    """
+    stored = result_store.load(result_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Result not found or expired")
+    path, media_type, headers = stored
+    return ResultFileResponse(result_id, path, media_type, headers)
 
 
 # Define the email model
@@ -92,21 +256,25 @@ async def send_email(request: Request, data: MessageSchema):
 
 @app.post("/merge_pdfs")
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
-async def merge_pdfs_endpoint(request: Request, files: List[UploadFile] = File(...)):
+async def merge_pdfs_endpoint(request: Request, files: List[Union[UploadFile, UploadDescriptor]] = Depends(upload_inputs)):
     try:
         # Validate all files
-        for file in files:
-            validator.validate_and_sanitize(file)
+        uploads = [await run_in_threadpool(validator.ingest, file) for file in files]
         
-        # Get the merged PDF in memory
-        pdf_bytes = merge_pdfs_api(files)
+        # Repair damaged inputs in parallel; intact ones are parsed once, by the serial assembly
+        damaged = [index for index, upload in enumerate(uploads) if needs_repair(upload)]
+        if damaged:
+            repaired = await gather_cancellable(request, normalize_pdf, [(uploads[index],) for index in damaged])
+            for index, source in zip(damaged, repaired):
+                uploads[index] = source
+        pdf_bytes = await run_cancellable(request, merge_pdfs_api, uploads)
         
         # Generate output filename from first file
         original_name = files[0].filename.rsplit('.', 1)[0] if files else "output"
         output_filename = f"{original_name}Dpdfmerged.pdf"
 
-        # Return the merged PDF as a downloadable file (StreamingResponse)
-        return StreamingResponse(
+        # Return the merged PDF as a downloadable file
+        return await result_response(
             pdf_bytes,
             media_type='application/pdf',
             headers={"Content-Disposition": f"attachment; filename={output_filename}"}
@@ -125,12 +293,12 @@ class RangesModel(BaseModel):
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
 async def split_pdfs_endpoint(
     request: Request,
-    file: UploadFile = File(...),
+    file: Union[UploadFile, UploadDescriptor] = Depends(upload_input),
     ranges_model: str = Form(...),  # Accepting ranges as a string
 ):
     try:
         # Validate file
-        validator.validate_and_sanitize(file)
+        upload = await run_in_threadpool(validator.ingest, file)
         
         # Parse the ranges_model JSON string directly
         ranges_data = json.loads(ranges_model)
@@ -142,14 +310,14 @@ async def split_pdfs_endpoint(
         print("Received ranges:", ranges)
 
         # Get the split PDFs in memory
-        split_files = split_pdfs_api(file, ranges)
+        split_files = split_pdfs_api(upload, ranges)
         
         # Generate output filename
         original_name = file.filename.rsplit('.', 1)[0]
         output_filename = f"{original_name}Dpdfsplit.zip"
 
-        # Return the split PDFs as a zip file (StreamingResponse)
-        return StreamingResponse(
+        # Return the split PDFs as a zip file
+        return await result_response(
             zip_files(split_files),
             media_type='application/zip',
             headers={"Content-Disposition": f"attachment; filename={output_filename}"}
@@ -166,7 +334,7 @@ async def split_pdfs_endpoint(
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
 async def split_by_page_count_endpoint(
     request: Request,
-    file: UploadFile = File(...),
+    file: Union[UploadFile, UploadDescriptor] = Depends(upload_input),
     pages_per_split: int = Form(...)
 ):
     """
@@ -174,7 +342,7 @@ async def split_by_page_count_endpoint(
     """
     try:
         # Validate file
-        validator.validate_and_sanitize(file)
+        upload = await run_in_threadpool(validator.ingest, file)
         
         # Validate pages_per_split
         if pages_per_split < 1:
@@ -183,14 +351,14 @@ async def split_by_page_count_endpoint(
         print(f"Splitting by page count: {pages_per_split} pages per file")
         
         # Split the PDF
-        split_files = split_pdf_by_page_count(file, pages_per_split)
+        split_files = split_pdf_by_page_count(upload, pages_per_split)
         
         # Generate output filename
         original_name = file.filename.rsplit('.', 1)[0]
         output_filename = f"{original_name}Dpdfsplit_by_count.zip"
         
         # Return as zip file
-        return StreamingResponse(
+        return await result_response(
             zip_files(split_files),
             media_type='application/zip',
             headers={"Content-Disposition": f"attachment; filename={output_filename}"}
@@ -207,7 +375,7 @@ async def split_by_page_count_endpoint(
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
 async def split_by_file_size_endpoint(
     request: Request,
-    file: UploadFile = File(...),
+    file: Union[UploadFile, UploadDescriptor] = Depends(upload_input),
     target_size_mb: float = Form(...)
 ):
     """
@@ -215,7 +383,7 @@ async def split_by_file_size_endpoint(
     """
     try:
         # Validate file
-        validator.validate_and_sanitize(file)
+        upload = await run_in_threadpool(validator.ingest, file)
         
         # Validate target_size_mb
         if target_size_mb <= 0:
@@ -226,14 +394,14 @@ async def split_by_file_size_endpoint(
         print(f"Splitting by file size: {target_size_mb}MB per file")
         
         # Split the PDF
-        split_files = split_pdf_by_file_size(file, target_size_mb)
+        split_files = await run_cancellable(request, split_pdf_by_file_size, upload, target_size_mb)
         
         # Generate output filename
         original_name = file.filename.rsplit('.', 1)[0]
         output_filename = f"{original_name}Dpdfsplit_by_size.zip"
         
         # Return as zip file
-        return StreamingResponse(
+        return await result_response(
             zip_files(split_files),
             media_type='application/zip',
             headers={"Content-Disposition": f"attachment; filename={output_filename}"}
@@ -250,7 +418,7 @@ async def split_by_file_size_endpoint(
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
 async def extract_pages_separate_endpoint(
     request: Request,
-    file: UploadFile = File(...),
+    file: Union[UploadFile, UploadDescriptor] = Depends(upload_input),
     pages: str = Form(...)
 ):
     """
@@ -259,7 +427,7 @@ async def extract_pages_separate_endpoint(
     """
     try:
         # Validate file
-        validator.validate_and_sanitize(file)
+        upload = await run_in_threadpool(validator.ingest, file)
         
         print(f"Extracting pages as separate files: {pages}")
         
@@ -276,14 +444,14 @@ async def extract_pages_separate_endpoint(
             page_list = [int(pages)]
         
         # Extract pages as separate files
-        extracted_files = extract_pages_as_separate_files(file, page_list)
+        extracted_files = await run_cancellable(request, extract_pages_as_separate_files, upload, page_list)
         
         # Generate output filename
         original_name = file.filename.rsplit('.', 1)[0]
         output_filename = f"{original_name}Dpdfextracted_pages.zip"
         
         # Return as zip file
-        return StreamingResponse(
+        return await result_response(
             zip_files(extracted_files),
             media_type='application/zip',
             headers={"Content-Disposition": f"attachment; filename={output_filename}"}
@@ -296,40 +464,100 @@ async def extract_pages_separate_endpoint(
         raise HTTPException(status_code=500, detail=f"Error extracting pages: {str(e)}")
     
     
+def compression_structure(
+    object_streams: Optional[bool] = Form(None),   # Object streams and a compressed xref stream
+    subset_fonts: Optional[bool] = Form(None),     # Subset embedded fonts to the glyphs used
+    remove_metadata: Optional[bool] = Form(None),  # Drop title/author/XMP metadata and thumbnails
+) -> dict:
+    """Structure-level compression options of a request, unset ones from the config"""
+    return {
+        "object_streams": config.COMPRESS_OBJECT_STREAMS if object_streams is None else object_streams,
+        "subset_fonts": config.COMPRESS_SUBSET_FONTS if subset_fonts is None else subset_fonts,
+        "remove_metadata": config.COMPRESS_REMOVE_METADATA if remove_metadata is None else remove_metadata,
+    }
+
+
+def saved_bytes_header(reports: List[dict]) -> str:
+    """Bytes saved per compression step, summed over files: "images=123,fonts=45,..." """
+    totals = {}
+    for report in reports:
+        for step, saved in report.items():
+            totals[step] = totals.get(step, 0) + saved
+    return ",".join(f"{step}={saved}" for step, saved in totals.items())
+
+
 @app.post("/compress")
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
 async def compress_pdfs_endpoint(
     request: Request,
-    files: list[UploadFile] = File(...),  # Accept multiple files
+    files: List[Union[UploadFile, UploadDescriptor]] = Depends(upload_inputs),  # Accept multiple files
     compression_level: int = Form(50),     # Compression level 1-100
     target_dpi: int = Form(150),           # Target DPI 72-300
+    target_size_mb: Optional[float] = Form(None),  # Size each output PDF must fit in; target_dpi becomes the maximum
+    report_savings: bool = Form(False),    # Measure the bytes each step saves into X-Compression-Saved
+    structure: dict = Depends(compression_structure),
 ):
     try:
         # Validate all files
-        for file in files:
-            validator.validate_and_sanitize(file)
+        uploads = [await run_in_threadpool(validator.ingest, file) for file in files]
         
         # Validate compression level and DPI
         if not 1 <= compression_level <= 100:
             raise HTTPException(status_code=400, detail="Compression level must be between 1 and 100")
         if not 72 <= target_dpi <= 300:
             raise HTTPException(status_code=400, detail="Target DPI must be between 72 and 300")
+        if target_size_mb is not None and target_size_mb <= 0:
+            raise HTTPException(status_code=400, detail="Target size must be greater than 0 MB")
         
         # Print received parameters for debugging
-        print(f"Received compression level: {compression_level}, target DPI: {target_dpi}")
+        print(f"Received compression level: {compression_level}, target DPI: {target_dpi}, target size: {target_size_mb}")
+
+        headers = {}
+        if target_size_mb is not None:
+            # Quality and DPI are solved per file from a size probe instead of taken from the form
+            target_size = int(target_size_mb * 1024 * 1024)
+            # One failed file stops the other files' passes
+            outcomes = await gather_or_cancel([
+                compress_to_size(request, upload, target_size, compression_level, target_dpi, report_savings,
+                                 **structure)
+                for upload in uploads
+            ])
+            targets = [target for _, target in outcomes]
+            headers = {
+                "X-Compression-Passes": ",".join(str(target["passes"]) for target in targets),
+                "X-Compression-Image-Quality": ",".join(str(target["image_quality"]) for target in targets),
+                "X-Compression-DPI": ",".join(str(target["dpi"]) for target in targets),
+                "X-Compression-Target-Met": ",".join(str(target["target_met"]).lower() for target in targets),
+            }
+            outcomes = [(result, target["saved"]) for result, target in outcomes]
 
-        # Extract files and process compression
-        compressed_files, opy = compress_pdfs_api(files, compression_level, target_dpi)
+        # A single file is split across the workers if it is large; several files get one worker each
+        elif len(uploads) == 1:
+            outcomes = [await compress_pdf_chunked(request, uploads[0], compression_level, target_dpi,
+                                                   report_savings, **structure)]
+        else:
+            outcomes = await gather_cancellable(
+                request, compress_pdf_with_report, [(upload, compression_level, target_dpi) for upload in uploads],
+                measure=report_savings, **structure
+            )
+        if report_savings:
+            headers["X-Compression-Saved"] = saved_bytes_header([report for _, report in outcomes])
+
+        compressed = [result for result, _ in outcomes]
+        if len(uploads) == 1:
+            compressed_files, opy = compressed[0], '1'
+        else:
+            compressed_files, opy = await run_cancellable(request, zip_files, compressed, "compressed"), '2'
 
         # If there is only one file, return it directly as a PDF
         if int(opy) == 1:
             print("Compressed file one:", compressed_files)
             original_name = files[0].filename.rsplit('.', 1)[0]
             output_filename = f"{original_name}Dpdfcompressed.pdf"
-            return StreamingResponse(
+            return await result_response(
                 compressed_files,
                 media_type='application/pdf',
-                headers={"Content-Disposition": f"attachment; filename={output_filename}"}
+                headers={"Content-Disposition": f"attachment; filename={output_filename}", **headers}
             )
 
         # If there are multiple files, return them as a zip
@@ -338,10 +566,10 @@ async def compress_pdfs_endpoint(
             original_name = files[0].filename.rsplit('.', 1)[0]
             output_filename = f"{original_name}Dpdfcompressed.zip"
             
-            return StreamingResponse(
+            return await result_response(
                 compressed_files,
                 media_type='application/zip',
-                headers={"Content-Disposition": f"attachment; filename={output_filename}"}
+                headers={"Content-Disposition": f"attachment; filename={output_filename}", **headers}
             )
 
     except HTTPException:
@@ -354,17 +582,18 @@ async def compress_pdfs_endpoint(
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
 async def estimate_compression_endpoint(
     request: Request,
-    file: UploadFile = File(...),
+    file: Union[UploadFile, UploadDescriptor] = Depends(upload_input),
     compression_level: int = Form(50),
     target_dpi: int = Form(150),
+    structure: dict = Depends(compression_structure),
 ):
     """
     Estimate the output file size for compression settings.
-    Returns original size and estimated compressed size.
+    Returns original size, estimated compressed size and the bytes each compression step saves.
     """
     try:
         # Validate file
-        validator.validate_and_sanitize(file)
+        upload = await run_in_threadpool(validator.ingest, file)
         
         # Validate compression level and DPI
         if not 1 <= compression_level <= 100:
@@ -373,14 +602,11 @@ async def estimate_compression_endpoint(
             raise HTTPException(status_code=400, detail="Target DPI must be between 72 and 300")
         
         # Get original file size
-        file_content = await file.read()
-        original_size = len(file_content)
-        
-        # Reset file pointer for compression
-        await file.seek(0)
+        original_size = upload.size
         
         # Perform actual compression to get accurate size
-        compressed_files, _ = compress_pdfs_api([file], compression_level, target_dpi)
+        compressed_files, saved_bytes = await compress_pdf_chunked(request, upload, compression_level, target_dpi,
+                                                                   measure=True, **structure)
         
         # Get compressed size
         compressed_files.seek(0, 2)  # Seek to end
@@ -393,7 +619,8 @@ async def estimate_compression_endpoint(
             "original_size": original_size,
             "estimated_size": compressed_size,
             "compression_ratio": round(compression_ratio, 2),
-            "size_reduction": original_size - compressed_size
+            "size_reduction": original_size - compressed_size,
+            "saved_bytes": saved_bytes
         }
     
     except HTTPException:
@@ -402,16 +629,40 @@ async def estimate_compression_endpoint(
         print(e)
         raise HTTPException(status_code=500, detail=f"Error estimating compression: {str(e)}")
 
+@app.post("/analyze_pdf")
+@limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
+async def analyze_pdf_endpoint(
+    request: Request,
+    file: Union[UploadFile, UploadDescriptor] = Depends(upload_input),
+):
+    """
+    Break down where a PDF's bytes go without rendering it.
+    Returns bytes per category (images, fonts, content, annotations, metadata, structure, other),
+    images by codec and effective DPI, embedded and subset fonts, duplicate streams and a
+    recommended compression profile whose fields can be sent as-is to /compress.
+    """
+    try:
+        # Validate file
+        upload = await run_in_threadpool(validator.ingest, file)
+
+        return await run_cancellable(request, analyze_pdf, upload)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(e)
+        raise HTTPException(status_code=500, detail=f"Error analyzing PDF: {str(e)}")
+
 @app.post("/split")
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
 async def split_pdf_endpoint(
     request: Request,
-    file: UploadFile = File(...),  # Accept a single file
+    file: Union[UploadFile, UploadDescriptor] = Depends(upload_input),  # Accept a single file
     pages_to_remove: str = Form(...),  # Accept a comma-separated list of page numbers
 ):
     try:
         # Validate file
-        validator.validate_and_sanitize(file)
+        upload = await run_in_threadpool(validator.ingest, file)
         
         # Print received page numbers for debugging
         print("Received pages to remove:", pages_to_remove)
@@ -419,18 +670,15 @@ async def split_pdf_endpoint(
         # Parse the pages_to_remove into a list of integers
         pages_to_remove_list = [int(page.strip()) - 1 for page in pages_to_remove.split(",")]  # Convert to 0-based indexing
 
-        # Read the uploaded PDF file into memory
-        pdf_stream = io.BytesIO(await file.read())
-
         # Remove the specified pages from the PDF
-        modified_pdf = remove_pages_from_pdf(pdf_stream, pages_to_remove_list)
+        modified_pdf = remove_pages_from_pdf(upload, pages_to_remove_list)
         
         # Generate output filename
         original_name = file.filename.rsplit('.', 1)[0]
         output_filename = f"{original_name}Dpdfremoved_pages.pdf"
 
         # Return the modified PDF as a response
-        return StreamingResponse(
+        return await result_response(
             modified_pdf,
             media_type='application/pdf',
             headers={"Content-Disposition": f"attachment; filename={output_filename}"}
@@ -446,23 +694,22 @@ async def split_pdf_endpoint(
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
 async def extract_pdf_pages_endpoint(
     request: Request,
-    file: UploadFile = File(...),
+    file: Union[UploadFile, UploadDescriptor] = Depends(upload_input),
     pages_to_extract: str = Form(...)
 ):
     try:
         # Validate file
-        validator.validate_and_sanitize(file)
+        upload = await run_in_threadpool(validator.ingest, file)
         
         print("Received pages to extract:", pages_to_extract)
         pages_to_extract_list = [int(page.strip()) - 1 for page in pages_to_extract.split(",")]
-        pdf_stream = io.BytesIO(await file.read())
-        extracted_pdf = extract_pages_from_pdf(pdf_stream, pages_to_extract_list)
+        extracted_pdf = extract_pages_from_pdf(upload, pages_to_extract_list)
         
         # Generate output filename
         original_name = file.filename.rsplit('.', 1)[0]
         output_filename = f"{original_name}Dpdfextracted.pdf"
 
-        return StreamingResponse(
+        return await result_response(
             extracted_pdf,
             media_type='application/pdf',
             headers={"Content-Disposition": f"attachment; filename={output_filename}"}
@@ -478,23 +725,22 @@ async def extract_pdf_pages_endpoint(
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
 async def organize_pdf_pages_endpoint(
     request: Request,
-    file: UploadFile = File(...),
+    file: Union[UploadFile, UploadDescriptor] = Depends(upload_input),
     pages_to_organize: str = Form(...)
 ):
     try:
         # Validate file
-        validator.validate_and_sanitize(file)
+        upload = await run_in_threadpool(validator.ingest, file)
         
         print("Received pages to organize:", pages_to_organize)
         pages_to_extract_list = [int(page.strip()) - 1 for page in pages_to_organize.split(",")]
-        pdf_stream = io.BytesIO(await file.read())
-        extracted_pdf = extract_pages_from_pdf(pdf_stream, pages_to_extract_list)
+        extracted_pdf = extract_pages_from_pdf(upload, pages_to_extract_list)
         
         # Generate output filename
         original_name = file.filename.rsplit('.', 1)[0]
         output_filename = f"{original_name}Dpdforganized.pdf"
 
-        return StreamingResponse(
+        return await result_response(
             extracted_pdf,
             media_type='application/pdf',
             headers={"Content-Disposition": f"attachment; filename={output_filename}"}
@@ -508,24 +754,21 @@ async def organize_pdf_pages_endpoint(
     
 @app.post("/repair")
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
-async def repair_pdf_endpoint(request: Request, file: UploadFile = File(...)):
+async def repair_pdf_endpoint(request: Request, file: Union[UploadFile, UploadDescriptor] = Depends(upload_input)):
     print("in repair............")
     try:
         # Validate file
-        validator.validate_and_sanitize(file)
-        
-        # Read the uploaded PDF file into memory
-        pdf_stream = io.BytesIO(await file.read())
+        upload = await run_in_threadpool(validator.ingest, file)
 
         # Attempt to repair the PDF
-        repaired_pdf = repair_pdf(pdf_stream)
+        repaired_pdf = await run_cancellable(request, repair_pdf, upload)
         
         # Generate output filename
         original_name = file.filename.rsplit('.', 1)[0]
         output_filename = f"{original_name}Dpdfrepaired.pdf"
 
         # Return the repaired PDF as a downloadable file
-        return StreamingResponse(
+        return await result_response(
             repaired_pdf,
             media_type='application/pdf',
             headers={"Content-Disposition": f"attachment; filename={output_filename}"}
@@ -539,26 +782,23 @@ async def repair_pdf_endpoint(request: Request, file: UploadFile = File(...)):
     
 @app.post("/wordtopdf")
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
-async def word_to_pdf_endpoint(request: Request, file: UploadFile = File(...)):
+async def word_to_pdf_endpoint(request: Request, file: Union[UploadFile, UploadDescriptor] = Depends(upload_input)):
     print("in word to pdf conversion..........")
     try:
         # Validate file (allow Word documents)
         allowed_types = ["application/vnd.openxmlformats-officedocument.wordprocessingml.document"]
-        validator.validate_file_type(file, allowed_types)
-        validator.validate_file_size(file)
+        upload = await run_in_threadpool(validator.ingest, file, allowed_types)
         
-        # Read the uploaded Word file into memory
-        word_stream = io.BytesIO(await file.read())
-
-        # Attempt to convert the Word file to PDF
-        pdf_stream = convert_word_to_pdf(word_stream)
+        # Attempt to convert the Word file to PDF straight from the spooled upload
+        with upload.open() as word_stream:
+            pdf_stream = convert_word_to_pdf(word_stream)
         
         # Generate output filename
         original_name = file.filename.rsplit('.', 1)[0]
         output_filename = f"{original_name}Dpdfword_to_pdf.pdf"
 
         # Return the converted PDF as a downloadable file
-        return StreamingResponse(
+        return await result_response(
             pdf_stream,
             media_type='application/pdf',
             headers={"Content-Disposition": f"attachment; filename={output_filename}"}
@@ -571,25 +811,22 @@ async def word_to_pdf_endpoint(request: Request, file: UploadFile = File(...)):
     
 @app.post("/jpegtopdf")
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
-async def jpeg_to_pdf_endpoint(request: Request, file: UploadFile = File(...)):
+async def jpeg_to_pdf_endpoint(request: Request, file: Union[UploadFile, UploadDescriptor] = Depends(upload_input)):
     try:
         # Validate file (allow JPEG and PNG images)
         allowed_types = ["image/jpeg", "image/png"]
-        validator.validate_file_type(file, allowed_types)
-        validator.validate_file_size(file)
-        
-        # Read the uploaded image file as a BytesIO stream
-        image_stream = io.BytesIO(await file.read())
+        upload = await run_in_threadpool(validator.ingest, file, allowed_types)
         
-        # Convert the image to PDF in memory
-        pdf_stream = image_to_pdf(image_stream)
+        # Convert the image to PDF straight from the spooled upload
+        with upload.open() as image_stream:
+            pdf_stream = image_to_pdf(image_stream)
         
         # Generate output filename
         original_name = file.filename.rsplit('.', 1)[0]
         output_filename = f"{original_name}Dpdfimage_to_pdf.pdf"
 
         # Return the PDF as a response
-        return StreamingResponse(
+        return await result_response(
             pdf_stream, 
             media_type="application/pdf",
             headers={"Content-Disposition": f"attachment; filename={output_filename}"}
@@ -603,25 +840,22 @@ async def jpeg_to_pdf_endpoint(request: Request, file: UploadFile = File(...)):
 
 @app.post("/exceltopdf")
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
-async def excel_to_pdf_endpoint(request: Request, file: UploadFile = File(...)):
+async def excel_to_pdf_endpoint(request: Request, file: Union[UploadFile, UploadDescriptor] = Depends(upload_input)):
     try:
         # Validate file (allow Excel files)
         allowed_types = ["application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"]
-        validator.validate_file_type(file, allowed_types)
-        validator.validate_file_size(file)
+        upload = await run_in_threadpool(validator.ingest, file, allowed_types)
         
-        # Read the uploaded Excel file as a BytesIO stream
-        excel_stream = io.BytesIO(await file.read())
-
-        # Convert the Excel file to PDF in memory
-        pdf_stream = excel_to_pdf(excel_stream)
+        # Convert the Excel file to PDF straight from the spooled upload
+        with upload.open() as excel_stream:
+            pdf_stream = excel_to_pdf(excel_stream)
         
         # Generate output filename
         original_name = file.filename.rsplit('.', 1)[0]
         output_filename = f"{original_name}Dpdfexcel_to_pdf.pdf"
 
         # Return the PDF as a response
-        return StreamingResponse(
+        return await result_response(
             pdf_stream, 
             media_type="application/pdf",
             headers={"Content-Disposition": f"attachment; filename={output_filename}"}
@@ -636,13 +870,12 @@ async def excel_to_pdf_endpoint(request: Request, file: UploadFile = File(...)):
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
 async def rotate_pdf_endpoint(
     request: Request,
-    files: List[UploadFile] = File(...),
+    files: List[Union[UploadFile, UploadDescriptor]] = Depends(upload_inputs),
     pages: str = Form('')
 ):
     try:
         # Validate all files
-        for file in files:
-            validator.validate_and_sanitize(file)
+        uploads = [await run_in_threadpool(validator.ingest, file) for file in files]
         
         form_data = await request.form()
         # Extract all rotation fields dynamically
@@ -650,22 +883,15 @@ async def rotate_pdf_endpoint(
         print("Rotations:", rotations)
 
         pages_to_rotate = [int(page.strip()) - 1 for page in pages.split(',')] if pages else None
-        merged_stream = io.BytesIO()
 
-        for idx, file in enumerate(files):
-            pdf_stream = io.BytesIO(await file.read())
-            pdf_document = fitz.open(stream=pdf_stream, filetype='pdf')
-            rotation_angle = rotations[idx]
-
-            if pages_to_rotate:
-                for page_num in pages_to_rotate:
-                    if page_num < len(pdf_document):
-                        pdf_document[page_num].set_rotation(rotation_angle)
-            else:
-                for page in pdf_document:
-                    page.set_rotation(rotation_angle)
-
-            pdf_document.save(merged_stream)
+        # Rotate the files in parallel, then concatenate them in upload order
+        rotated = await gather_cancellable(
+            request, rotate_pdf_api,
+            [(upload, rotations[idx], pages_to_rotate) for idx, upload in enumerate(uploads)]
+        )
+        merged_stream = io.BytesIO()
+        for pdf_stream in rotated:
+            merged_stream.write(pdf_stream.read())
 
         merged_stream.seek(0)
         
@@ -673,7 +899,7 @@ async def rotate_pdf_endpoint(
         original_name = files[0].filename.rsplit('.', 1)[0]
         output_filename = f"{original_name}Dpdfrotated.pdf"
         
-        return StreamingResponse(
+        return await result_response(
             merged_stream, 
             media_type='application/pdf',
             headers={"Content-Disposition": f"attachment; filename={output_filename}"}
@@ -688,7 +914,7 @@ async def rotate_pdf_endpoint(
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
 async def add_watermark_endpoint(
     request: Request,
-    files: List[UploadFile] = File(...),
+    files: List[Union[UploadFile, UploadDescriptor]] = Depends(upload_inputs),
     watermark_text: Optional[str] = Form(None),
     watermark_image: Optional[UploadFile] = File(None),
     position: str = Form('top-left'),
@@ -701,8 +927,7 @@ async def add_watermark_endpoint(
 ):
     try:
         # Validate all PDF files
-        for file in files:
-            validator.validate_and_sanitize(file)
+        uploads = [await run_in_threadpool(validator.ingest, file) for file in files]
         
         # Validate watermark image if provided
         if watermark_image:
@@ -739,33 +964,29 @@ async def add_watermark_endpoint(
         if watermark_image:
             watermark_image_data = await watermark_image.read()
 
-        for file in files:
-            pdf_stream = io.BytesIO(await file.read())
-            
-            if watermark_image_data:
-                # Create a fresh BytesIO for each file to avoid stream position issues
-                image_stream = io.BytesIO(watermark_image_data)
-                pdf_stream = add_image_watermark(
-                    pdf_stream, 
-                    image_stream, 
-                    position, 
-                    opacity, 
-                    rotation,
-                    pages=page_list
-                )
-            elif watermark_text:
-                pdf_stream = add_watermark(
-                    pdf_stream, 
-                    watermark_text, 
-                    position,
-                    font_size=font_size,
-                    font_name=font_name,
-                    opacity=opacity,
-                    rotation=int(rotation),  # Text rotation should be int
-                    pages=page_list,
-                    bold=bold
-                )
+        # Watermark the files in parallel, then concatenate them in upload order
+        if watermark_image_data:
+            # Create a fresh BytesIO for each file to avoid stream position issues
+            watermarked = await gather_cancellable(
+                request, add_image_watermark,
+                [(upload, io.BytesIO(watermark_image_data), position, opacity, rotation) for upload in uploads],
+                pages=page_list
+            )
+        elif watermark_text:
+            watermarked = await gather_cancellable(
+                request, add_watermark,
+                [(upload, watermark_text, position) for upload in uploads],
+                font_size=font_size,
+                font_name=font_name,
+                opacity=opacity,
+                rotation=int(rotation),  # Text rotation should be int
+                pages=page_list,
+                bold=bold
+            )
+        else:
+            watermarked = uploads
 
+        for pdf_stream in watermarked:
             merged_stream.write(pdf_stream.read())
 
         merged_stream.seek(0)
@@ -774,7 +995,7 @@ async def add_watermark_endpoint(
         original_name = files[0].filename.rsplit('.', 1)[0]
         output_filename = f"{original_name}Dpdfwatermarked.pdf"
         
-        return StreamingResponse(
+        return await result_response(
             merged_stream, 
             media_type='application/pdf',
             headers={"Content-Disposition": f"attachment; filename={output_filename}"}
@@ -792,7 +1013,7 @@ async def add_watermark_endpoint(
 # PDF to Word conversion endpoint disabled to reduce deployment size
 # @app.post("/pdf_to_word")
 # @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
-# async def pdf_to_word_endpoint(request: Request, file: UploadFile = File(...)):
+# async def pdf_to_word_endpoint(request: Request, file: Union[UploadFile, UploadDescriptor] = Depends(upload_input)):
 #     """
 #     Convert PDF to Word (DOCX) format.
 #     Preserves text formatting, images, and table structures.
@@ -824,7 +1045,7 @@ async def add_watermark_endpoint(
 #         output_filename = f"{original_name}Dpdfpdf_to_word.docx"
 #         
 #         # Return the converted DOCX file
-#         return StreamingResponse(
+#         return result_response(
 #             docx_stream,
 #             media_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
 #             headers={"Content-Disposition": f"attachment; filename={output_filename}"}
@@ -853,7 +1074,7 @@ class PasswordProtectionRequest(BaseModel):
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
 async def add_password_endpoint(
     request: Request,
-    file: UploadFile = File(...),
+    file: Union[UploadFile, UploadDescriptor] = Depends(upload_input),
     user_password: str = Form(...),
     owner_password: Optional[str] = Form(None),
     allow_printing: bool = Form(True),
@@ -866,10 +1087,7 @@ async def add_password_endpoint(
     """
     try:
         # Validate file
-        validator.validate_and_sanitize(file)
-        
-        # Read PDF
-        pdf_stream = io.BytesIO(await file.read())
+        upload = await run_in_threadpool(validator.ingest, file)
         
         # Calculate permissions
         permissions = 0
@@ -884,7 +1102,7 @@ async def add_password_endpoint(
         
         # Add password
         protected_pdf = add_password_to_pdf(
-            pdf_stream,
+            upload,
             user_password,
             owner_password,
             permissions
@@ -894,7 +1112,7 @@ async def add_password_endpoint(
         original_name = file.filename.rsplit('.', 1)[0]
         output_filename = f"{original_name}Dpdfprotected.pdf"
         
-        return StreamingResponse(
+        return await result_response(
             protected_pdf,
             media_type='application/pdf',
             headers={"Content-Disposition": f"attachment; filename={output_filename}"}
@@ -911,7 +1129,7 @@ async def add_password_endpoint(
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
 async def remove_password_endpoint(
     request: Request,
-    file: UploadFile = File(...),
+    file: Union[UploadFile, UploadDescriptor] = Depends(upload_input),
     password: str = Form(...)
 ):
     """
@@ -919,19 +1137,16 @@ async def remove_password_endpoint(
     """
     try:
         # Validate file
-        validator.validate_and_sanitize(file)
-        
-        # Read PDF
-        pdf_stream = io.BytesIO(await file.read())
+        upload = await run_in_threadpool(validator.ingest, file)
         
         # Remove password
-        unlocked_pdf = remove_password_from_pdf(pdf_stream, password)
+        unlocked_pdf = remove_password_from_pdf(upload, password)
         
         # Generate output filename
         original_name = file.filename.rsplit('.', 1)[0]
         output_filename = f"{original_name}Dpdfunlocked.pdf"
         
-        return StreamingResponse(
+        return await result_response(
             unlocked_pdf,
             media_type='application/pdf',
             headers={"Content-Disposition": f"attachment; filename={output_filename}"}
@@ -954,7 +1169,7 @@ async def remove_password_endpoint(
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
 async def add_page_numbers_endpoint(
     request: Request,
-    file: UploadFile = File(...),
+    file: Union[UploadFile, UploadDescriptor] = Depends(upload_input),
     position: str = Form("bottom-center"),
     format_string: str = Form("{page}"),
     start_page: int = Form(1),
@@ -969,7 +1184,7 @@ async def add_page_numbers_endpoint(
     """
     try:
         # Validate file
-        validator.validate_and_sanitize(file)
+        upload = await run_in_threadpool(validator.ingest, file)
         
         # Validate inputs
         if font_size < 6 or font_size > 72:
@@ -979,12 +1194,10 @@ async def add_page_numbers_endpoint(
         if position not in valid_positions:
             raise HTTPException(status_code=400, detail=f"Invalid position. Must be one of: {', '.join(valid_positions)}")
         
-        # Read PDF
-        pdf_stream = io.BytesIO(await file.read())
-        
         # Add page numbers
-        numbered_pdf = add_page_numbers(
-            pdf_stream,
+        numbered_pdf = await run_cancellable(
+            request, add_page_numbers,
+            upload,
             position=position,
             format_string=format_string,
             start_page=start_page,
@@ -996,7 +1209,7 @@ async def add_page_numbers_endpoint(
         original_name = file.filename.rsplit('.', 1)[0]
         output_filename = f"{original_name}Dpdfnumbered.pdf"
         
-        return StreamingResponse(
+        return await result_response(
             numbered_pdf,
             media_type='application/pdf',
             headers={"Content-Disposition": f"attachment; filename={output_filename}"}
@@ -1017,7 +1230,7 @@ async def add_page_numbers_endpoint(
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
 async def detect_blank_pages_endpoint(
     request: Request,
-    file: UploadFile = File(...),
+    file: Union[UploadFile, UploadDescriptor] = Depends(upload_input),
     threshold: float = Form(0.99)
 ):
     """
@@ -1028,17 +1241,14 @@ async def detect_blank_pages_endpoint(
     """
     try:
         # Validate file
-        validator.validate_and_sanitize(file)
+        upload = await run_in_threadpool(validator.ingest, file)
         
         # Validate threshold
         if threshold < 0.5 or threshold > 1.0:
             raise HTTPException(status_code=400, detail="Threshold must be between 0.5 and 1.0")
         
-        # Read PDF
-        pdf_stream = io.BytesIO(await file.read())
-        
         # Detect blank pages
-        blank_pages = detect_blank_pages(pdf_stream, threshold)
+        blank_pages = await run_cancellable(request, detect_blank_pages, upload, threshold)
         
         return {
             "blank_pages": blank_pages,
@@ -1056,7 +1266,7 @@ async def detect_blank_pages_endpoint(
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
 async def remove_blank_pages_endpoint(
     request: Request,
-    file: UploadFile = File(...),
+    file: Union[UploadFile, UploadDescriptor] = Depends(upload_input),
     threshold: float = Form(0.99)
 ):
     """
@@ -1069,24 +1279,21 @@ async def remove_blank_pages_endpoint(
     """
     try:
         # Validate file
-        validator.validate_and_sanitize(file)
+        upload = await run_in_threadpool(validator.ingest, file)
         
         # Validate threshold
         if threshold < 0.5 or threshold > 1.0:
             raise HTTPException(status_code=400, detail="Threshold must be between 0.5 and 1.0")
         
-        # Read PDF
-        pdf_stream = io.BytesIO(await file.read())
-        
         # Remove blank pages
-        cleaned_pdf, removed_pages = remove_blank_pages(pdf_stream, threshold)
+        cleaned_pdf, removed_pages = await run_cancellable(request, remove_blank_pages, upload, threshold)
         
         # Generate output filename
         original_name = file.filename.rsplit('.', 1)[0]
         output_filename = f"{original_name}Dpdfcleaned.pdf"
         
         # Return the cleaned PDF with info about removed pages in headers
-        return StreamingResponse(
+        return await result_response(
             cleaned_pdf,
             media_type='application/pdf',
             headers={
@@ -1111,7 +1318,7 @@ async def remove_blank_pages_endpoint(
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
 async def pdf_to_images_endpoint(
     request: Request,
-    file: UploadFile = File(...),
+    file: Union[UploadFile, UploadDescriptor] = Depends(upload_input),
     dpi: int = Form(150),
     image_format: str = Form("png"),
     pages: Optional[str] = Form(None)
@@ -1125,7 +1332,7 @@ async def pdf_to_images_endpoint(
     """
     try:
         # Validate file
-        validator.validate_and_sanitize(file)
+        upload = await run_in_threadpool(validator.ingest, file)
         
         # Validate DPI
         if not 72 <= dpi <= 300:
@@ -1154,11 +1361,8 @@ async def pdf_to_images_endpoint(
             except ValueError:
                 raise HTTPException(status_code=400, detail="Invalid page numbers format")
         
-        # Read PDF
-        pdf_stream = io.BytesIO(await file.read())
-        
         # Convert to images
-        images = pdf_to_images(pdf_stream, dpi, image_format, page_list)
+        images = await run_cancellable(request, pdf_to_images, upload, dpi, image_format, page_list)
         
         # Generate output filename
         original_name = file.filename.rsplit('.', 1)[0]
@@ -1168,7 +1372,7 @@ async def pdf_to_images_endpoint(
             img_stream, img_filename = images[0]
             output_filename = f"{original_name}Dpdf{img_filename}"
             ext = 'jpeg' if image_format.lower() in ['jpg', 'jpeg'] else 'png'
-            return StreamingResponse(
+            return await result_response(
                 img_stream,
                 media_type=f'image/{ext}',
                 headers={"Content-Disposition": f"attachment; filename={output_filename}"}
@@ -1176,7 +1380,7 @@ async def pdf_to_images_endpoint(
         
         # Multiple images - return as zip
         zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        with span("zip"), zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
             for img_stream, img_filename in images:
                 img_stream.seek(0)
                 zipf.writestr(img_filename, img_stream.read())
@@ -1184,7 +1388,7 @@ async def pdf_to_images_endpoint(
         zip_buffer.seek(0)
         output_filename = f"{original_name}Dpdfimages.zip"
         
-        return StreamingResponse(
+        return await result_response(
             zip_buffer,
             media_type='application/zip',
             headers={"Content-Disposition": f"attachment; filename={output_filename}"}
@@ -1205,7 +1409,7 @@ async def pdf_to_images_endpoint(
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
 async def flatten_pdf_endpoint(
     request: Request,
-    file: UploadFile = File(...)
+    file: Union[UploadFile, UploadDescriptor] = Depends(upload_input)
 ):
     """
     Flatten PDF by converting form fields and annotations to static content.
@@ -1213,19 +1417,16 @@ async def flatten_pdf_endpoint(
     """
     try:
         # Validate file
-        validator.validate_and_sanitize(file)
-        
-        # Read PDF
-        pdf_stream = io.BytesIO(await file.read())
+        upload = await run_in_threadpool(validator.ingest, file)
         
         # Flatten PDF
-        flattened_pdf = flatten_pdf(pdf_stream)
+        flattened_pdf = await run_cancellable(request, flatten_pdf, upload)
         
         # Generate output filename
         original_name = file.filename.rsplit('.', 1)[0]
         output_filename = f"{original_name}Dpdfflattened.pdf"
         
-        return StreamingResponse(
+        return await result_response(
             flattened_pdf,
             media_type='application/pdf',
             headers={"Content-Disposition": f"attachment; filename={output_filename}"}
@@ -1246,7 +1447,7 @@ async def flatten_pdf_endpoint(
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
 async def get_pdf_metadata_endpoint(
     request: Request,
-    file: UploadFile = File(...)
+    file: Union[UploadFile, UploadDescriptor] = Depends(upload_input)
 ):
     """
     Get PDF metadata information.
@@ -1254,13 +1455,10 @@ async def get_pdf_metadata_endpoint(
     """
     try:
         # Validate file
-        validator.validate_and_sanitize(file)
-        
-        # Read PDF
-        pdf_stream = io.BytesIO(await file.read())
+        upload = await run_in_threadpool(validator.ingest, file)
         
         # Get metadata
-        metadata = get_pdf_metadata(pdf_stream)
+        metadata = get_pdf_metadata(upload)
         
         return metadata
     
@@ -1275,7 +1473,7 @@ async def get_pdf_metadata_endpoint(
 @limiter.limit(f"{config.RATE_LIMIT_PER_MINUTE}/minute")
 async def update_pdf_metadata_endpoint(
     request: Request,
-    file: UploadFile = File(...),
+    file: Union[UploadFile, UploadDescriptor] = Depends(upload_input),
     title: Optional[str] = Form(None),
     author: Optional[str] = Form(None),
     subject: Optional[str] = Form(None),
@@ -1288,14 +1486,11 @@ async def update_pdf_metadata_endpoint(
     """
     try:
         # Validate file
-        validator.validate_and_sanitize(file)
-        
-        # Read PDF
-        pdf_stream = io.BytesIO(await file.read())
+        upload = await run_in_threadpool(validator.ingest, file)
         
         # Update metadata
         updated_pdf = update_pdf_metadata(
-            pdf_stream,
+            upload,
             title=title,
             author=author,
             subject=subject,
@@ -1307,7 +1502,7 @@ async def update_pdf_metadata_endpoint(
         original_name = file.filename.rsplit('.', 1)[0]
         output_filename = f"{original_name}Dpdfmetadata_updated.pdf"
         
-        return StreamingResponse(
+        return await result_response(
             updated_pdf,
             media_type='application/pdf',
             headers={"Content-Disposition": f"attachment; filename={output_filename}"}
@@ -42,7 +42,9 @@ Type=simple
 User=$USER
 WorkingDirectory=$HOME/Pydf-Api
 Environment="PATH=$HOME/.local/bin:/usr/local/bin:/usr/bin:/bin"
-ExecStart=/usr/local/bin/uvicorn dapi:app --host 0.0.0.0 --port 8001
+ExecStart=/usr/bin/python3 server.py
+KillSignal=SIGTERM
+TimeoutStopSec=40
 Restart=always
 RestartSec=10
 
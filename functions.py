@@ -2,23 +2,32 @@
 # sys.path.insert(0, "python_libs")
 
 import fitz
-import numpy as np
 
-from typing import List
+from typing import Dict, List
 from fastapi import UploadFile
 import io
 from typing import Tuple,Union,Optional
+import re
 import zipfile
+import itertools
+import zlib
+import hashlib
 import tempfile
-from PIL import Image
-from docx import Document
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
-import openpyxl
+# PIL, numpy, python-docx, reportlab and openpyxl are imported inside the
+# functions that use them, so workers only pay for them on first use
 # from pdf2docx import Converter  # Removed to reduce deployment size
 import os
 
+from config import config
+from metrics import metrics
+from timing import span, timed
+from memory_budget import note_pages
+from validation import UploadDescriptor
+from transport import SpoolFile
+from rate_limit import charge_pages
+from cancellation import check_cancelled
+from progress import report_progress
+
 position_map = {
     "top-left": (0, 100, 200, 100),
     "top-center": (250, 100, 400, 100),
@@ -32,6 +41,48 @@ position_map = {
     "bottom-right": (400, 600, 600, 400),
 }
 
+
+# Anything _open_pdf accepts: bytes, a stream, a path, an UploadFile, an ingested upload
+# or bytes handed over from another process
+PdfSource = Union[bytes, io.BytesIO, str, UploadFile, UploadDescriptor, SpoolFile]
+
+
+def _open_pdf(source: PdfSource, count_pages: bool = True) -> fitz.Document:
+    """
+    Open a PDF, timed as the 'parse' stage; streams are read from the start.
+    count_pages=False skips the page accounting for a document that is opened again later.
+    """
+    # File-backed documents are counted once per request however often they are opened
+    document = None
+    with span("parse"):
+        if isinstance(source, (UploadDescriptor, SpoolFile)):
+            # MuPDF reads the spool file directly: no copy of the upload in Python
+            document = source.path
+            doc = fitz.open(source.path, filetype="pdf")
+        elif isinstance(source, str):
+            document = source
+            doc = fitz.open(source, filetype="pdf")
+        else:
+            if isinstance(source, UploadFile):
+                source.file.seek(0)
+                source = source.file.read()
+            elif hasattr(source, "seek"):
+                source.seek(0)
+            doc = fitz.open(stream=source, filetype="pdf")
+    # Refine the request's memory reservation and charge the client for the pages
+    if count_pages:
+        note_pages(doc.page_count, document)
+        charge_pages(doc.page_count)
+    return doc
+
+
+def _save_pdf(doc: fitz.Document, output_stream, **save_options) -> None:
+    """Serialize a document into output_stream, timed as the 'serialize' stage"""
+    with span("serialize"):
+        doc.save(output_stream, **save_options)
+
+
+@timed("process")
 def add_watermark(
     input_pdf_stream: io.BytesIO, 
     watermark_text: str, 
@@ -60,7 +111,7 @@ def add_watermark(
     Returns:
         Output PDF as BytesIO
     """
-    doc = fitz.open(stream=input_pdf_stream, filetype="pdf")
+    doc = _open_pdf(input_pdf_stream)
     
     # Add bold suffix to font name if requested
     if bold:
@@ -79,6 +130,7 @@ def add_watermark(
         pages_to_watermark = [p - 1 for p in pages if 0 < p <= len(doc)]
     
     for page_num in pages_to_watermark:
+        check_cancelled()
         page = doc.load_page(page_num)
         page_width, page_height = page.rect.width, page.rect.height
         
@@ -121,13 +173,16 @@ def add_watermark(
             opacity=opacity  # This is the correct way to set opacity in PyMuPDF
         )
 
+    metrics.record_pages("add_watermark", len(pages_to_watermark))
+
     output_pdf_stream = io.BytesIO()
-    doc.save(output_pdf_stream)
+    _save_pdf(doc, output_pdf_stream)
     doc.close()
 
     output_pdf_stream.seek(0)
     return output_pdf_stream
 
+@timed("process")
 def add_image_watermark(
     input_pdf_stream: io.BytesIO,
     watermark_image_stream: io.BytesIO,
@@ -152,7 +207,7 @@ def add_image_watermark(
     Returns:
         Output PDF as BytesIO
     """
-    doc = fitz.open(stream=input_pdf_stream, filetype="pdf")
+    doc = _open_pdf(input_pdf_stream)
     image_data = watermark_image_stream.read()
 
     # Get image dimensions (to preserve aspect ratio)
@@ -173,6 +228,7 @@ def add_image_watermark(
         pages_to_watermark = [p - 1 for p in pages if 0 < p <= len(doc)]
     
     for page_num in pages_to_watermark:
+        check_cancelled()
         page = doc.load_page(page_num)
         page_width, page_height = page.rect.width, page.rect.height
         
@@ -214,8 +270,10 @@ def add_image_watermark(
             opacity=opacity
         )
 
+    metrics.record_pages("add_image_watermark", len(pages_to_watermark))
+
     output_pdf_stream = io.BytesIO()
-    doc.save(output_pdf_stream)
+    _save_pdf(doc, output_pdf_stream)
     doc.close()
 
     output_pdf_stream.seek(0)
@@ -224,7 +282,12 @@ def add_image_watermark(
 
 
 
+@timed("process")
 def excel_to_pdf(excel_stream: io.BytesIO) -> io.BytesIO:
+    import openpyxl
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
     try:
         # Load the Excel file using openpyxl
         excel_stream.seek(0)
@@ -267,7 +330,13 @@ def excel_to_pdf(excel_stream: io.BytesIO) -> io.BytesIO:
         print(f"Error converting Excel to PDF: {e}")
         raise e
 
+@timed("process")
 def image_to_pdf(image_stream: io.BytesIO) -> io.BytesIO:
+    from PIL import Image
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+
     try:
         # Open the image using Pillow (supports JPEG, PNG, and other formats)
         image = Image.open(image_stream)
@@ -317,7 +386,12 @@ def jpeg_to_pdf(jpeg_stream: io.BytesIO) -> io.BytesIO:
     """Legacy function - redirects to image_to_pdf"""
     return image_to_pdf(jpeg_stream)
     
+@timed("process")
 def convert_word_to_pdf(word_stream: io.BytesIO) -> io.BytesIO:
+    from docx import Document
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
     try:
         # Read the Word document content using python-docx
         word_doc = Document(word_stream)
@@ -352,6 +426,51 @@ def convert_word_to_pdf(word_stream: io.BytesIO) -> io.BytesIO:
         print(f"Error converting Word to PDF: {e}")
         raise e
 
+# The cross-reference offset is in the last few hundred bytes of an intact file
+XREF_TAIL_BYTES = 1024
+_STARTXREF = re.compile(rb"startxref\s+(\d+)")
+_XREF_TARGET = re.compile(rb"\s*(xref|\d+\s+\d+\s+obj)")
+
+
+def needs_repair(source: PdfSource) -> bool:
+    """
+    Cheap check whether MuPDF would have to repair a file: its last startxref
+    must point at a cross-reference table or stream. Only the file's tail and
+    the bytes at that offset are read; in-memory sources are assumed to need it.
+    """
+    if not isinstance(source, (UploadDescriptor, SpoolFile)):
+        return True
+    try:
+        with open(source.path, "rb") as fh:
+            size = fh.seek(0, os.SEEK_END)
+            fh.seek(max(0, size - XREF_TAIL_BYTES))
+            offsets = _STARTXREF.findall(fh.read())
+            if not offsets or int(offsets[-1]) >= size:
+                return True
+            fh.seek(int(offsets[-1]))
+            return _XREF_TARGET.match(fh.read(64)) is None
+    except OSError:
+        return True
+
+@timed("parse")
+def normalize_pdf(source: PdfSource) -> PdfSource:
+    """
+    Prepare one input of a merge: parse it and, if MuPDF had to repair it,
+    return a cleanly re-serialized copy so the merge does not repair it again.
+    Intact inputs are returned as they are.
+    """
+    pdf = _open_pdf(source, count_pages=False)
+    try:
+        if not pdf.is_repaired:
+            return source
+        normalized = io.BytesIO()
+        _save_pdf(pdf, normalized, garbage=1)
+        normalized.seek(0)
+        return normalized
+    finally:
+        pdf.close()
+
+@timed("process")
 def merge_pdfs_api(files: List[UploadFile]):
     # Create a new PDF document to hold the merged content
     merged_pdf = fitz.open()
@@ -359,22 +478,24 @@ def merge_pdfs_api(files: List[UploadFile]):
     # Loop through the input files
     for file in files:
         # Read the content of each uploaded file
-        pdf = fitz.open(stream=file.file.read(), filetype='pdf')
+        pdf = _open_pdf(file)
         # Insert the entire PDF into the merged document
         merged_pdf.insert_pdf(pdf)
+        metrics.record_pages("merge_pdfs", pdf.page_count)
         # Close the current PDF file
         pdf.close()
 
     # Save the merged PDF to a BytesIO object (in-memory)
     pdf_bytes = io.BytesIO()
-    merged_pdf.save(pdf_bytes)
+    _save_pdf(merged_pdf, pdf_bytes)
     merged_pdf.close()
 
     # Seek to the beginning of the in-memory PDF before returning it
     pdf_bytes.seek(0)
     return pdf_bytes
 
-def zip_files(files: List[io.BytesIO]) -> io.BytesIO:
+@timed("zip")
+def zip_files(files: List[io.BytesIO], name: str = "split") -> io.BytesIO:
     # Create a BytesIO object to hold the zip content
     zip_bytes = io.BytesIO()
 
@@ -383,18 +504,16 @@ def zip_files(files: List[io.BytesIO]) -> io.BytesIO:
         for idx, pdf_bytes in enumerate(files):
             # Write each PDF as a separate file in the zip archive
             pdf_bytes.seek(0)  # Ensure we're reading from the start
-            zipf.writestr(f"split_{idx + 1}.pdf", pdf_bytes.read())
+            zipf.writestr(f"{name}_{idx + 1}.pdf", pdf_bytes.read())
 
     # Move the cursor to the beginning of the BytesIO object
     zip_bytes.seek(0)
     return zip_bytes
 
+@timed("process")
 def rotate_pdf_api(file: UploadFile, rotation_angle: int, page_numbers: Optional[List[int]] = None) -> io.BytesIO:
-    # Read the uploaded PDF file as a BytesIO stream
-    pdf_stream = io.BytesIO(file.file.read())
-    
     # Open the PDF with PyMuPDF
-    pdf_document = fitz.open(stream=pdf_stream, filetype='pdf')
+    pdf_document = _open_pdf(file)
     
     # Rotate specified pages or all pages if `page_numbers` is None
     if page_numbers is None:
@@ -406,19 +525,21 @@ def rotate_pdf_api(file: UploadFile, rotation_angle: int, page_numbers: Optional
         for page_num in page_numbers:
             if 0 <= page_num < len(pdf_document):
                 pdf_document[page_num].set_rotation(rotation_angle)
+    metrics.record_pages("rotate_pdf", pdf_document.page_count)
     
     # Save the rotated PDF to a BytesIO object (in memory)
     rotated_pdf_stream = io.BytesIO()
-    pdf_document.save(rotated_pdf_stream)
+    _save_pdf(pdf_document, rotated_pdf_stream)
     pdf_document.close()
     
     # Move the stream position back to the start
     rotated_pdf_stream.seek(0)
     return rotated_pdf_stream
 
+@timed("process")
 def split_pdfs_api(file: UploadFile, ranges: List[Tuple[int, int]]):
     # Open the uploaded PDF file in memory
-    pdf_document = fitz.open(stream=file.file.read(), filetype='pdf')
+    pdf_document = _open_pdf(file)
     split_files = []
 
     # Loop through the provided page ranges
@@ -431,7 +552,7 @@ def split_pdfs_api(file: UploadFile, ranges: List[Tuple[int, int]]):
         
         # Save the split PDF to a BytesIO object (in-memory)
         pdf_bytes = io.BytesIO()
-        new_pdf.save(pdf_bytes)
+        _save_pdf(new_pdf, pdf_bytes)
         new_pdf.close()
         
         # Seek to the beginning of the in-memory PDF
@@ -440,11 +561,14 @@ def split_pdfs_api(file: UploadFile, ranges: List[Tuple[int, int]]):
         # Append the in-memory file to the list
         split_files.append(pdf_bytes)
 
+    metrics.record_pages("split_pdfs", pdf_document.page_count)
+
     # Close the original PDF document
     pdf_document.close()
     return split_files
 
 
+@timed("process")
 def split_pdf_by_page_count(file: UploadFile, pages_per_split: int) -> List[io.BytesIO]:
     """
     Split a PDF into multiple files with a specified number of pages each.
@@ -456,7 +580,7 @@ def split_pdf_by_page_count(file: UploadFile, pages_per_split: int) -> List[io.B
     Returns:
         List of BytesIO objects containing the split PDFs
     """
-    pdf_document = fitz.open(stream=file.file.read(), filetype='pdf')
+    pdf_document = _open_pdf(file)
     total_pages = pdf_document.page_count
     split_files = []
     
@@ -470,16 +594,18 @@ def split_pdf_by_page_count(file: UploadFile, pages_per_split: int) -> List[io.B
         
         # Save to BytesIO
         pdf_bytes = io.BytesIO()
-        new_pdf.save(pdf_bytes)
+        _save_pdf(new_pdf, pdf_bytes)
         new_pdf.close()
         pdf_bytes.seek(0)
         
         split_files.append(pdf_bytes)
     
+    metrics.record_pages("split_pdf_by_page_count", total_pages)
     pdf_document.close()
     return split_files
 
 
+@timed("process")
 def split_pdf_by_file_size(file: UploadFile, target_size_mb: float) -> List[io.BytesIO]:
     """
     Split a PDF into multiple files targeting a specific file size.
@@ -491,7 +617,7 @@ def split_pdf_by_file_size(file: UploadFile, target_size_mb: float) -> List[io.B
     Returns:
         List of BytesIO objects containing the split PDFs
     """
-    pdf_document = fitz.open(stream=file.file.read(), filetype='pdf')
+    pdf_document = _open_pdf(file)
     total_pages = pdf_document.page_count
     split_files = []
     target_size_bytes = target_size_mb * 1024 * 1024
@@ -500,12 +626,13 @@ def split_pdf_by_file_size(file: UploadFile, target_size_mb: float) -> List[io.B
     current_size = 0
     
     for page_num in range(total_pages):
+        check_cancelled()
         # Insert the page into the current PDF
         current_pdf.insert_pdf(pdf_document, from_page=page_num, to_page=page_num)
         
         # Check the current size
         temp_bytes = io.BytesIO()
-        current_pdf.save(temp_bytes)
+        _save_pdf(current_pdf, temp_bytes)
         current_size = temp_bytes.tell()
         
         # If we've exceeded the target size and have at least one page, save this PDF
@@ -515,7 +642,7 @@ def split_pdf_by_file_size(file: UploadFile, target_size_mb: float) -> List[io.B
             
             # Save the current PDF
             pdf_bytes = io.BytesIO()
-            current_pdf.save(pdf_bytes)
+            _save_pdf(current_pdf, pdf_bytes)
             pdf_bytes.seek(0)
             split_files.append(pdf_bytes)
             
@@ -527,15 +654,17 @@ def split_pdf_by_file_size(file: UploadFile, target_size_mb: float) -> List[io.B
     # Save any remaining pages
     if current_pdf.page_count > 0:
         pdf_bytes = io.BytesIO()
-        current_pdf.save(pdf_bytes)
+        _save_pdf(current_pdf, pdf_bytes)
         pdf_bytes.seek(0)
         split_files.append(pdf_bytes)
     
+    metrics.record_pages("split_pdf_by_file_size", total_pages)
     current_pdf.close()
     pdf_document.close()
     return split_files
 
 
+@timed("process")
 def extract_pages_as_separate_files(file: UploadFile, pages: List[int]) -> List[io.BytesIO]:
     """
     Extract specific pages as individual PDF files.
@@ -547,10 +676,11 @@ def extract_pages_as_separate_files(file: UploadFile, pages: List[int]) -> List[
     Returns:
         List of BytesIO objects, each containing a single page
     """
-    pdf_document = fitz.open(stream=file.file.read(), filetype='pdf')
+    pdf_document = _open_pdf(file)
     extracted_files = []
     
     for page_num in pages:
+        check_cancelled()
         # Adjust for zero-indexed pages
         page_index = page_num - 1
         
@@ -561,12 +691,13 @@ def extract_pages_as_separate_files(file: UploadFile, pages: List[int]) -> List[
             
             # Save to BytesIO
             pdf_bytes = io.BytesIO()
-            new_pdf.save(pdf_bytes)
+            _save_pdf(new_pdf, pdf_bytes)
             new_pdf.close()
             pdf_bytes.seek(0)
             
             extracted_files.append(pdf_bytes)
     
+    metrics.record_pages("extract_pages_as_separate_files", len(extracted_files))
     pdf_document.close()
     return extracted_files
 
@@ -598,6 +729,1012 @@ def parse_page_ranges(range_string: str) -> List[Tuple[int, int]]:
     return ranges
 
 
+def _compression_settings(compression_level: int) -> Tuple[int, bool, int]:
+    """(garbage level, deflate, image quality) for a compression level 1-100"""
+    # Higher compression level = lower quality, smaller file
+    if compression_level >= 75:  # Maximum compression
+        return 4, True, 50
+    if compression_level >= 50:  # Balanced
+        return 3, True, 75
+    return 2, True, 90  # Maximum quality
+
+
+def _encode_image(img_pil, image_ext: str, image_quality: int) -> bytes:
+    """Encode a PIL image the way compression stores it: PNG stays PNG, the rest becomes JPEG"""
+    img_buffer = io.BytesIO()
+    if image_ext in ["jpg", "jpeg"]:
+        img_pil.save(img_buffer, format="JPEG", quality=image_quality, optimize=True)
+    elif image_ext == "png":
+        img_pil.save(img_buffer, format="PNG", optimize=True)
+    else:
+        # For other formats, convert to JPEG
+        if img_pil.mode in ("RGBA", "LA", "P"):
+            img_pil = img_pil.convert("RGB")
+        img_pil.save(img_buffer, format="JPEG", quality=image_quality, optimize=True)
+    return img_buffer.getvalue()
+
+
+# Scan detection: an image is grayscale when at most SCAN_COLOR_FRACTION of its pixels
+# have channels more than SCAN_GRAY_SPREAD apart, and bitonal when at most
+# SCAN_MIDTONE_FRACTION of its gray levels lie between SCAN_DARK and SCAN_LIGHT.
+# Images are judged on every n-th pixel, about SCAN_SAMPLE_SIDE per side.
+SCAN_GRAY_SPREAD = 32
+SCAN_COLOR_FRACTION = 0.005
+SCAN_DARK = 64
+SCAN_LIGHT = 192
+SCAN_MIDTONE_FRACTION = 0.06
+SCAN_SAMPLE_SIDE = 512
+
+# An image rewritten as raw stream data plus the image dictionary entries that describe it
+RawImage = Tuple[bytes, Optional[Dict[str, str]]]
+
+
+def _otsu_threshold(histogram) -> int:
+    """Gray level that best separates a 256-bin histogram into dark and light pixels (Otsu)"""
+    import numpy as np
+
+    levels = np.arange(256)
+    weight = np.cumsum(histogram).astype(np.float64)
+    mean = np.cumsum(histogram * levels).astype(np.float64)
+    total, total_mean = weight[-1], mean[-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (total_mean * weight - mean * total) ** 2 / (weight * (total - weight))
+    return int(np.argmax(np.nan_to_num(between[:-1])))
+
+
+def _scan_kind(pdf_document: fitz.Document, xref: int, img_pil) -> Tuple[str, int]:
+    """
+    ("bitonal", threshold), ("gray", 0) or ("color", 0) for an image, from
+    NumPy histograms of a pixel sample. Images with transparency, CMYK or
+    already 1-bit images are left "color".
+    """
+    import numpy as np
+
+    if not config.COMPRESS_DETECT_SCANS or img_pil.mode not in ("RGB", "L", "P"):
+        return "color", 0
+    if any(pdf_document.xref_get_key(xref, key)[0] != "null" for key in ("SMask", "Mask")):
+        return "color", 0
+
+    step = max(1, max(img_pil.width, img_pil.height) // SCAN_SAMPLE_SIDE)
+    pixels = np.asarray(img_pil.convert("RGB") if img_pil.mode == "P" else img_pil)[::step, ::step]
+    if pixels.ndim == 3:
+        spread = pixels.max(axis=2) - pixels.min(axis=2)
+        if np.count_nonzero(spread > SCAN_GRAY_SPREAD) > SCAN_COLOR_FRACTION * spread.size:
+            return "color", 0
+        pixels = pixels @ np.array([0.299, 0.587, 0.114])
+    histogram = np.bincount(pixels.astype(np.uint8).ravel(), minlength=256)
+    if histogram[SCAN_DARK:SCAN_LIGHT].sum() <= SCAN_MIDTONE_FRACTION * histogram.sum():
+        return "bitonal", _otsu_threshold(histogram)
+    return "gray", 0
+
+
+def _encode_bitonal(img_pil, threshold: int) -> RawImage:
+    """
+    A grayscale image as 1-bit DeviceGray, whichever is smaller of CCITT
+    Group 4 (when Pillow has libtiff) and Flate
+    """
+    import numpy as np
+    from PIL import Image, features
+
+    white = np.asarray(img_pil) > threshold
+    keys = {
+        "Width": str(img_pil.width),
+        "Height": str(img_pil.height),
+        "BitsPerComponent": "1",
+        "ColorSpace": "/DeviceGray",
+        "Filter": "/FlateDecode",
+    }
+    data = zlib.compress(np.packbits(white, axis=1).tobytes(), 9)
+
+    if features.check("libtiff"):
+        # One strip, so the strip is a complete Group 4 stream
+        tiff = io.BytesIO()
+        Image.fromarray(white).save(tiff, format="TIFF", compression="group4", tiffinfo={278: img_pil.height})
+        tiff_image = Image.open(tiff)
+        offsets, counts = tiff_image.tag_v2.get(273), tiff_image.tag_v2.get(279)
+        if offsets and len(offsets) == 1 and counts[0] < len(data):
+            black_is_1 = "true" if tiff_image.tag_v2.get(262) == 1 else "false"
+            data = tiff.getvalue()[offsets[0]:offsets[0] + counts[0]]
+            keys.update(Filter="/CCITTFaxDecode", DecodeParms=(
+                f"<</K -1/Columns {img_pil.width}/Rows {img_pil.height}/BlackIs1 {black_is_1}>>"
+            ))
+    return data, keys
+
+
+def _encode_scan(img_pil, kind: str, threshold: int, image_ext: str, image_quality: int) -> RawImage:
+    """Encode an image as its scan kind: bitonal as raw 1-bit data, grayscale and color as an image file"""
+    if kind == "bitonal":
+        return _encode_bitonal(img_pil.convert("L"), threshold)
+    if kind == "gray":
+        img_pil = img_pil.convert("L")
+    return _encode_image(img_pil, image_ext, image_quality), None
+
+
+def _recompress_image(
+    pdf_document: fitz.Document,
+    xref: int,
+    image_quality: int,
+    target_dpi: int,
+    current_dpi: Optional[float] = None
+) -> RawImage:
+    """
+    Re-encode one image of a document, downsampled to target_dpi.
+    current_dpi is the image's resolution as placed on the page; by default
+    the DPI recorded in the image file is used. Scanned black-and-white and
+    grayscale images are reduced to 1-bit or 8-bit gray (see _scan_kind).
+
+    Returns:
+        (image file, None), or (raw 1-bit stream, image dictionary entries) for a bitonal image
+    """
+    from PIL import Image
+
+    # Extract image
+    base_image = pdf_document.extract_image(xref)
+    image_bytes = base_image["image"]
+    image_ext = base_image["ext"]
+
+    # Open image with PIL
+    img_pil = Image.open(io.BytesIO(image_bytes))
+    kind, threshold = _scan_kind(pdf_document, xref, img_pil)
+    if kind != "color":
+        metrics.inc("pydf_compress_scan_images_total", labels={"kind": kind})
+
+    # Resize image based on target DPI if needed
+    # Calculate new size based on DPI ratio
+    if current_dpi is None:
+        current_dpi = img_pil.info.get('dpi', (72, 72))[0]
+    if current_dpi > target_dpi:
+        scale_factor = target_dpi / current_dpi
+        new_size = (max(1, int(img_pil.width * scale_factor)), max(1, int(img_pil.height * scale_factor)))
+        img_pil = img_pil.resize(new_size, Image.Resampling.LANCZOS)
+
+    # Compress image
+    return _encode_scan(img_pil, kind, threshold, image_ext, image_quality)
+
+
+class _ByteCounter:
+    """Write-only stream that keeps the size of a document saved into it, not its bytes"""
+
+    def __init__(self):
+        self.position = 0
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.position += len(data)
+        self.size = max(self.size, self.position)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}[whence]
+        self.position = base + offset
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+    def truncate(self, size: Optional[int] = None) -> None:
+        self.size = self.position if size is None else size
+
+    def flush(self) -> None:
+        pass
+
+
+# How each compression step is measured: unreferenced objects dropped (so objects a
+# step replaced are not counted against it) and streams deflated (as they will be)
+_MEASURE_OPTIONS = {"garbage": 1, "deflate": True, "deflate_fonts": True, "deflate_images": True}
+
+
+def _note_saving(report: Optional[Dict[str, int]], category: str, pdf_document: fitz.Document,
+                 previous: int, **save_options) -> int:
+    """
+    Add to report the bytes the step just applied saved, measured by saving
+    with save_options (by default _MEASURE_OPTIONS).
+
+    Returns:
+        The new size (`previous` when there is no report to measure for)
+    """
+    if report is None:
+        return previous
+    counter = _ByteCounter()
+    pdf_document.save(counter, **(save_options or _MEASURE_OPTIONS))
+    report[category] = report.get(category, 0) + previous - counter.size
+    return counter.size
+
+
+def _start_report(report: Optional[Dict[str, int]], pdf_document: fitz.Document) -> int:
+    """
+    Size of the document as opened, reporting what dropping its unreferenced
+    objects and deflating its uncompressed streams save
+    """
+    if report is None:
+        return 0
+    counter = _ByteCounter()
+    pdf_document.save(counter)
+    size = _note_saving(report, "unused_objects", pdf_document, counter.size, garbage=1)
+    return _note_saving(report, "streams", pdf_document, size)
+
+
+def _save_compressed(
+    pdf_document: fitz.Document,
+    compression_level: int = 50,
+    report: Optional[Dict[str, int]] = None,
+    size: int = 0,
+    object_streams: bool = True,
+    subset_fonts: bool = True,
+    remove_metadata: bool = False
+) -> io.BytesIO:
+    """
+    Apply the structure-level compression steps and save the document (which is closed).
+
+    Metadata (document info, XMP, thumbnails) is removed and embedded fonts are
+    subset to the glyphs used, then the save merges duplicate objects, deflates
+    streams (fonts and images included), cleans their syntax and, with
+    object_streams, packs objects into object streams indexed by a compressed
+    cross-reference stream.
+
+    Args:
+        pdf_document: Document to save
+        compression_level: Compression level from 1-100 (higher = more compression)
+        report: Bytes saved per step, added to (None: not measured)
+        size: Size of the document before these steps (from the report's previous step)
+        object_streams: Use object streams and a cross-reference stream
+        subset_fonts: Subset embedded fonts
+        remove_metadata: Remove the document's metadata
+
+    Returns:
+        Compressed PDF as a BytesIO object
+    """
+    garbage_level, deflate, _ = _compression_settings(compression_level)
+    if remove_metadata:
+        pdf_document.scrub(
+            attached_files=False, clean_pages=False, embedded_files=False, hidden_text=False,
+            javascript=False, redactions=False, remove_links=False, reset_fields=False,
+            reset_responses=False, metadata=True, xml_metadata=True, thumbnails=True
+        )
+        size = _note_saving(report, "metadata", pdf_document, size)
+    if subset_fonts:
+        try:
+            pdf_document.subset_fonts()
+        except Exception as e:
+            print(f"Error subsetting fonts: {e}")
+        size = _note_saving(report, "fonts", pdf_document, size)
+
+    save_options = dict(garbage=garbage_level, deflate=deflate, deflate_fonts=deflate, deflate_images=deflate,
+                        clean=True)
+    size = _note_saving(report, "duplicates", pdf_document, size, **save_options)
+    if object_streams:
+        save_options["use_objstms"] = 1
+
+    compressed_pdf = io.BytesIO()
+    _save_pdf(pdf_document, compressed_pdf, **save_options)
+    pdf_document.close()
+    if report is not None and object_streams:
+        report["object_streams"] = size - compressed_pdf.getbuffer().nbytes
+    compressed_pdf.seek(0)
+    return compressed_pdf
+
+
+# XObject entries of a resources dictionary's source ("/Im1 12 0 R")
+_XOBJECT_ENTRY = re.compile(r"/([^\s/<>\[\]()]+)\s*(\d+) 0 R")
+
+
+def _replace_image(page: fitz.Page, xref: int, data: bytes) -> None:
+    """
+    page.replace_image(), minus the copy of the new image it leaves referenced
+    from the page's resources (which only garbage >= 3 would merge away)
+    """
+    pdf_document = page.parent
+    first_new = pdf_document.xref_length()
+    page.replace_image(xref, stream=data)
+    kind, xobjects = pdf_document.xref_get_key(page.xref, "Resources/XObject")
+    if kind == "dict":
+        for name, ref in _XOBJECT_ENTRY.findall(xobjects):
+            if int(ref) >= first_new:
+                pdf_document.xref_set_key(page.xref, f"Resources/XObject/{name}", "null")
+
+
+def _store_image(page: fitz.Page, xref: int, data: bytes, keys: Optional[Dict[str, str]]) -> None:
+    """
+    Put a re-encoded image in place of image xref: an image file through
+    replace_image(), raw stream data (keys given) by rewriting the image object
+    """
+    if keys is None:
+        _replace_image(page, xref, data)
+        return
+    pdf_document = page.parent
+    pdf_document.update_stream(xref, data, compress=False)
+    # Entries describing the old encoding or colors no longer apply
+    for key in ("Decode", "DecodeParms", "Filter", "ColorSpace"):
+        if key not in keys and pdf_document.xref_get_key(xref, key)[0] != "null":
+            pdf_document.xref_set_key(xref, key, "null")
+    for key, value in keys.items():
+        pdf_document.xref_set_key(xref, key, value)
+
+
+@timed("process")
+def compress_pdf_with_report(
+    pdf_file: PdfSource,
+    compression_level: int = 50,
+    target_dpi: int = 150,
+    object_streams: bool = True,
+    subset_fonts: bool = True,
+    remove_metadata: bool = False,
+    measure: bool = False
+) -> Tuple[io.BytesIO, Optional[Dict[str, int]]]:
+    """
+    Compress a single PDF file and, with measure, report the bytes each step saved.
+
+    Args:
+        pdf_file: PDF to compress
+        compression_level: Compression level from 1-100 (higher = more compression)
+        target_dpi: Target DPI for images (72-300)
+        object_streams: Use object streams and a cross-reference stream
+        subset_fonts: Subset embedded fonts
+        remove_metadata: Remove the document's metadata
+        measure: Measure what each step saves (costs a save of the document per step)
+
+    Returns:
+        (compressed PDF, bytes saved per step or None when not measured) where
+        the steps are unused_objects, streams, content, images, metadata,
+        fonts, duplicates and object_streams (negative when a step grew the file)
+    """
+    pdf_document = _open_pdf(pdf_file)
+    print(f"Compressing: {getattr(pdf_file, 'filename', 'document')} with level {compression_level}, DPI {target_dpi}")
+    _, _, image_quality = _compression_settings(compression_level)
+    report: Optional[Dict[str, int]] = {} if measure else None
+    size = _start_report(report, pdf_document)
+
+    for page in pdf_document:
+        check_cancelled()
+        report_progress("clean", page.number, pdf_document.page_count)
+        # Clean page contents
+        page.clean_contents(sanitize=True)
+    size = _note_saving(report, "content", pdf_document, size)
+
+    # Images shared by several pages are re-encoded once
+    compressed_xrefs = set()
+    for page in pdf_document:
+        check_cancelled()
+        report_progress("compress", page.number, pdf_document.page_count)
+        # Compress images on the page
+        image_list = page.get_images(full=True)
+        for img_index, img in enumerate(image_list):
+            xref = img[0]
+            if xref in compressed_xrefs:
+                continue
+            compressed_xrefs.add(xref)
+            try:
+                # Replace image in PDF
+                _store_image(page, xref, *_recompress_image(pdf_document, xref, image_quality, target_dpi))
+            except Exception as e:
+                print(f"Error compressing image {img_index} on page: {e}")
+                continue
+    size = _note_saving(report, "images", pdf_document, size)
+
+    metrics.record_pages("compress_pdf", pdf_document.page_count)
+
+    compressed_pdf = _save_compressed(pdf_document, compression_level, report, size,
+                                      object_streams, subset_fonts, remove_metadata)
+    return compressed_pdf, report
+
+
+def compress_pdf(pdf_file: PdfSource, compression_level: int = 50, target_dpi: int = 150, **structure) -> io.BytesIO:
+    """
+    Compress a single PDF file.
+
+    Args:
+        pdf_file: PDF to compress
+        compression_level: Compression level from 1-100 (higher = more compression)
+        target_dpi: Target DPI for images (72-300)
+        **structure: object_streams, subset_fonts and remove_metadata (see compress_pdf_with_report)
+
+    Returns:
+        Compressed PDF as a BytesIO object
+    """
+    return compress_pdf_with_report(pdf_file, compression_level, target_dpi, **structure)[0]
+
+
+# Compression probe: side and number of the tiles encoded per sampled image, and the settings they are encoded at
+PROBE_TILE = 256
+PROBE_QUALITIES = (5, 10, 20, 40, 60, 80, 95)
+PROBE_SCALES = (0.25, 0.5, 1.0)
+PROBE_TILES = 3
+
+
+def _image_placements(pdf_document: fitz.Document) -> Dict[int, dict]:
+    """
+    Each image of a document once, with its stored size, pixel size, format
+    and its highest resolution as placed on a page (72 when it is not placed
+    directly on a page, so it is never downsampled)
+    """
+    images: Dict[int, dict] = {}
+    for page in pdf_document:
+        for img in page.get_images(full=True):
+            xref, width, height, image_filter = img[0], img[2], img[3], img[8]
+            if xref not in images:
+                kind, length = pdf_document.xref_get_key(xref, "Length")
+                ext = {"DCTDecode": "jpeg", "JPXDecode": "jpx"}.get(image_filter, "png")
+                images[xref] = {"xref": xref, "length": int(length) if kind == "int" else 0,
+                                "pixels": width * height, "ext": ext, "dpi": 72.0}
+            # get_image_rects() would decode every image to match it; the bbox of its name is enough
+            try:
+                rect = page.get_image_bbox(img)
+            except Exception:
+                continue
+            if rect.is_valid and not rect.is_infinite and rect.width > 0 and rect.height > 0:
+                dpi = max(width * 72 / rect.width, height * 72 / rect.height)
+                images[xref]["dpi"] = max(images[xref]["dpi"], dpi)
+    return images
+
+
+def _probe_image(pdf_document: fitz.Document, xref: int) -> Dict[Tuple[int, float], float]:
+    """
+    Encoded bytes per pixel of an image at each (PROBE_QUALITIES, PROBE_SCALES):
+    the whole image encoded at the smallest scale, scaled by how PROBE_TILES
+    tiles along its diagonal change between that and the other scales
+    """
+    from PIL import Image
+
+    base_image = pdf_document.extract_image(xref)
+    img_pil = Image.open(io.BytesIO(base_image["image"]))
+    kind, threshold = _scan_kind(pdf_document, xref, img_pil)
+    # PNG and 1-bit images ignore the quality: they are encoded once per tile
+    lossless = base_image["ext"] == "png" or kind == "bitonal"
+    encoded = {key: 0 for key in itertools.product(PROBE_QUALITIES, PROBE_SCALES)}
+    pixels = dict.fromkeys(PROBE_SCALES, 0)
+    for scale in PROBE_SCALES:
+        # A tile of the downsampled image, cut from the original before resizing it
+        width = min(img_pil.width, int(PROBE_TILE / scale))
+        height = min(img_pil.height, int(PROBE_TILE / scale))
+        for position in range(PROBE_TILES):
+            left = (img_pil.width - width) * (2 * position + 1) // (2 * PROBE_TILES)
+            top = (img_pil.height - height) * (2 * position + 1) // (2 * PROBE_TILES)
+            tile = img_pil.crop((left, top, left + width, top + height))
+            if scale < 1:
+                # reducing_gap: box-reduce first, LANCZOS only for the last factor of two
+                tile = tile.resize((max(1, int(width * scale)), max(1, int(height * scale))),
+                                   Image.Resampling.LANCZOS, reducing_gap=2.0)
+            pixels[scale] += tile.width * tile.height
+            size = None
+            for quality in PROBE_QUALITIES:
+                if size is None or not lossless:
+                    size = len(_encode_scan(tile, kind, threshold, base_image["ext"], quality)[0])
+                encoded[(quality, scale)] += size
+    tiles = {(quality, scale): size / pixels[scale] for (quality, scale), size in encoded.items()}
+
+    # Tiles see only part of the image (often its busiest part): the whole image at the
+    # smallest scale gives the level, the tiles how it changes with the scale
+    smallest = PROBE_SCALES[0]
+    whole = img_pil.resize((max(1, int(img_pil.width * smallest)), max(1, int(img_pil.height * smallest))),
+                           Image.Resampling.LANCZOS, reducing_gap=2.0)
+    bpp = {}
+    size = None
+    for quality in PROBE_QUALITIES:
+        if size is None or not lossless:
+            size = len(_encode_scan(whole, kind, threshold, base_image["ext"], quality)[0])
+        level = size / (whole.width * whole.height)
+        for scale in PROBE_SCALES:
+            bpp[(quality, scale)] = level * tiles[(quality, scale)] / tiles[(quality, smallest)]
+    return bpp
+
+
+@timed("process")
+def probe_compression(pdf_file: PdfSource, sample_images: int = 8, compression_level: int = 50,
+                      **structure) -> dict:
+    """
+    Measure how a document responds to image quality and downsampling without
+    compressing it: the `sample_images` largest images are sampled (a tile of
+    each encoded at every probe setting) and the document is saved once with
+    its image streams emptied, which sizes everything but the images.
+
+    Args:
+        pdf_file: PDF to probe
+        sample_images: Number of images to sample
+        compression_level: Compression level whose save options the final pass uses
+        **structure: Structure-level steps the final pass applies (see _save_compressed)
+
+    Returns:
+        {"fixed": bytes of everything but the images, "images": [image]}, each
+        image being {"xref", "length", "pixels", "ext", "dpi", "bpp"} where bpp
+        maps (quality, scale) to bytes per output pixel, or is None when the
+        image was not sampled
+    """
+    pdf_document = _open_pdf(pdf_file, count_pages=False)
+    try:
+        images = _image_placements(pdf_document)
+        largest = sorted(images.values(), key=lambda image: -image["length"])
+        for done, image in enumerate(largest):
+            image["bpp"] = None
+            if done < sample_images:
+                check_cancelled()
+                report_progress("probe", done, min(sample_images, len(largest)))
+                try:
+                    image["bpp"] = _probe_image(pdf_document, image["xref"])
+                except Exception as e:
+                    print(f"Error probing image {image['xref']}: {e}")
+
+        for xref in images:
+            pdf_document.update_stream(xref, b"")
+    except BaseException:
+        pdf_document.close()
+        raise
+    # Saved the way the final pass saves (which closes the document)
+    fixed = _save_compressed(pdf_document, compression_level, **structure).getbuffer().nbytes
+    return {"fixed": fixed, "images": largest}
+
+
+@timed("process")
+def compress_pdf_with_settings(
+    pdf_file: PdfSource,
+    image_quality: int,
+    target_dpi: float,
+    image_dpis: Dict[int, float],
+    compression_level: int = 50,
+    measure: bool = False,
+    **structure
+) -> Tuple[io.BytesIO, Optional[Dict[str, int]]]:
+    """
+    Compress a PDF with an explicit image quality, downsampling each image to
+    target_dpi from its resolution as placed (image_dpis, from the probe).
+    An image whose re-encoding is not smaller than the original is kept.
+
+    Args:
+        pdf_file: PDF to compress
+        image_quality: JPEG quality 1-95
+        target_dpi: Resolution images are downsampled to
+        image_dpis: Placed resolution of each image xref
+        compression_level: Compression level whose save options are used
+        measure: Measure what each step saves (see compress_pdf_with_report)
+        **structure: object_streams, subset_fonts and remove_metadata (see _save_compressed)
+
+    Returns:
+        (compressed PDF, bytes saved per step or None) as from compress_pdf_with_report()
+    """
+    pdf_document = _open_pdf(pdf_file)
+    report: Optional[Dict[str, int]] = {} if measure else None
+    size = _start_report(report, pdf_document)
+
+    for page in pdf_document:
+        check_cancelled()
+        report_progress("clean", page.number, pdf_document.page_count)
+        page.clean_contents(sanitize=True)
+    size = _note_saving(report, "content", pdf_document, size)
+
+    compressed_xrefs = set()
+    for page in pdf_document:
+        check_cancelled()
+        report_progress("compress", page.number, pdf_document.page_count)
+        for img in page.get_images(full=True):
+            xref = img[0]
+            if xref in compressed_xrefs:
+                continue
+            compressed_xrefs.add(xref)
+            try:
+                data, keys = _recompress_image(pdf_document, xref, image_quality, target_dpi,
+                                               image_dpis.get(xref, 72.0))
+                kind, length = pdf_document.xref_get_key(xref, "Length")
+                if kind != "int" or len(data) < int(length):
+                    _store_image(page, xref, data, keys)
+            except Exception as e:
+                print(f"Error compressing image {xref}: {e}")
+    size = _note_saving(report, "images", pdf_document, size)
+
+    metrics.record_pages("compress_pdf", pdf_document.page_count)
+
+    return _save_compressed(pdf_document, compression_level, report, size, **structure), report
+
+
+# Indirect object references in a PDF object's source ("12 0 R")
+_REFERENCE = re.compile(r"(\d+) 0 R")
+
+# Work of one compression chunk:
+# ([(image xref, re-encoded image, raw image entries)], [(page number, cleaned contents, resources)])
+ChunkResult = Tuple[List[Tuple[int, io.BytesIO, Optional[Dict[str, str]]]], List[Tuple[int, io.BytesIO, Optional[str]]]]
+
+
+@timed("parse")
+def plan_compression_chunks(
+    pdf_file: PdfSource,
+    chunks: int,
+    min_pages: int
+) -> Optional[Tuple[List[List[int]], List[Tuple[int, int]]]]:
+    """
+    Split the work of compressing one document across `chunks` workers.
+
+    Args:
+        pdf_file: PDF to compress
+        chunks: Number of workers
+        min_pages: Documents with fewer pages are not worth splitting
+
+    Returns:
+        (image xrefs per chunk, balanced by stream size; page range [start, stop) per chunk),
+        or None to compress the document in one piece
+    """
+    pdf_document = _open_pdf(pdf_file)
+    try:
+        page_count = pdf_document.page_count
+        if chunks < 2 or page_count < max(2, min_pages):
+            return None
+
+        # Each image once, however many pages use it
+        sizes = {}
+        for page_num in range(page_count):
+            for img in pdf_document.get_page_images(page_num, full=True):
+                if img[0] not in sizes:
+                    kind, length = pdf_document.xref_get_key(img[0], "Length")
+                    sizes[img[0]] = int(length) if kind == "int" else 1
+
+        # Largest images first, each into the chunk with the fewest bytes so far
+        image_chunks: List[List[int]] = [[] for _ in range(chunks)]
+        loads = [0] * chunks
+        for xref, size in sorted(sizes.items(), key=lambda item: -item[1]):
+            idx = loads.index(min(loads))
+            image_chunks[idx].append(xref)
+            loads[idx] += size
+
+        step = -(-page_count // chunks)
+        page_chunks = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+        page_chunks += [(page_count, page_count)] * (chunks - len(page_chunks))
+        return image_chunks, page_chunks
+    finally:
+        pdf_document.close()
+
+
+@timed("process")
+def compress_chunk(
+    pdf_file: PdfSource,
+    xrefs: List[int],
+    pages: Tuple[int, int],
+    compression_level: int = 50,
+    target_dpi: int = 150
+) -> ChunkResult:
+    """
+    One worker's share of a chunked compression: re-encode the images in
+    xrefs and clean the contents of pages [start, stop).
+
+    Returns:
+        ([(xref, image, raw image entries or None)], [(page number, contents, cleaned resources or None)])
+    """
+    _, _, image_quality = _compression_settings(compression_level)
+    pdf_document = _open_pdf(pdf_file, count_pages=False)
+    try:
+        original_length = pdf_document.xref_length()
+
+        images = []
+        for done, xref in enumerate(xrefs):
+            check_cancelled()
+            report_progress("images", done, len(xrefs))
+            try:
+                data, keys = _recompress_image(pdf_document, xref, image_quality, target_dpi)
+                images.append((xref, io.BytesIO(data), keys))
+            except Exception as e:
+                print(f"Error compressing image {xref}: {e}")
+
+        contents = []
+        start, stop = pages
+        for page_num in range(start, stop):
+            check_cancelled()
+            report_progress("compress", page_num - start, stop - start)
+            page = pdf_document[page_num]
+            page.clean_contents(sanitize=True)
+            data = b"".join(pdf_document.xref_stream(xref) for xref in page.get_contents())
+            kind, resources = pdf_document.xref_get_key(page.xref, "Resources")
+            # Resources pointing at objects created by the cleaning only exist in this copy
+            if kind != "dict" or any(int(ref) >= original_length for ref in _REFERENCE.findall(resources)):
+                resources = None
+            contents.append((page_num, io.BytesIO(data), resources))
+        return images, contents
+    finally:
+        pdf_document.close()
+
+
+@timed("process")
+def apply_compression_chunks(
+    pdf_file: PdfSource,
+    results: List[ChunkResult],
+    compression_level: int = 50,
+    measure: bool = False,
+    **structure
+) -> Tuple[io.BytesIO, Optional[Dict[str, int]]]:
+    """
+    Write the cleaned contents and re-encoded images of all chunks into the
+    document and save it once.
+
+    Returns:
+        (compressed PDF, bytes saved per step or None) as from compress_pdf_with_report()
+    """
+    pdf_document = _open_pdf(pdf_file, count_pages=False)
+    report: Optional[Dict[str, int]] = {} if measure else None
+    size = _start_report(report, pdf_document)
+
+    for _, contents in results:
+        for page_num, data, resources in contents:
+            page = pdf_document[page_num]
+            xrefs = page.get_contents()
+            if xrefs:
+                pdf_document.update_stream(xrefs[0], data.read())
+                if len(xrefs) > 1:
+                    page.set_contents(xrefs[0])
+            if resources:
+                pdf_document.xref_set_key(page.xref, "Resources", resources)
+    size = _note_saving(report, "content", pdf_document, size)
+
+    # replace_image() needs a page that uses the image
+    image_pages = {}
+    for page_num in range(pdf_document.page_count):
+        for img in pdf_document.get_page_images(page_num):
+            image_pages.setdefault(img[0], page_num)
+    for images, _ in results:
+        for xref, data, keys in images:
+            if xref in image_pages:
+                _store_image(pdf_document[image_pages[xref]], xref, data.read(), keys)
+    size = _note_saving(report, "images", pdf_document, size)
+
+    metrics.record_pages("compress_pdf", pdf_document.page_count)
+
+    return _save_compressed(pdf_document, compression_level, report, size, **structure), report
+
+
+# Byte-budget analysis: categories every object of a document is counted under
+ANALYSIS_CATEGORIES = ("images", "fonts", "content", "annotations", "metadata", "structure", "other")
+# Image codecs by the last filter of an image stream
+IMAGE_CODECS = {"DCTDecode": "jpeg", "JPXDecode": "jpx", "CCITTFaxDecode": "ccitt", "JBIG2Decode": "jbig2",
+                "FlateDecode": "flate", "LZWDecode": "lzw", "RunLengthDecode": "rle"}
+# Effective DPI bands images are grouped in (upper bounds)
+ANALYSIS_DPI_BANDS = (72, 150, 300)
+# Share of the file a category must reach to change the recommended profile
+ANALYSIS_SIGNIFICANT_SHARE = 0.05
+# Object types counted as document structure (with the cross-reference data)
+_STRUCTURE_TYPES = ("/Catalog", "/Pages", "/Page", "/Outlines", "/ObjStm", "/XRef")
+
+
+def _source_size(source: PdfSource) -> int:
+    """Size in bytes of a PDF source"""
+    if isinstance(source, (UploadDescriptor, SpoolFile)):
+        return source.size
+    if isinstance(source, str):
+        return os.path.getsize(source)
+    if isinstance(source, UploadFile):
+        source = source.file
+    if hasattr(source, "seek"):
+        source.seek(0, io.SEEK_END)
+        return source.tell()
+    return len(source)
+
+
+def _placed_dpis(pdf_document: fitz.Document) -> Dict[int, float]:
+    """
+    Highest effective DPI of each image placed directly on a page. Unlike
+    _image_placements(), images inside form XObjects are skipped: locating
+    them means decoding every image (get_image_rects)
+    """
+    dpis: Dict[int, float] = {}
+    for page in pdf_document:
+        for img in page.get_images(full=True):
+            if img[-1] != 0:
+                continue
+            try:
+                rect = page.get_image_bbox(img)
+            except Exception:
+                continue
+            if rect.is_valid and not rect.is_infinite and rect.width > 0 and rect.height > 0:
+                dpi = max(img[2] * 72 / rect.width, img[3] * 72 / rect.height)
+                dpis[img[0]] = max(dpis.get(img[0], 0.0), dpi)
+    return dpis
+
+
+def _dpi_band(dpi: Optional[float]) -> str:
+    """Label of the effective DPI band of an image ("unplaced": not placed directly on a page)"""
+    if dpi is None:
+        return "unplaced"
+    for bound in ANALYSIS_DPI_BANDS:
+        if dpi <= bound:
+            return f"<={bound}"
+    return f">{ANALYSIS_DPI_BANDS[-1]}"
+
+
+def _recommend_compression(analysis: dict) -> dict:
+    """
+    /compress settings suited to where a document's bytes are, with the
+    reason for each one that differs from the defaults (the form's for
+    compression_level and target_dpi, the config's for the structure steps)
+    """
+    size = max(1, analysis["size"])
+    categories = analysis["categories"]
+    defaults = {
+        "compression_level": 50,
+        "target_dpi": 150,
+        "object_streams": config.COMPRESS_OBJECT_STREAMS,
+        "subset_fonts": config.COMPRESS_SUBSET_FONTS,
+        "remove_metadata": config.COMPRESS_REMOVE_METADATA,
+    }
+    profile = dict(defaults)
+    reasons = {}
+
+    image_share = categories["images"] / size
+    if image_share >= 0.5:
+        profile["compression_level"] = 75
+        reasons["compression_level"] = f"images are {image_share:.0%} of the file"
+    elif analysis["images"]["count"] and image_share < ANALYSIS_SIGNIFICANT_SHARE:
+        # Little to gain from downsampling: keep the images sharp
+        profile["target_dpi"] = 300
+        reasons["target_dpi"] = f"images are under {ANALYSIS_SIGNIFICANT_SHARE:.0%} of the file"
+
+    if analysis["fonts"]["embedded"]["bytes"] >= ANALYSIS_SIGNIFICANT_SHARE * size:
+        profile["subset_fonts"] = True
+        reasons["subset_fonts"] = f"{analysis['fonts']['embedded']['count']} fonts are embedded whole"
+
+    if categories["metadata"] >= ANALYSIS_SIGNIFICANT_SHARE * size:
+        profile["remove_metadata"] = True
+        reasons["remove_metadata"] = f"metadata and thumbnails are {categories['metadata'] / size:.0%} of the file"
+
+    if not analysis["object_streams"] and \
+            categories["structure"] + categories["other"] >= ANALYSIS_SIGNIFICANT_SHARE * size:
+        profile["object_streams"] = True
+        reasons["object_streams"] = f"{analysis['objects']} objects are stored outside object streams"
+
+    profile["reasons"] = [reason for key, reason in reasons.items() if profile[key] != defaults[key]]
+    return profile
+
+
+@timed("process")
+def analyze_pdf(pdf_file: PdfSource) -> dict:
+    """
+    Break a document's bytes down by what they hold, walking its cross-reference
+    table once. Streams are read raw, never decoded (except object streams,
+    whose compressed size is shared out over the objects they hold) and no
+    page is rendered, so this runs in time linear in the objects' size.
+
+    Args:
+        pdf_file: PDF to analyze
+
+    Returns:
+        {"size", "pages", "objects", "object_streams",
+         "categories": bytes per ANALYSIS_CATEGORIES (adding up to size),
+         "images": {"count", "bytes", "pixels", "by_codec", "by_dpi"},
+         "fonts": {"count", "embedded", "subset", "not_embedded"},
+         "duplicates": {"objects", "bytes"} (streams identical to an earlier one, also counted in their category),
+         "recommendation": /compress settings (see _recommend_compression)}
+    """
+    pdf_document = _open_pdf(pdf_file)
+    try:
+        placed_dpis = _placed_dpis(pdf_document)
+        sizes: Dict[int, float] = {}
+        kinds: Dict[int, str] = {}
+        owners: Dict[int, str] = {}  # streams categorized by the object referencing them
+        font_files: Dict[int, bool] = {}  # font program xref -> subset
+        object_streams: List[int] = []
+        codecs: Dict[int, str] = {}
+        pixels: Dict[int, int] = {}
+        digests = set()
+        images = {"count": 0, "bytes": 0, "pixels": 0, "by_codec": {}, "by_dpi": {}}
+        fonts = {"count": 0, "embedded": {"count": 0, "bytes": 0}, "subset": {"count": 0, "bytes": 0}, "not_embedded": 0}
+        duplicates = {"objects": 0, "bytes": 0}
+
+        xref_count = pdf_document.xref_length()
+        for xref in range(1, xref_count):
+            if xref % 1000 == 0:
+                check_cancelled()
+                report_progress("analyze", xref, xref_count)
+            source = pdf_document.xref_object(xref, compressed=True)
+            if source == "null":
+                continue
+            raw = pdf_document.xref_stream_raw(xref) if pdf_document.xref_is_stream(xref) else b""
+            sizes[xref] = len(source) + len(raw)
+            if raw:
+                digest = hashlib.sha256(source.encode() + raw).digest()
+                if digest in digests:
+                    duplicates["objects"] += 1
+                    duplicates["bytes"] += sizes[xref]
+                digests.add(digest)
+
+            obj_type = pdf_document.xref_get_key(xref, "Type")[1]
+            subtype = pdf_document.xref_get_key(xref, "Subtype")[1]
+            if subtype == "/Image":
+                kinds[xref] = "images"
+                names = re.findall(r"/(\w+)", pdf_document.xref_get_key(xref, "Filter")[1])
+                codecs[xref] = IMAGE_CODECS.get(names[-1], names[-1].lower()) if names else "raw"
+                width, height = (pdf_document.xref_get_key(xref, key) for key in ("Width", "Height"))
+                if width[0] == "int" and height[0] == "int":
+                    pixels[xref] = int(width[1]) * int(height[1])
+            elif obj_type == "/Metadata":
+                kinds[xref] = "metadata"
+            elif obj_type == "/FontDescriptor":
+                kinds[xref] = "fonts"
+                name = pdf_document.xref_get_key(xref, "FontName")[1].lstrip("/")
+                # Subset fonts are named with a six-letter tag: ABCDEF+Helvetica
+                subset = len(name) > 7 and name[6] == "+" and name[:6].isalpha() and name[:6].isupper()
+                for ref in _REFERENCE.findall(pdf_document.xref_get_key(xref, "CIDSet")[1]):
+                    owners[int(ref)] = "fonts"
+                files = [pdf_document.xref_get_key(xref, key) for key in ("FontFile", "FontFile2", "FontFile3")]
+                files = [int(value.split()[0]) for kind, value in files if kind == "xref"]
+                for file_xref in files:
+                    font_files[file_xref] = subset
+                if not files:
+                    fonts["not_embedded"] += 1
+            elif obj_type == "/Font":
+                kinds[xref] = "fonts"
+                for key in ("ToUnicode", "Widths", "W", "Encoding", "CIDToGIDMap"):
+                    for ref in _REFERENCE.findall(pdf_document.xref_get_key(xref, key)[1]):
+                        owners[int(ref)] = "fonts"
+                if subtype not in ("/CIDFontType0", "/CIDFontType2"):
+                    fonts["count"] += 1
+                if subtype in ("/Type1", "/TrueType") and pdf_document.xref_get_key(xref, "FontDescriptor")[0] == "null":
+                    fonts["not_embedded"] += 1
+            elif obj_type == "/Annot":
+                kinds[xref] = "annotations"
+                for ref in _REFERENCE.findall(pdf_document.xref_get_key(xref, "AP")[1]):
+                    owners[int(ref)] = "annotations"
+            elif obj_type in _STRUCTURE_TYPES:
+                kinds[xref] = "structure"
+                if obj_type == "/ObjStm":
+                    object_streams.append(xref)
+                if obj_type == "/Page":
+                    for ref in _REFERENCE.findall(pdf_document.xref_get_key(xref, "Contents")[1]):
+                        owners.setdefault(int(ref), "content")
+                    for ref in _REFERENCE.findall(pdf_document.xref_get_key(xref, "Thumb")[1]):
+                        owners[int(ref)] = "metadata"
+            elif subtype == "/Form":
+                kinds[xref] = "content"
+            else:
+                kinds[xref] = "other"
+
+        kind, info = pdf_document.xref_get_key(-1, "Info")
+        if kind == "xref":
+            owners[int(info.split()[0])] = "metadata"
+
+        # Objects inside an object stream take their share of its compressed size
+        for objstm in object_streams:
+            data = pdf_document.xref_stream(objstm)
+            first = int(pdf_document.xref_get_key(objstm, "First")[1])
+            members = [int(number) for number in data[:first].split()[::2] if int(number) in sizes]
+            stored = sum(sizes[xref] for xref in members)
+            if stored:
+                ratio = (sizes[objstm] - len(pdf_document.xref_object(objstm, compressed=True))) / stored
+                sizes[objstm] -= ratio * stored
+                for xref in members:
+                    sizes[xref] *= ratio
+
+        size = _source_size(pdf_file)
+        categories = dict.fromkeys(ANALYSIS_CATEGORIES, 0)
+        for xref, object_size in sizes.items():
+            object_size = int(object_size)
+            if xref in font_files:
+                category = "fonts"
+                embedding = fonts["subset" if font_files[xref] else "embedded"]
+                embedding["count"] += 1
+                embedding["bytes"] += object_size
+            else:
+                category = owners.get(xref, kinds[xref])
+            categories[category] += object_size
+            if xref in codecs:
+                images["count"] += 1
+                images["bytes"] += object_size
+                images["pixels"] += pixels.get(xref, 0)
+                for group, key in (("by_codec", codecs[xref]), ("by_dpi", _dpi_band(placed_dpis.get(xref)))):
+                    band = images[group].setdefault(key, {"count": 0, "bytes": 0})
+                    band["count"] += 1
+                    band["bytes"] += object_size
+        # Headers, cross-reference tables and object delimiters
+        categories["structure"] += max(0, size - sum(categories.values()))
+
+        analysis = {
+            "size": size,
+            "pages": pdf_document.page_count,
+            "objects": len(sizes),
+            "object_streams": len(object_streams),
+            "categories": categories,
+            "images": images,
+            "fonts": fonts,
+            "duplicates": duplicates,
+        }
+        analysis["recommendation"] = _recommend_compression(analysis)
+        return analysis
+    finally:
+        pdf_document.close()
+
+
+@timed("process")
 def compress_pdfs_api(
     files: List[UploadFile],
     compression_level: int = 50,
@@ -614,86 +1751,8 @@ def compress_pdfs_api(
     Returns:
         Compressed PDF(s) as BytesIO object(s)
     """
-    
-    def compress_pdf(pdf_file: UploadFile) -> io.BytesIO:
-        """Compress a single PDF file."""
-        pdf_document = fitz.open(stream=pdf_file.file.read(), filetype='pdf')
-        print(f"Compressing: {pdf_file.filename} with level {compression_level}, DPI {target_dpi}")
-        
-        # Map compression level (1-100) to quality settings
-        # Higher compression level = lower quality, smaller file
-        if compression_level >= 75:  # Maximum compression
-            garbage_level = 4
-            deflate = True
-            image_quality = 50
-        elif compression_level >= 50:  # Balanced
-            garbage_level = 3
-            deflate = True
-            image_quality = 75
-        else:  # Maximum quality
-            garbage_level = 2
-            deflate = True
-            image_quality = 90
-        
-        for page in pdf_document:
-            # Clean page contents
-            page.clean_contents(sanitize=True)
-            
-            # Compress images on the page
-            image_list = page.get_images(full=True)
-            for img_index, img in enumerate(image_list):
-                xref = img[0]
-                try:
-                    # Extract image
-                    base_image = pdf_document.extract_image(xref)
-                    image_bytes = base_image["image"]
-                    image_ext = base_image["ext"]
-                    
-                    # Open image with PIL
-                    img_pil = Image.open(io.BytesIO(image_bytes))
-                    
-                    # Resize image based on target DPI if needed
-                    # Calculate new size based on DPI ratio
-                    current_dpi = img_pil.info.get('dpi', (72, 72))[0]
-                    if current_dpi > target_dpi:
-                        scale_factor = target_dpi / current_dpi
-                        new_size = (int(img_pil.width * scale_factor), int(img_pil.height * scale_factor))
-                        img_pil = img_pil.resize(new_size, Image.Resampling.LANCZOS)
-                    
-                    # Compress image
-                    img_buffer = io.BytesIO()
-                    if image_ext in ["jpg", "jpeg"]:
-                        img_pil.save(img_buffer, format="JPEG", quality=image_quality, optimize=True)
-                    elif image_ext == "png":
-                        img_pil.save(img_buffer, format="PNG", optimize=True)
-                    else:
-                        # For other formats, convert to JPEG
-                        if img_pil.mode in ("RGBA", "LA", "P"):
-                            img_pil = img_pil.convert("RGB")
-                        img_pil.save(img_buffer, format="JPEG", quality=image_quality, optimize=True)
-                    
-                    img_buffer.seek(0)
-                    
-                    # Replace image in PDF
-                    page.replace_image(xref, stream=img_buffer.read())
-                except Exception as e:
-                    print(f"Error compressing image {img_index} on page: {e}")
-                    continue
-
-        # Save the compressed PDF to a BytesIO stream
-        compressed_pdf = io.BytesIO()
-        pdf_document.save(
-            compressed_pdf,
-            deflate=deflate,
-            garbage=garbage_level,
-            clean=True
-        )
-        pdf_document.close()
-        compressed_pdf.seek(0)
-        return compressed_pdf
-
     # Compress all provided PDFs
-    compressed_files = [compress_pdf(file) for file in files]
+    compressed_files = [compress_pdf(file, compression_level, target_dpi) for file in files]
     print(f"Compressed {len(compressed_files)} file(s)")
 
     # If only one file, return it directly
@@ -701,18 +1760,12 @@ def compress_pdfs_api(
         return compressed_files[0], '1'
 
     # If multiple files, zip them together
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for idx, pdf_bytes in enumerate(compressed_files):
-            pdf_bytes.seek(0)
-            zipf.writestr(f"compressed_{idx + 1}.pdf", pdf_bytes.read())
-
-    zip_buffer.seek(0)
-    return zip_buffer, '2'
+    return zip_files(compressed_files, "compressed"), '2'
 
+@timed("process")
 def remove_pages_from_pdf(pdf_stream: io.BytesIO, pages_to_remove: List[int]) -> io.BytesIO:
     # Open the PDF file from the in-memory stream
-    pdf_document = fitz.open(stream=pdf_stream, filetype='pdf')
+    pdf_document = _open_pdf(pdf_stream)
 
     # Sort pages in reverse order to avoid shifting indices when deleting
     pages_to_remove.sort(reverse=True)
@@ -720,17 +1773,19 @@ def remove_pages_from_pdf(pdf_stream: io.BytesIO, pages_to_remove: List[int]) ->
     # Remove specified pages
     for page_num in pages_to_remove:
         pdf_document.delete_page(page_num)
+    metrics.record_pages("remove_pages_from_pdf", len(pages_to_remove))
 
     # Create a new in-memory buffer for the modified PDF
     modified_pdf_stream = io.BytesIO()
-    pdf_document.save(modified_pdf_stream)
+    _save_pdf(pdf_document, modified_pdf_stream)
     modified_pdf_stream.seek(0)  # Go back to the beginning of the stream
 
     return modified_pdf_stream
 
+@timed("process")
 def extract_pages_from_pdf(pdf_stream: io.BytesIO, pages_to_extract: List[int]) -> io.BytesIO:
     # Open the PDF file from the in-memory stream
-    pdf_document = fitz.open(stream=pdf_stream, filetype='pdf')
+    pdf_document = _open_pdf(pdf_stream)
 
     # Create a new PDF to save the extracted pages
     extracted_pdf = fitz.open()
@@ -739,10 +1794,11 @@ def extract_pages_from_pdf(pdf_stream: io.BytesIO, pages_to_extract: List[int])
     for page_num in pages_to_extract:
         if 0 <= page_num < pdf_document.page_count:
             extracted_pdf.insert_pdf(pdf_document, from_page=page_num, to_page=page_num)
+    metrics.record_pages("extract_pages_from_pdf", extracted_pdf.page_count)
 
     # Save the extracted pages to a BytesIO object (in-memory)
     pdf_bytes = io.BytesIO()
-    extracted_pdf.save(pdf_bytes)
+    _save_pdf(extracted_pdf, pdf_bytes)
     pdf_document.close()
     extracted_pdf.close()
 
@@ -750,14 +1806,16 @@ def extract_pages_from_pdf(pdf_stream: io.BytesIO, pages_to_extract: List[int])
     pdf_bytes.seek(0)
     return pdf_bytes
 
+@timed("process")
 def repair_pdf(pdf_stream: io.BytesIO) -> io.BytesIO:
     try:
         # Open the corrupted PDF from the in-memory stream
-        pdf_document = fitz.open(stream=pdf_stream, filetype='pdf')
+        pdf_document = _open_pdf(pdf_stream)
+        metrics.record_pages("repair_pdf", pdf_document.page_count)
         
         # Save the repaired PDF to a new in-memory stream
         repaired_pdf_bytes = io.BytesIO()
-        pdf_document.save(repaired_pdf_bytes)
+        _save_pdf(pdf_document, repaired_pdf_bytes)
         pdf_document.close()
         
         # Seek to the beginning of the in-memory PDF before returning it
@@ -790,6 +1848,7 @@ def repair_pdf(pdf_stream: io.BytesIO) -> io.BytesIO:
 #         raise e
 
 
+@timed("process")
 def is_scanned_pdf(pdf_stream: io.BytesIO) -> bool:
     """
     Detect if a PDF is scanned (image-based) by checking for text content.
@@ -801,8 +1860,7 @@ def is_scanned_pdf(pdf_stream: io.BytesIO) -> bool:
         True if PDF appears to be scanned (no text), False otherwise
     """
     try:
-        pdf_stream.seek(0)
-        doc = fitz.open(stream=pdf_stream, filetype='pdf')
+        doc = _open_pdf(pdf_stream)
         
         # Check first few pages for text content
         pages_to_check = min(3, doc.page_count)
@@ -875,6 +1933,7 @@ def is_scanned_pdf(pdf_stream: io.BytesIO) -> bool:
 # PASSWORD PROTECTION & UNLOCKING
 # ============================================================================
 
+@timed("process")
 def add_password_to_pdf(
     pdf_stream: io.BytesIO,
     user_password: str,
@@ -898,8 +1957,7 @@ def add_password_to_pdf(
         Password-protected PDF as BytesIO
     """
     try:
-        pdf_stream.seek(0)
-        doc = fitz.open(stream=pdf_stream, filetype='pdf')
+        doc = _open_pdf(pdf_stream)
         
         # If no owner password specified, use user password
         if owner_password is None:
@@ -913,7 +1971,8 @@ def add_password_to_pdf(
         output_stream = io.BytesIO()
         
         # Save with encryption
-        doc.save(
+        _save_pdf(
+            doc,
             output_stream,
             encryption=fitz.PDF_ENCRYPT_AES_256,  # Use AES-256 encryption
             user_pw=user_password,
@@ -930,6 +1989,7 @@ def add_password_to_pdf(
         raise e
 
 
+@timed("process")
 def remove_password_from_pdf(
     pdf_stream: io.BytesIO,
     password: str
@@ -948,10 +2008,8 @@ def remove_password_from_pdf(
         Exception if password is incorrect
     """
     try:
-        pdf_stream.seek(0)
-        
         # Try to open with password
-        doc = fitz.open(stream=pdf_stream, filetype='pdf')
+        doc = _open_pdf(pdf_stream)
         
         # Authenticate with password
         if doc.is_encrypted:
@@ -961,7 +2019,7 @@ def remove_password_from_pdf(
         
         # Save without encryption
         output_stream = io.BytesIO()
-        doc.save(output_stream, encryption=fitz.PDF_ENCRYPT_NONE)
+        _save_pdf(doc, output_stream, encryption=fitz.PDF_ENCRYPT_NONE)
         doc.close()
         
         output_stream.seek(0)
@@ -978,6 +2036,7 @@ def remove_password_from_pdf(
 # PAGE NUMBERING
 # ============================================================================
 
+@timed("process")
 def add_page_numbers(
     pdf_stream: io.BytesIO,
     position: str = "bottom-center",
@@ -1011,8 +2070,7 @@ def add_page_numbers(
         PDF with page numbers as BytesIO
     """
     try:
-        pdf_stream.seek(0)
-        doc = fitz.open(stream=pdf_stream, filetype='pdf')
+        doc = _open_pdf(pdf_stream)
         total_pages = doc.page_count
         
         # Position mapping with margins
@@ -1029,6 +2087,8 @@ def add_page_numbers(
         get_position = position_coords.get(position, position_coords["bottom-center"])
         
         for page_num in range(total_pages):
+            check_cancelled()
+            report_progress("number", page_num, total_pages)
             # Skip first page if requested
             if skip_first and page_num == 0:
                 continue
@@ -1063,9 +2123,11 @@ def add_page_numbers(
                 color=color
             )
         
+        metrics.record_pages("add_page_numbers", total_pages)
+        
         # Save the modified PDF
         output_stream = io.BytesIO()
-        doc.save(output_stream)
+        _save_pdf(doc, output_stream)
         doc.close()
         
         output_stream.seek(0)
@@ -1080,6 +2142,7 @@ def add_page_numbers(
 # BLANK PAGE REMOVAL
 # ============================================================================
 
+@timed("process")
 def remove_blank_pages(
     pdf_stream: io.BytesIO,
     threshold: float = 0.99
@@ -1098,13 +2161,14 @@ def remove_blank_pages(
         Tuple of (cleaned PDF as BytesIO, list of removed page numbers)
     """
     try:
-        pdf_stream.seek(0)
-        doc = fitz.open(stream=pdf_stream, filetype='pdf')
+        doc = _open_pdf(pdf_stream)
         
         removed_pages = []
         pages_to_delete = []
         
         for page_num in range(doc.page_count):
+            check_cancelled()
+            report_progress("analyze", page_num, doc.page_count)
             page = doc[page_num]
             
             # Check if page is blank using multiple methods
@@ -1114,13 +2178,15 @@ def remove_blank_pages(
                 removed_pages.append(page_num + 1)  # 1-indexed for user display
                 pages_to_delete.append(page_num)
         
+        metrics.record_pages("remove_blank_pages", doc.page_count)
+        
         # Delete pages in reverse order to maintain indices
         for page_num in reversed(pages_to_delete):
             doc.delete_page(page_num)
         
         # Save the cleaned PDF
         output_stream = io.BytesIO()
-        doc.save(output_stream)
+        _save_pdf(doc, output_stream)
         doc.close()
         
         output_stream.seek(0)
@@ -1163,6 +2229,7 @@ def _is_page_blank(page: fitz.Page, threshold: float = 0.99) -> bool:
         pix = page.get_pixmap(matrix=fitz.Matrix(0.5, 0.5))
         
         # Convert to PIL Image for analysis
+        from PIL import Image
         img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
         
         # Convert to grayscale
@@ -1182,6 +2249,7 @@ def _is_page_blank(page: fitz.Page, threshold: float = 0.99) -> bool:
         return len(text) == 0 and len(images) == 0
 
 
+@timed("process")
 def detect_blank_pages(pdf_stream: io.BytesIO, threshold: float = 0.99) -> List[int]:
     """
     Detect blank pages without removing them (for preview).
@@ -1194,16 +2262,18 @@ def detect_blank_pages(pdf_stream: io.BytesIO, threshold: float = 0.99) -> List[
         List of blank page numbers (1-indexed)
     """
     try:
-        pdf_stream.seek(0)
-        doc = fitz.open(stream=pdf_stream, filetype='pdf')
+        doc = _open_pdf(pdf_stream)
         
         blank_pages = []
         
         for page_num in range(doc.page_count):
+            check_cancelled()
+            report_progress("analyze", page_num, doc.page_count)
             page = doc[page_num]
             if _is_page_blank(page, threshold):
                 blank_pages.append(page_num + 1)  # 1-indexed
         
+        metrics.record_pages("detect_blank_pages", doc.page_count)
         doc.close()
         return blank_pages
         
@@ -1216,6 +2286,7 @@ def detect_blank_pages(pdf_stream: io.BytesIO, threshold: float = 0.99) -> List[
 # PDF TO IMAGE CONVERSION
 # ============================================================================
 
+@timed("process")
 def pdf_to_images(
     pdf_stream: io.BytesIO,
     dpi: int = 150,
@@ -1235,8 +2306,7 @@ def pdf_to_images(
         List of tuples (image_stream, filename)
     """
     try:
-        pdf_stream.seek(0)
-        doc = fitz.open(stream=pdf_stream, filetype='pdf')
+        doc = _open_pdf(pdf_stream)
         
         # Determine which pages to convert
         if pages is None:
@@ -1248,6 +2318,8 @@ def pdf_to_images(
         images = []
         
         for page_num in pages_to_convert:
+            check_cancelled()
+            report_progress("render", len(images), len(pages_to_convert))
             page = doc[page_num]
             
             # Calculate zoom factor from DPI (default PDF is 72 DPI)
@@ -1272,6 +2344,7 @@ def pdf_to_images(
             img_stream.seek(0)
             images.append((img_stream, filename))
         
+        metrics.record_pages("pdf_to_images", len(images))
         doc.close()
         return images
         
@@ -1284,6 +2357,7 @@ def pdf_to_images(
 # FLATTEN PDF
 # ============================================================================
 
+@timed("process")
 def flatten_pdf(pdf_stream: io.BytesIO) -> io.BytesIO:
     """
     Flatten PDF by converting form fields and annotations to static content.
@@ -1296,10 +2370,11 @@ def flatten_pdf(pdf_stream: io.BytesIO) -> io.BytesIO:
         Flattened PDF as BytesIO
     """
     try:
-        pdf_stream.seek(0)
-        doc = fitz.open(stream=pdf_stream, filetype='pdf')
+        doc = _open_pdf(pdf_stream)
         
         for page_num in range(doc.page_count):
+            check_cancelled()
+            report_progress("flatten", page_num, doc.page_count)
             page = doc[page_num]
             
             # Get all annotations (form fields, comments, etc.)
@@ -1315,9 +2390,11 @@ def flatten_pdf(pdf_stream: io.BytesIO) -> io.BytesIO:
             # Apply redactions (flattens annotations)
             page.apply_redactions()
         
+        metrics.record_pages("flatten_pdf", doc.page_count)
+        
         # Remove form fields by creating a new PDF without them
         output_stream = io.BytesIO()
-        doc.save(output_stream, garbage=4, deflate=True, clean=True)
+        _save_pdf(doc, output_stream, garbage=4, deflate=True, clean=True)
         doc.close()
         
         output_stream.seek(0)
@@ -1332,6 +2409,7 @@ def flatten_pdf(pdf_stream: io.BytesIO) -> io.BytesIO:
 # PDF METADATA EDITOR
 # ============================================================================
 
+@timed("process")
 def get_pdf_metadata(pdf_stream: io.BytesIO) -> dict:
     """
     Get PDF metadata information.
@@ -1343,8 +2421,7 @@ def get_pdf_metadata(pdf_stream: io.BytesIO) -> dict:
         Dictionary with metadata
     """
     try:
-        pdf_stream.seek(0)
-        doc = fitz.open(stream=pdf_stream, filetype='pdf')
+        doc = _open_pdf(pdf_stream)
         
         metadata = doc.metadata
         
@@ -1370,6 +2447,7 @@ def get_pdf_metadata(pdf_stream: io.BytesIO) -> dict:
         raise e
 
 
+@timed("process")
 def update_pdf_metadata(
     pdf_stream: io.BytesIO,
     title: Optional[str] = None,
@@ -1393,8 +2471,7 @@ def update_pdf_metadata(
         PDF with updated metadata as BytesIO
     """
     try:
-        pdf_stream.seek(0)
-        doc = fitz.open(stream=pdf_stream, filetype='pdf')
+        doc = _open_pdf(pdf_stream)
         
         # Get current metadata
         metadata = doc.metadata.copy()
@@ -1416,7 +2493,7 @@ def update_pdf_metadata(
         
         # Save with updated metadata
         output_stream = io.BytesIO()
-        doc.save(output_stream, garbage=4, deflate=True)
+        _save_pdf(doc, output_stream, garbage=4, deflate=True)
         doc.close()
         
         output_stream.seek(0)
@@ -1426,3 +2503,5 @@ def update_pdf_metadata(
         print(f"Error updating PDF metadata: {e}")
         raise e
 
+
+metrics.describe("pydf_compress_scan_images_total", "counter", "Scanned images re-encoded as bitonal or grayscale by kind")
@@ -0,0 +1,518 @@
+"""
+Memory admission control for PDF Tool API
+Estimates each request's peak memory, admits or queues it against a global budget
+shared by all worker processes, and learns from the peak RSS actually observed
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from config import config
+from metrics import metrics
+from timing import current_timings
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+MB = 1024 * 1024
+
+# Fixed per-request overhead (interpreter objects, multipart parsing, response buffers)
+BASE_OVERHEAD = 16 * MB
+
+# Used to guess the page count from the upload size before the body is parsed
+DEFAULT_BYTES_PER_PAGE = 100 * 1024
+
+# Per-route cost model: (multiple of upload size, bytes per page)
+OPERATION_PROFILES: Dict[str, Tuple[float, int]] = {
+    "/compress": (4.0, 256 * 1024),
+    "/estimate_compression": (4.0, 256 * 1024),
+    "/analyze_pdf": (1.5, 16 * 1024),
+    "/merge_pdfs": (3.0, 64 * 1024),
+    "/split_pdfs": (4.0, 64 * 1024),
+    "/split_by_page_count": (4.0, 64 * 1024),
+    "/split_by_file_size": (4.0, 128 * 1024),
+    "/extract_pages_separate": (4.0, 64 * 1024),
+    "/pdf_to_images": (2.0, int(1.5 * MB)),
+    "/detect_blank_pages": (2.0, 256 * 1024),
+    "/remove_blank_pages": (3.0, 256 * 1024),
+    "/flatten_pdf": (3.0, 128 * 1024),
+    "/add_watermark": (3.0, 64 * 1024),
+    "/rotatepdf": (3.0, 32 * 1024),
+    "/get_pdf_metadata": (1.5, 0),
+}
+DEFAULT_PROFILE: Tuple[float, int] = (3.0, 64 * 1024)
+
+# Bounds for the learned correction factor per operation
+MIN_CORRECTION, MAX_CORRECTION = 0.25, 8.0
+LEARNING_RATE = 0.2
+
+
+def read_rss() -> Optional[int]:
+    """Current resident set size of this process in bytes (None if unavailable)"""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except Exception:
+        return None
+
+
+def reset_peak_rss() -> bool:
+    """Restart this process's peak RSS (VmHWM) from its current RSS; False where Linux does not support it"""
+    try:
+        with open("/proc/self/clear_refs", "w") as fh:
+            fh.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def read_peak_rss() -> Optional[int]:
+    """Peak resident set size of this process since the last reset_peak_rss(), in bytes"""
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def detect_memory_limit() -> int:
+    """Container memory limit (cgroup v2/v1) or physical memory, in bytes"""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as fh:
+                value = fh.read().strip()
+            if value.isdigit() and int(value) < (1 << 60):
+                return int(value)
+        except OSError:
+            continue
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return 2048 * MB
+
+
+def detect_cpu_limit() -> int:
+    """CPUs this process may use (affinity and cgroup v2 quota)"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as fh:
+            quota, period = fh.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def cpu_share() -> int:
+    """
+    Operation slots and worker processes for one server process: each server
+    worker runs its own pool, so the usable CPUs are split between SERVER_WORKERS
+    """
+    return max(1, detect_cpu_limit() // max(1, config.SERVER_WORKERS))
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# Ledger key suffix of the memory held by a server process's idle worker pool
+BASELINE_SUFFIX = ":pool"
+
+
+def _concurrent_peak(peaks: List[Tuple[float, float, int]]) -> int:
+    """Largest sum of the (start, end, bytes) peaks whose intervals overlap one of them"""
+    return max(
+        sum(size for other_start, other_end, size in peaks if other_start < end and start < other_end)
+        for start, end, _ in peaks
+    )
+
+
+class _Ledger:
+    """
+    Reservations shared by all worker processes, kept in a small JSON file
+    guarded by flock. Entries of dead workers are dropped on every update.
+    Without fcntl (non-POSIX) the ledger is process-local.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.shared = FCNTL_AVAILABLE and bool(path)
+        self._local: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _update(self, mutate) -> Tuple[bool, int]:
+        """Apply mutate(entries) -> bool under the lock; returns (result, reserved total)"""
+        if not self.shared:
+            with self._lock:
+                result = mutate(self._local)
+                return result, sum(self._local.values())
+
+        with self._lock, open(self.path, "a+") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                fh.seek(0)
+                raw = fh.read()
+                try:
+                    entries = json.loads(raw) if raw else {}
+                except ValueError:
+                    entries = {}
+                entries = {
+                    key: size for key, size in entries.items()
+                    if _pid_alive(int(key.split(":", 1)[0]))
+                }
+                result = mutate(entries)
+                fh.seek(0)
+                fh.truncate()
+                json.dump(entries, fh)
+                fh.flush()
+                return result, sum(entries.values())
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def try_reserve(self, key: str, size: int, budget: int) -> Tuple[bool, int]:
+        def mutate(entries):
+            in_use = sum(entries.values())
+            running = sum(size for key, size in entries.items() if not key.endswith(BASELINE_SUFFIX))
+            # An oversized request is still admitted once nothing else is running
+            if in_use + size <= budget or running == 0:
+                entries[key] = size
+                return True
+            return False
+        return self._update(mutate)
+
+    def resize(self, key: str, size: int) -> None:
+        def mutate(entries):
+            if key in entries:
+                entries[key] = size
+            return True
+        self._update(mutate)
+
+    def put(self, key: str, size: int) -> None:
+        """Record size under key whatever the budget (memory already in use)"""
+        def mutate(entries):
+            entries[key] = size
+            return True
+        self._update(mutate)
+
+    def release(self, key: str) -> None:
+        self._update(lambda entries: entries.pop(key, None) is not None)
+
+
+class Reservation:
+    """Memory reserved for one request"""
+
+    def __init__(self, manager: "MemoryBudget", operation: str, upload_bytes: int):
+        self.manager = manager
+        self.operation = operation
+        self.upload_bytes = upload_bytes
+        self.pages: Optional[int] = None
+        self.documents: set = set()
+        self.key = f"{os.getpid()}:{uuid.uuid4().hex[:12]}"
+        self.raw_estimate = manager.raw_estimate(operation, upload_bytes)
+        self.estimate = manager.estimate(operation, upload_bytes)
+        self.rss_start: Optional[int] = None
+        self.rss_peak: Optional[int] = None
+        self.overlapped = False
+        # (start, end, bytes) of the RSS growth of each operation run in a worker process
+        self.worker_peaks: List[Tuple[float, float, int]] = []
+
+    def add_pages(self, pages: int, document: Optional[str] = None) -> None:
+        """
+        Refine the estimate once a document has been opened and its page count is known.
+        A document (identified by its file) that is opened again is not counted twice.
+        """
+        if document is not None:
+            if document in self.documents:
+                return
+            self.documents.add(document)
+        self.pages = (self.pages or 0) + pages
+        raw = self.manager.raw_estimate(self.operation, self.upload_bytes, self.pages)
+        estimate = self.manager.estimate(self.operation, self.upload_bytes, self.pages)
+        self.raw_estimate = raw
+        if estimate > self.estimate:
+            # Already admitted: record the larger footprint so later requests queue
+            self.estimate = estimate
+            self.manager.ledger.resize(self.key, estimate)
+
+
+    def add_worker_peak(self, started: float, finished: float, growth: int) -> None:
+        """Record the memory an operation used in its worker process"""
+        self.worker_peaks.append((started, finished, growth))
+
+
+_current: ContextVar[Optional[Reservation]] = ContextVar("pydf_memory_reservation", default=None)
+
+
+def note_pages(pages: int, document: Optional[str] = None) -> None:
+    """Hook for functions.py: report the page count of a document being processed"""
+    reservation = _current.get()
+    if reservation is not None:
+        reservation.add_pages(pages, document)
+
+
+def note_worker_memory(started: float, finished: float, growth: int) -> None:
+    """Hook for the worker pool: report an operation's peak RSS growth in its worker process"""
+    reservation = _current.get()
+    if reservation is not None:
+        reservation.add_worker_peak(started, finished, growth)
+
+
+@contextmanager
+def reservation_scope(reservation):
+    """Send note_pages() calls to `reservation` (anything with add_pages(pages, document))"""
+    token = _current.set(reservation)
+    try:
+        yield reservation
+    finally:
+        _current.reset(token)
+
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when the admission queue is full or the wait timed out"""
+
+
+class MemoryBudget:
+    """
+    Admission controller.
+
+    estimate = (BASE_OVERHEAD + size_factor * upload_bytes + page_bytes * pages) * correction[operation]
+
+    The correction factor starts at 1.0 and is updated from the RSS growth
+    observed while a request ran alone in its worker.
+    """
+
+    def __init__(self, budget_bytes: int, queue_limit: int, queue_timeout: float, ledger_path: str):
+        self.budget = budget_bytes
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+        self.ledger = _Ledger(ledger_path)
+        self.corrections: Dict[str, float] = {}
+        self._waiters: List[Reservation] = []
+        self._active: Dict[str, Reservation] = {}
+        self._sampler: Optional[threading.Thread] = None
+        self._sampler_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Estimation
+    # ------------------------------------------------------------------
+
+    def raw_estimate(self, operation: str, upload_bytes: int, pages: Optional[int] = None) -> int:
+        size_factor, page_bytes = OPERATION_PROFILES.get(operation, DEFAULT_PROFILE)
+        if pages is None:
+            pages = upload_bytes // DEFAULT_BYTES_PER_PAGE
+        return int(BASE_OVERHEAD + size_factor * upload_bytes + page_bytes * pages)
+
+    def estimate(self, operation: str, upload_bytes: int, pages: Optional[int] = None) -> int:
+        """Estimated peak memory of a request in bytes"""
+        return int(self.raw_estimate(operation, upload_bytes, pages) * self.corrections.get(operation, 1.0))
+
+    def learn(self, reservation: Reservation) -> None:
+        """Update the operation's correction factor from an observed peak"""
+        if reservation.worker_peaks:
+            # The work ran in worker processes: their growth is the request's footprint
+            observed = _concurrent_peak(reservation.worker_peaks) + BASE_OVERHEAD
+        elif reservation.overlapped or reservation.rss_start is None or reservation.rss_peak is None:
+            return
+        else:
+            observed = max(0, reservation.rss_peak - reservation.rss_start) + BASE_OVERHEAD
+        ratio = observed / max(1, reservation.raw_estimate)
+        current = self.corrections.get(reservation.operation, 1.0)
+        updated = (1 - LEARNING_RATE) * current + LEARNING_RATE * ratio
+        self.corrections[reservation.operation] = min(MAX_CORRECTION, max(MIN_CORRECTION, updated))
+        metrics.observe("pydf_memory_estimate_ratio", ratio, {"operation": reservation.operation})
+
+    # ------------------------------------------------------------------
+    # Admission
+    # ------------------------------------------------------------------
+
+    async def acquire(self, operation: str, upload_bytes: int) -> Reservation:
+        """
+        Wait until the request fits in the budget.
+
+        Raises:
+            MemoryBudgetExceeded: If the queue is full or the wait times out
+        """
+        reservation = Reservation(self, operation, upload_bytes)
+
+        # The ledger is a flock'ed file: every update runs off the event loop
+        admitted, _ = await run_in_threadpool(self.ledger.try_reserve, reservation.key, reservation.estimate, self.budget)
+        if not admitted:
+            if len(self._waiters) >= self.queue_limit:
+                metrics.inc("pydf_memory_admission_rejected_total", 1, {"reason": "queue_full"})
+                raise MemoryBudgetExceeded("Server is at its memory limit, please retry")
+
+            self._waiters.append(reservation)
+            start = time.monotonic()
+            delay = 0.02
+            try:
+                while True:
+                    if self._waiters[0] is reservation:
+                        admitted, _ = await run_in_threadpool(
+                            self.ledger.try_reserve, reservation.key, reservation.estimate, self.budget
+                        )
+                        if admitted:
+                            break
+                    if time.monotonic() - start >= self.queue_timeout:
+                        metrics.inc("pydf_memory_admission_rejected_total", 1, {"reason": "timeout"})
+                        raise MemoryBudgetExceeded("Timed out waiting for memory, please retry")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 1.5, 0.25)
+            finally:
+                self._waiters.remove(reservation)
+            waited = time.monotonic() - start
+            metrics.observe("pydf_memory_admission_wait_seconds", waited)
+            timings = current_timings()
+            if timings is not None:
+                timings.add("queue", waited)
+
+        self._start_tracking(reservation)
+        return reservation
+
+    def reserve_baseline(self, size: int) -> None:
+        """
+        Count memory this server process holds outside any request (its
+        worker pool) against the budget; released when the process exits.
+        """
+        key = f"{os.getpid()}{BASELINE_SUFFIX}"
+        if size > 0:
+            self.ledger.put(key, size)
+        else:
+            self.ledger.release(key)
+
+    def release(self, reservation: Reservation) -> None:
+        with self._sampler_lock:
+            self._active.pop(reservation.key, None)
+        self.ledger.release(reservation.key)
+        self.learn(reservation)
+
+    # ------------------------------------------------------------------
+    # Peak RSS sampling
+    # ------------------------------------------------------------------
+
+    def _start_tracking(self, reservation: Reservation) -> None:
+        rss = read_rss()
+        reservation.rss_start = rss
+        reservation.rss_peak = rss
+        with self._sampler_lock:
+            if self._active:
+                reservation.overlapped = True
+                for other in self._active.values():
+                    other.overlapped = True
+            self._active[reservation.key] = reservation
+            if rss is not None and (self._sampler is None or not self._sampler.is_alive()):
+                self._sampler = threading.Thread(target=self._sample, name="pydf-rss-sampler", daemon=True)
+                self._sampler.start()
+
+    def _sample(self, interval: float = 0.02) -> None:
+        """Poll RSS while reservations are active; exits when idle"""
+        while True:
+            with self._sampler_lock:
+                if not self._active:
+                    self._sampler = None
+                    return
+                active = list(self._active.values())
+            rss = read_rss()
+            if rss is not None:
+                for reservation in active:
+                    if reservation.rss_peak is None or rss > reservation.rss_peak:
+                        reservation.rss_peak = rss
+            time.sleep(interval)
+
+
+class MemoryBudgetMiddleware:
+    """
+    ASGI middleware that reserves memory for upload requests before their
+    body is received, using the Content-Length as the upload size.
+    Requests that cannot be admitted get 503 with Retry-After.
+    """
+
+    def __init__(self, app, manager: MemoryBudget, retry_after: int = 5):
+        self.app = app
+        self.manager = manager
+        self.retry_after = retry_after
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("method") != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers", []))
+        if not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            await self.app(scope, receive, send)
+            return
+        try:
+            upload_bytes = int(headers.get(b"content-length", b""))
+        except ValueError:
+            upload_bytes = config.MAX_FILE_SIZE  # unknown length: assume the worst
+
+        try:
+            reservation = await self.manager.acquire(scope.get("path", ""), upload_bytes)
+        except MemoryBudgetExceeded as e:
+            body = json.dumps({"detail": str(e)}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(self.retry_after).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        token = _current.set(reservation)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+            await run_in_threadpool(self.manager.release, reservation)
+
+
+def _budget_bytes() -> int:
+    if config.MEMORY_BUDGET_MB > 0:
+        return config.MEMORY_BUDGET_MB * MB
+    return int(detect_memory_limit() * 0.6)
+
+
+# Create a singleton instance
+memory_budget = MemoryBudget(
+    budget_bytes=_budget_bytes(),
+    queue_limit=config.MEMORY_QUEUE_LIMIT,
+    queue_timeout=config.MEMORY_QUEUE_TIMEOUT,
+    ledger_path=config.MEMORY_LEDGER_PATH,
+)
+
+metrics.describe("pydf_memory_admission_wait_seconds", "histogram", "Time requests waited for memory admission")
+metrics.describe("pydf_memory_admission_rejected_total", "counter", "Requests rejected with 503 by memory admission")
+metrics.describe("pydf_memory_estimate_ratio", "histogram", "Observed peak memory divided by the model estimate",
+                 (0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 4.0, 8.0))
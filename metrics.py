@@ -0,0 +1,460 @@
+"""
+Metrics collection for PDF Tool API
+Prometheus text-format counters, gauges and histograms, merged across worker processes
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import config
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+# Latency buckets in seconds, spanning 1-page metadata reads to multi-minute exports
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0
+)
+
+# Event loop lag buckets in seconds
+LOOP_LAG_BUCKETS: Tuple[float, ...] = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+IMPORT_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Lag below this is scheduler noise, not a blocked loop
+LOOP_BLOCK_THRESHOLD = 0.01
+
+# Counters and histograms of exited workers, folded into one file in the metrics directory
+EXITED_SNAPSHOT = "exited.json"
+LOCK_FILE = ".lock"
+
+
+def _format_labels(labels: Optional[Dict[str, str]]) -> str:
+    """Render a label dict as a stable Prometheus label string (without braces)"""
+    if not labels:
+        return ""
+    parts = []
+    for key in sorted(labels):
+        value = str(labels[key]).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return ",".join(parts)
+
+
+def _merge(snapshots: Iterable[dict]) -> dict:
+    """Sum the counters, gauges and histograms of several snapshots"""
+    merged = {"counters": {}, "gauges": {}, "histograms": {}}
+    for data in snapshots:
+        for kind in ("counters", "gauges"):
+            for name, series in data.get(kind, {}).items():
+                target = merged[kind].setdefault(name, {})
+                for key, value in series.items():
+                    target[key] = target.get(key, 0.0) + value
+        for name, series in data.get("histograms", {}).items():
+            target = merged["histograms"].setdefault(name, {})
+            for key, hist in series.items():
+                current = target.get(key)
+                if current is None or len(current["buckets"]) != len(hist["buckets"]):
+                    target[key] = {"buckets": list(hist["buckets"]), "sum": hist["sum"], "count": hist["count"]}
+                    continue
+                current["buckets"] = [a + b for a, b in zip(current["buckets"], hist["buckets"])]
+                current["sum"] += hist["sum"]
+                current["count"] += hist["count"]
+    return merged
+
+
+def _read_snapshot(path: str) -> Optional[dict]:
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_snapshot(path: str, data: dict) -> None:
+    """Write a snapshot atomically (readers never see a partial file)"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as fh:
+        json.dump(data, fh)
+    os.replace(tmp_path, path)
+
+
+def _pid_alive(pid: int) -> bool:
+    """Check whether a worker process is still running"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricsRegistry:
+    """
+    In-process metric store.
+
+    Each worker keeps its own counters and periodically writes a JSON snapshot
+    to the shared metrics directory. Scraping /metrics merges the snapshots of
+    all workers: counters and histograms are summed over every snapshot, gauges
+    only over workers that are still alive. Snapshots of exited workers are
+    folded into EXITED_SNAPSHOT and deleted, so the directory holds one file
+    per live process plus that one.
+    """
+
+    def __init__(self, directory: Optional[str] = None, flush_interval: float = 1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._meta: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {}
+        self._counters: Dict[str, Dict[str, float]] = {}
+        self._gauges: Dict[str, Dict[str, float]] = {}
+        self._histograms: Dict[str, Dict[str, dict]] = {}
+        self._last_flush = 0.0
+        self._dirty = False
+        self._loop_monitor: Optional[asyncio.Task] = None
+
+        if self.directory:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+            except OSError as e:
+                print(f"Warning: Could not create metrics directory {self.directory}: {e}")
+                self.directory = None
+
+    # ------------------------------------------------------------------
+    # Registration and updates
+    # ------------------------------------------------------------------
+
+    def describe(self, name: str, metric_type: str, help_text: str,
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        """Register a metric name with its type ('counter', 'gauge' or 'histogram')"""
+        self._meta[name] = (metric_type, help_text, tuple(buckets))
+
+    def inc(self, name: str, value: float = 1.0, labels: Optional[Dict[str, str]] = None) -> None:
+        """Increment a counter"""
+        key = _format_labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+            self._dirty = True
+
+    def add_gauge(self, name: str, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        """Add a (possibly negative) delta to a gauge"""
+        key = _format_labels(labels)
+        with self._lock:
+            series = self._gauges.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+            self._dirty = True
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        """Record a histogram observation"""
+        buckets = self._meta.get(name, ("histogram", "", DEFAULT_BUCKETS))[2]
+        key = _format_labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0}
+                series[key] = hist
+            for idx, bound in enumerate(buckets):
+                if value <= bound:
+                    hist["buckets"][idx] += 1
+                    break
+            hist["sum"] += value
+            hist["count"] += 1
+            self._dirty = True
+
+    def reset(self) -> None:
+        """Drop all series; forked workers call this so the parent's data is not counted twice"""
+        with self._lock:
+            self._counters = {}
+            self._gauges = {}
+            self._histograms = {}
+            self._dirty = False
+            self._last_flush = 0.0
+        self._loop_monitor = None
+
+    def record_pages(self, operation: str, pages: int) -> None:
+        """Hook for functions.py: count pages processed by an operation"""
+        if pages > 0:
+            self.inc("pydf_pages_processed_total", pages, {"operation": operation})
+
+    # ------------------------------------------------------------------
+    # Cross-process persistence
+    # ------------------------------------------------------------------
+
+    def snapshot(self) -> dict:
+        """Return a JSON-serializable copy of this process's metrics"""
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "counters": {name: dict(series) for name, series in self._counters.items()},
+                "gauges": {name: dict(series) for name, series in self._gauges.items()},
+                "histograms": {
+                    name: {key: {"buckets": list(h["buckets"]), "sum": h["sum"], "count": h["count"]}
+                           for key, h in series.items()}
+                    for name, series in self._histograms.items()
+                },
+            }
+
+    def flush(self, force: bool = False) -> None:
+        """Write this process's snapshot to the metrics directory (throttled)"""
+        if not self.directory:
+            return
+        now = time.monotonic()
+        if not force and (not self._dirty or now - self._last_flush < self.flush_interval):
+            return
+        self._last_flush = now
+        self._dirty = False
+
+        try:
+            _write_snapshot(os.path.join(self.directory, f"worker_{os.getpid()}.json"), self.snapshot())
+        except OSError as e:
+            print(f"Warning: Could not write metrics snapshot: {e}")
+
+    @contextmanager
+    def _directory_lock(self):
+        """Exclusive lock on the metrics directory across processes (a no-op without fcntl)"""
+        if not FCNTL_AVAILABLE:
+            yield
+            return
+        with open(os.path.join(self.directory, LOCK_FILE), "a") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _fold_exited(self, paths: List[str]) -> None:
+        """Add the counters and histograms of exited workers' snapshots to EXITED_SNAPSHOT, then delete them"""
+        exited_path = os.path.join(self.directory, EXITED_SNAPSHOT)
+        with self._directory_lock():
+            folded = [_read_snapshot(exited_path) or {}]
+            for path in paths:
+                # None: another process folded it first
+                data = _read_snapshot(path)
+                if data is not None:
+                    data["gauges"] = {}
+                    folded.append(data)
+            if len(folded) > 1:
+                _write_snapshot(exited_path, _merge(folded))
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _load_snapshots(self) -> List[dict]:
+        """Load snapshots of all workers, using live data for the current process"""
+        own_pid = os.getpid()
+        snapshots = [self.snapshot()]
+        if not self.directory:
+            return snapshots
+
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return snapshots
+
+        exited = []
+        for name in names:
+            if not (name.startswith("worker_") and name.endswith(".json")):
+                continue
+            path = os.path.join(self.directory, name)
+            data = _read_snapshot(path)
+            if data is None:
+                continue
+            pid = data.get("pid")
+            if pid == own_pid:
+                continue
+            if not isinstance(pid, int) or not _pid_alive(pid):
+                exited.append(path)
+                continue
+            snapshots.append(data)
+
+        try:
+            if exited:
+                self._fold_exited(exited)
+        except OSError as e:
+            print(f"Warning: Could not fold exited workers' metrics: {e}")
+        # Counters of exited workers still count; their gauges do not
+        exited_data = _read_snapshot(os.path.join(self.directory, EXITED_SNAPSHOT))
+        if exited_data is not None:
+            snapshots.append(exited_data)
+        return snapshots
+
+    def collect(self) -> dict:
+        """Merge the snapshots of every worker process into one"""
+        return _merge(self._load_snapshots())
+
+    def clear_stale(self) -> None:
+        """
+        Empty the metrics directory when no other live process has a snapshot
+        in it: metrics left over from a previous run of the server
+        """
+        if not self.directory:
+            return
+        own_pid = os.getpid()
+        try:
+            with self._directory_lock():
+                names = [name for name in os.listdir(self.directory) if name != LOCK_FILE]
+                for name in names:
+                    if name.startswith("worker_") and name.endswith(".json"):
+                        pid = (_read_snapshot(os.path.join(self.directory, name)) or {}).get("pid")
+                        if isinstance(pid, int) and pid != own_pid and _pid_alive(pid):
+                            return
+                for name in names:
+                    os.remove(os.path.join(self.directory, name))
+        except OSError as e:
+            print(f"Warning: Could not clear metrics directory {self.directory}: {e}")
+
+    # ------------------------------------------------------------------
+    # Exposition
+    # ------------------------------------------------------------------
+
+    def render(self) -> str:
+        """Render merged metrics in the Prometheus text exposition format"""
+        self.flush(force=True)
+        merged = self.collect()
+        lines: List[str] = []
+
+        names = sorted(set(self._meta) | set(merged["counters"]) | set(merged["gauges"]) | set(merged["histograms"]))
+        for name in names:
+            metric_type, help_text, buckets = self._meta.get(name, ("untyped", "", DEFAULT_BUCKETS))
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+            if metric_type == "histogram":
+                for key, hist in sorted(merged["histograms"].get(name, {}).items()):
+                    lines.extend(self._render_histogram(name, key, hist, buckets))
+                continue
+
+            series = merged["counters"].get(name) or merged["gauges"].get(name) or {}
+            for key, value in sorted(series.items()):
+                label_str = f"{{{key}}}" if key else ""
+                lines.append(f"{name}{label_str} {value:g}")
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_histogram(name: str, key: str, hist: dict, buckets: Iterable[float]) -> List[str]:
+        lines = []
+        prefix = f"{key}," if key else ""
+        cumulative = 0
+        for bound, count in zip(buckets, hist["buckets"]):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {hist["count"]}')
+        label_str = f"{{{key}}}" if key else ""
+        lines.append(f"{name}_sum{label_str} {hist['sum']:g}")
+        lines.append(f"{name}_count{label_str} {hist['count']}")
+        return lines
+
+    # ------------------------------------------------------------------
+    # Event loop monitoring
+    # ------------------------------------------------------------------
+
+    def ensure_loop_monitor(self, interval: float = 0.1) -> None:
+        """Start the event-loop lag monitor on the running loop (idempotent)"""
+        if self._loop_monitor is not None and not self._loop_monitor.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._loop_monitor = loop.create_task(self._monitor_loop(interval))
+
+    async def _monitor_loop(self, interval: float) -> None:
+        """Measure how late the loop wakes up; lateness is time spent blocked"""
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - start - interval)
+            self.observe("pydf_event_loop_lag_seconds", lag)
+            if lag >= LOOP_BLOCK_THRESHOLD:
+                self.inc("pydf_event_loop_blocked_seconds_total", lag)
+            self.flush()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording per-route request counts, latency,
+    bytes in/out and in-flight requests
+    """
+
+    def __init__(self, app, registry: "MetricsRegistry" = None):
+        self.app = app
+        self.registry = registry or metrics
+        self._known_routes: Optional[set] = None
+
+    def _route_label(self, scope) -> str:
+        """Use the route path as label; collapse unknown paths to keep cardinality bounded"""
+        if self._known_routes is None:
+            app = scope.get("app")
+            routes = getattr(app, "routes", None) or []
+            self._known_routes = {getattr(route, "path", None) for route in routes}
+        path = scope.get("path", "")
+        return path if path in self._known_routes else "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        registry = self.registry
+        registry.ensure_loop_monitor()
+
+        route = self._route_label(scope)
+        method = scope.get("method", "GET")
+        state = {"status": 500, "bytes_in": 0, "bytes_out": 0}
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["bytes_in"] += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                state["bytes_out"] += len(message.get("body", b""))
+            await send(message)
+
+        registry.add_gauge("pydf_http_requests_in_flight", 1, {"route": route})
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            registry.add_gauge("pydf_http_requests_in_flight", -1, {"route": route})
+            registry.inc("pydf_http_requests_total", 1, {"method": method, "route": route, "status": str(state["status"])})
+            registry.observe("pydf_http_request_duration_seconds", elapsed, {"method": method, "route": route})
+            registry.inc("pydf_http_request_bytes_total", state["bytes_in"], {"route": route})
+            registry.inc("pydf_http_response_bytes_total", state["bytes_out"], {"route": route})
+            registry.flush()
+
+
+# Create a singleton instance
+metrics = MetricsRegistry(
+    directory=config.METRICS_DIR if config.METRICS_ENABLED else None,
+    flush_interval=config.METRICS_FLUSH_INTERVAL
+)
+
+metrics.describe("pydf_http_requests_total", "counter", "HTTP requests by method, route and status")
+metrics.describe("pydf_http_request_duration_seconds", "histogram", "HTTP request latency by route")
+metrics.describe("pydf_http_request_bytes_total", "counter", "Request body bytes received by route")
+metrics.describe("pydf_http_response_bytes_total", "counter", "Response body bytes sent by route")
+metrics.describe("pydf_http_requests_in_flight", "gauge", "Requests currently being served by route")
+metrics.describe("pydf_pages_processed_total", "counter", "PDF pages processed by operation")
+metrics.describe("pydf_event_loop_lag_seconds", "histogram", "Event loop wake-up lag", LOOP_LAG_BUCKETS)
+metrics.describe("pydf_event_loop_blocked_seconds_total", "counter", "Time the event loop was blocked by synchronous work")
+metrics.describe("pydf_startup_duration_seconds", "histogram", "Time spent importing modules at worker startup", IMPORT_BUCKETS)
+metrics.describe("pydf_import_duration_seconds", "histogram", "First-import time of top-level packages by phase (startup or lazy)", IMPORT_BUCKETS)
@@ -0,0 +1,253 @@
+"""
+On-demand request profiling for PDF Tool API
+Runs opted-in requests under cProfile and keeps the profile with a hash of the input
+"""
+import cProfile
+import hashlib
+import hmac
+import io
+import json
+import marshal
+import os
+import pstats
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Callable, List, Optional, Tuple
+
+from config import config
+
+PROFILE_HEADER = b"x-profile-token"
+
+# Uploaded files seen by the validator while a profiled request is running
+_profiled_inputs: ContextVar[Optional[List[dict]]] = ContextVar("pydf_profiled_inputs", default=None)
+# Marshalled stats of the operations a profiled request ran in threads or worker processes
+_operation_stats: ContextVar[Optional[List[bytes]]] = ContextVar("pydf_operation_stats", default=None)
+
+
+def note_upload(file) -> None:
+    """
+    Record the SHA-256 of an uploaded file if the current request is being
+    profiled. Called by the validator; a no-op for normal requests.
+    """
+    if _profiled_inputs.get() is None:
+        return
+    digest = hashlib.sha256()
+    size = 0
+    position = file.file.tell()
+    file.file.seek(0)
+    for chunk in iter(lambda: file.file.read(1024 * 1024), b""):
+        digest.update(chunk)
+        size += len(chunk)
+    file.file.seek(position)
+    note_input(file.filename, digest.hexdigest(), size)
+
+
+def note_input(filename: str, sha256: str, size: int) -> None:
+    """Record an input whose hash is already known (ingested uploads)"""
+    inputs = _profiled_inputs.get()
+    if inputs is not None:
+        inputs.append({"filename": filename, "sha256": sha256, "bytes": size})
+
+
+def operation_profiles() -> Optional[List[bytes]]:
+    """Where the current request's operations deliver their stats (None when it is not profiled)"""
+    return _operation_stats.get()
+
+
+def run_profiled(func: Callable[..., Any], *args, **kwargs) -> Tuple[Any, bytes]:
+    """
+    Run func(*args, **kwargs) under cProfile in the calling thread or worker
+    process, which the request's own profiler does not see.
+
+    Returns:
+        (result, marshalled pstats data)
+    """
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        profile.disable()
+    profile.create_stats()
+    return result, marshal.dumps(profile.stats)
+
+
+class _LoadedStats:
+    """Marshalled stats in the shape pstats.Stats.add() loads"""
+
+    def __init__(self, data: bytes):
+        self.stats = marshal.loads(data)
+
+    def create_stats(self) -> None:
+        pass
+
+
+class ProfileStore:
+    """Writes profiles to a local directory and enforces the retention limit"""
+
+    def __init__(self, directory: str, max_profiles: int):
+        self.directory = directory
+        self.max_profiles = max_profiles
+
+    @staticmethod
+    def new_id(input_sha256: str) -> str:
+        """Build a sortable profile id from the current time and the input hash"""
+        return f"{time.strftime('%Y%m%dT%H%M%S')}_{input_sha256[:12]}_{uuid.uuid4().hex[:6]}"
+
+    def save(self, stats: pstats.Stats, meta: dict, profile_id: Optional[str] = None) -> str:
+        """
+        Store a profile and its metadata.
+
+        Files written per profile:
+            <id>.prof  - raw cProfile data (load with pstats or snakeviz)
+            <id>.txt   - top functions by cumulative time
+            <id>.json  - request metadata, including the SHA-256 of every
+                         uploaded file (the files themselves are not kept)
+
+        Returns:
+            The profile id
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        profile_id = profile_id or self.new_id(meta["input_sha256"])
+        base = os.path.join(self.directory, profile_id)
+
+        stats.dump_stats(f"{base}.prof")
+
+        summary = io.StringIO()
+        stats.stream = summary
+        stats.sort_stats("cumulative").print_stats(40)
+        with open(f"{base}.txt", "w") as fh:
+            fh.write(summary.getvalue())
+
+        with open(f"{base}.json", "w") as fh:
+            json.dump({**meta, "profile_id": profile_id}, fh, indent=2)
+
+        self.prune()
+        return profile_id
+
+    def prune(self) -> None:
+        """Delete the oldest profiles beyond the retention limit"""
+        try:
+            metas = [
+                entry for entry in os.scandir(self.directory)
+                if entry.name.endswith(".json")
+            ]
+            metas.sort(key=lambda entry: entry.stat().st_mtime_ns)  # oldest first
+        except OSError:
+            return
+        for entry in metas[:max(0, len(metas) - self.max_profiles)]:
+            base = os.path.join(self.directory, entry.name[:-len(".json")])
+            for ext in (".json", ".prof", ".txt"):
+                try:
+                    os.remove(base + ext)
+                except OSError:
+                    pass
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles a request when it carries a valid
+    X-Profile-Token header.
+
+    cProfile follows the event loop thread, so coroutines of other requests
+    that run while the profiled request awaits show up in the profile too.
+    Operations started with run_cancellable are profiled where they run (a
+    thread or worker process) and merged into the request's profile.
+    Only one request is profiled at a time; concurrent opted-in requests are
+    served normally and answered with 'X-Profile: busy'.
+    """
+
+    def __init__(self, app, token: str, store: ProfileStore):
+        self.app = app
+        self.token = token.encode()
+        self.store = store
+        self._lock = threading.Lock()
+
+    def _requested(self, scope) -> bool:
+        for name, value in scope.get("headers", []):
+            if name == PROFILE_HEADER:
+                return hmac.compare_digest(value, self.token)
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.token or not self._requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        if not self._lock.acquire(blocking=False):
+            await self.app(scope, receive, self._with_header(send, b"x-profile", b"busy"))
+            return
+
+        digest = hashlib.sha256()
+        received = {"bytes": 0}
+        status = {"code": 500}
+        profile_id = {"value": None}
+        inputs: List[dict] = []
+        inputs_token = _profiled_inputs.set(inputs)
+        operations: List[bytes] = []
+        operations_token = _operation_stats.set(operations)
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                body = message.get("body", b"")
+                digest.update(body)
+                received["bytes"] += len(body)
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                # The body has been consumed by now, so the input hashes are final
+                status["code"] = message["status"]
+                input_hash = inputs[0]["sha256"] if inputs else digest.hexdigest()
+                profile_id["value"] = self.store.new_id(input_hash)
+                headers = list(message.get("headers", [])) + [(b"x-profile-id", profile_id["value"].encode())]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            profile.enable()
+            try:
+                await self.app(scope, receive_wrapper, send_wrapper)
+            finally:
+                profile.disable()
+            stats = pstats.Stats(profile)
+            for data in operations:
+                stats.add(_LoadedStats(data))
+            meta = {
+                "method": scope.get("method"),
+                "path": scope.get("path"),
+                "status": status["code"],
+                "duration_seconds": round(time.perf_counter() - start, 4),
+                "input_sha256": inputs[0]["sha256"] if inputs else digest.hexdigest(),
+                "inputs": inputs,
+                "body_sha256": digest.hexdigest(),
+                "body_bytes": received["bytes"],
+                "pid": os.getpid(),
+                "operations": len(operations),
+            }
+            try:
+                saved_id = self.store.save(stats, meta, profile_id["value"])
+                print(f"Profile saved: {saved_id} ({meta['path']}, {meta['duration_seconds']}s)")
+            except OSError as e:
+                print(f"Warning: Could not save profile: {e}")
+        finally:
+            _operation_stats.reset(operations_token)
+            _profiled_inputs.reset(inputs_token)
+            self._lock.release()
+
+    @staticmethod
+    def _with_header(send, name: bytes, value: bytes):
+        async def wrapper(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers", [])) + [(name, value)]}
+            await send(message)
+        return wrapper
+
+
+# Create a singleton instance
+profile_store = ProfileStore(config.PROFILING_DIR, config.PROFILING_MAX_FILES)
@@ -0,0 +1,189 @@
+"""
+Progress streaming for PDF Tool API
+Page loops in functions.py report (stage, pages done, total) through
+report_progress(). Requests that ask for it (Accept: text/event-stream or
+application/x-ndjson, or ?progress=sse|ndjson) get those events streamed as
+they happen, followed by a result event linking to the finished result.
+"""
+import asyncio
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from metrics import metrics
+
+SSE = "sse"
+NDJSON = "ndjson"
+
+# Scope key telling ResultFileResponse to keep the file and send headers only
+DEFER_RESULT_KEY = "pydf.defer_result"
+
+# Seconds between SSE keep-alive comments while an operation reports nothing
+HEARTBEAT_INTERVAL = 15.0
+
+
+class ProgressReporter:
+    """
+    Collects progress events from the operation's thread into the request's
+    event loop. Page events are throttled to one per PROGRESS_MIN_INTERVAL,
+    except when the stage changes.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, min_interval: float):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.min_interval = min_interval
+        self._last_sent = 0.0
+        self._last_stage: Optional[str] = None
+
+    def report(self, stage: str, done: int, total: int) -> None:
+        now = time.monotonic()
+        if stage == self._last_stage and now - self._last_sent < self.min_interval:
+            return
+        self._last_sent = now
+        self._last_stage = stage
+        event = {"event": "progress", "stage": stage, "done": done, "total": total}
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+
+_current: ContextVar[Optional[ProgressReporter]] = ContextVar("pydf_progress", default=None)
+
+
+def report_progress(stage: str, done: int, total: int) -> None:
+    """
+    Hook for page loops: `done` of `total` pages finished in `stage`.
+    A no-op unless the current request streams its progress.
+    """
+    reporter = _current.get()
+    if reporter is not None:
+        reporter.report(stage, done, total)
+
+
+@contextmanager
+def progress_scope(reporter):
+    """Send report_progress() calls to `reporter` (anything with report(stage, done, total))"""
+    token = _current.set(reporter)
+    try:
+        yield reporter
+    finally:
+        _current.reset(token)
+
+
+def _requested_format(scope) -> Optional[str]:
+    query = scope.get("query_string", b"").decode("latin-1")
+    for pair in query.split("&"):
+        key, _, value = pair.partition("=")
+        if key == "progress" and value in (SSE, NDJSON):
+            return value
+    accept = dict(scope.get("headers", [])).get(b"accept", b"")
+    if b"text/event-stream" in accept:
+        return SSE
+    if b"application/x-ndjson" in accept:
+        return NDJSON
+    return None
+
+
+def _encode(event: dict, fmt: str) -> bytes:
+    data = json.dumps(event)
+    if fmt == SSE:
+        return f"event: {event['event']}\ndata: {data}\n\n".encode()
+    return (data + "\n").encode()
+
+
+class ProgressMiddleware:
+    """
+    ASGI middleware that turns a POST into a progress stream on request.
+
+    The operation runs as usual; its response is captured instead of sent.
+    Result files are kept (see DEFER_RESULT_KEY) and announced with their
+    /results/{id} link, other responses are forwarded in the result event.
+    """
+
+    def __init__(self, app, min_interval: float = 0.1):
+        self.app = app
+        self.min_interval = min_interval
+
+    async def __call__(self, scope, receive, send):
+        fmt = _requested_format(scope) if scope["type"] == "http" and scope.get("method") == "POST" else None
+        if fmt is None:
+            await self.app(scope, receive, send)
+            return
+
+        reporter = ProgressReporter(asyncio.get_running_loop(), self.min_interval)
+        scope[DEFER_RESULT_KEY] = True
+        captured = {"status": 500, "headers": {}, "body": b""}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                captured["status"] = message["status"]
+                captured["headers"] = {key.decode("latin-1").lower(): value.decode("latin-1")
+                                       for key, value in message.get("headers", [])}
+            elif message["type"] == "http.response.body":
+                captured["body"] += message.get("body", b"")
+
+        async def run_app():
+            try:
+                await self.app(scope, receive, capture_send)
+            except Exception as e:
+                print(f"Error in streamed operation {scope.get('path')}: {e}")
+                captured.update(status=500, headers={}, body=json.dumps({"detail": "Internal Server Error"}).encode())
+
+        token = _current.set(reporter)
+        try:
+            # The task copies this context: the operation's thread reports to this request's queue
+            task = asyncio.ensure_future(run_app())
+        finally:
+            _current.reset(token)
+
+        media_type = b"text/event-stream" if fmt == SSE else b"application/x-ndjson"
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", media_type),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": _encode({"event": "accepted", "path": scope.get("path")}, fmt),
+                    "more_body": True})
+        metrics.inc("pydf_progress_streams_total", labels={"route": scope.get("path", ""), "format": fmt})
+
+        while not task.done() or not reporter.queue.empty():
+            getter = asyncio.ensure_future(reporter.queue.get())
+            done, _ = await asyncio.wait({getter, task}, timeout=HEARTBEAT_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                await send({"type": "http.response.body", "body": _encode(getter.result(), fmt), "more_body": True})
+                continue
+            getter.cancel()
+            if not done and fmt == SSE:
+                await send({"type": "http.response.body", "body": b": keep-alive\n\n", "more_body": True})
+
+        await send({"type": "http.response.body", "body": _encode(self._result_event(captured), fmt), "more_body": False})
+
+    @staticmethod
+    def _result_event(captured: dict) -> dict:
+        headers = captured["headers"]
+        event = {"event": "result", "status": captured["status"]}
+        extra = {key: value for key, value in headers.items()
+                 if key.startswith("x-") and key != "x-result-id"}
+        if extra:
+            event["headers"] = extra
+        if "x-result-id" in headers:
+            event.update(
+                url=headers.get("content-location"),
+                media_type=headers.get("content-type"),
+                size=int(headers.get("content-length", 0)),
+                content_disposition=headers.get("content-disposition"),
+            )
+        elif headers.get("content-type", "").startswith("application/json"):
+            try:
+                event["body"] = json.loads(captured["body"] or b"null")
+            except ValueError:
+                event["body"] = captured["body"].decode("utf-8", "replace")
+        return event
+
+
+metrics.describe("pydf_progress_streams_total", "counter", "Requests answered with a progress stream")
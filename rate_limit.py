@@ -0,0 +1,244 @@
+"""
+Cost-weighted rate limiting for PDF Tool API
+Charges each client for the work its requests cause (upload size, pages x
+operation weight) against a token bucket shared by all worker processes
+through a small SQLite database.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from config import config
+from metrics import metrics
+
+MB = 1024 * 1024
+
+# Work units charged per page, by route (1.0 = a cheap page operation)
+OPERATION_WEIGHTS: Dict[str, float] = {
+    "/pdf_to_images": 8.0,
+    "/compress": 4.0,
+    "/estimate_compression": 2.0,
+    "/analyze_pdf": 0.1,
+    "/flatten_pdf": 4.0,
+    "/detect_blank_pages": 3.0,
+    "/remove_blank_pages": 3.0,
+    "/add_watermark": 1.5,
+    "/add_page_numbers": 1.0,
+    "/split_by_file_size": 1.0,
+    "/merge_pdfs": 0.5,
+    "/rotatepdf": 0.5,
+    "/get_pdf_metadata": 0.05,
+}
+DEFAULT_WEIGHT = 1.0
+
+# Buckets idle this long are full again and can be deleted
+PRUNE_INTERVAL = 300.0
+
+
+class _BucketStore:
+    """
+    Token buckets in SQLite, updated inside BEGIN IMMEDIATE transactions so
+    concurrent workers never lose a charge. Each process opens its own
+    connection (after a fork the parent's connection is not reused).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._last_prune = 0.0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Buckets are disposable: losing the last updates on power loss is fine
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def update(self, key: str, capacity: float, refill_per_second: float,
+               cost: float, require: Optional[float], floor: float) -> Tuple[bool, float]:
+        """
+        Refill the bucket, then deduct cost.
+
+        Args:
+            key: Client key
+            capacity: Bucket size (burst)
+            refill_per_second: Units added per second
+            cost: Units to deduct
+            require: If set, only deduct when at least this many units are available
+            floor: Lowest balance a charge may leave (bounds the debt)
+
+        Returns:
+            (charged, balance after the update)
+        """
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + max(0.0, now - row[1]) * refill_per_second)
+            charged = require is None or tokens >= require
+            if charged:
+                tokens = max(floor, tokens - cost)
+            conn.execute(
+                "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (key, tokens, now),
+            )
+            if now - self._last_prune > PRUNE_INTERVAL:
+                self._last_prune = now
+                conn.execute("DELETE FROM buckets WHERE updated < ?", (now - capacity / refill_per_second,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return charged, tokens
+
+
+class CostRateLimiter:
+    """
+    Per-client token bucket measured in work units.
+
+    A request is admitted when the client's balance covers its upfront cost
+    (REQUEST units plus upload MB x UNITS_PER_MB). Pages are charged as
+    documents are opened (pages x operation weight) and may push the balance
+    negative, so the next requests wait until the bucket has refilled.
+    """
+
+    def __init__(self, store_path: str, units_per_minute: float, burst_units: float,
+                 request_units: float, units_per_mb: float):
+        self.store = _BucketStore(store_path)
+        self.refill_per_second = units_per_minute / 60.0
+        self.capacity = burst_units
+        self.request_units = request_units
+        self.units_per_mb = units_per_mb
+
+    def upfront_cost(self, upload_bytes: int) -> float:
+        return self.request_units + upload_bytes / MB * self.units_per_mb
+
+    def page_cost(self, operation: str, pages: int) -> float:
+        return pages * OPERATION_WEIGHTS.get(operation, DEFAULT_WEIGHT)
+
+    def admit(self, key: str, operation: str, upload_bytes: int) -> Tuple[bool, float]:
+        """
+        Charge the upfront cost if the client can afford it.
+
+        Returns:
+            (admitted, seconds until it could be admitted when rejected)
+        """
+        cost = self.upfront_cost(upload_bytes)
+        # A single request larger than the bucket is admitted once the bucket is full
+        required = min(cost, self.capacity)
+        admitted, balance = self.store.update(key, self.capacity, self.refill_per_second, cost, required, -self.capacity)
+        if admitted:
+            metrics.inc("pydf_rate_limit_units_total", cost, {"route": operation})
+            return True, 0.0
+        return False, (required - balance) / self.refill_per_second
+
+    def charge(self, key: str, operation: str, pages: int) -> None:
+        """Charge the pages of a document opened by an admitted request"""
+        cost = self.page_cost(operation, pages)
+        if cost > 0:
+            self.store.update(key, self.capacity, self.refill_per_second, cost, None, -self.capacity)
+            metrics.inc("pydf_rate_limit_units_total", cost, {"route": operation})
+
+
+_current: ContextVar[Optional[Tuple[CostRateLimiter, str, str]]] = ContextVar("pydf_rate_limit_client", default=None)
+
+
+def charge_pages(pages: int) -> None:
+    """Hook for functions.py: charge the current client for the pages of a document being processed"""
+    current = _current.get()
+    if current is None or pages <= 0:
+        return
+    limiter, key, operation = current
+    try:
+        limiter.charge(key, operation, pages)
+    except sqlite3.Error as e:
+        print(f"Warning: Could not charge rate limit: {e}")
+
+
+def _client_key(scope) -> str:
+    # Same key as slowapi's get_remote_address
+    client = scope.get("client")
+    return client[0] if client else "127.0.0.1"
+
+
+class CostRateLimitMiddleware:
+    """
+    ASGI middleware that admits POST and PATCH (upload chunk) requests
+    against the client's work-unit balance. Rejected requests get 429 with
+    Retry-After, like slowapi.
+    """
+
+    def __init__(self, app, limiter: CostRateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("method") not in ("POST", "PATCH"):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers", []))
+        try:
+            upload_bytes = int(headers.get(b"content-length", b"0"))
+        except ValueError:
+            upload_bytes = 0
+
+        key = _client_key(scope)
+        operation = scope.get("path", "")
+        try:
+            # BEGIN IMMEDIATE may wait for other workers' transactions: keep it off the event loop
+            admitted, retry_after = await run_in_threadpool(self.limiter.admit, key, operation, upload_bytes)
+        except sqlite3.Error as e:
+            # Never fail requests because the limiter's store is unavailable
+            print(f"Warning: Rate limit store unavailable: {e}")
+            await self.app(scope, receive, send)
+            return
+
+        if not admitted:
+            metrics.inc("pydf_rate_limit_rejected_total", labels={"route": operation})
+            body = json.dumps({"error": "Rate limit exceeded: work budget used up, retry later"}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(max(1, int(retry_after + 0.999))).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        token = _current.set((self.limiter, key, operation))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+
+
+# Create a singleton instance
+cost_limiter = CostRateLimiter(
+    store_path=config.RATE_LIMIT_DB_PATH,
+    units_per_minute=config.RATE_LIMIT_UNITS_PER_MINUTE,
+    burst_units=config.RATE_LIMIT_BURST_UNITS,
+    request_units=config.RATE_LIMIT_REQUEST_UNITS,
+    units_per_mb=config.RATE_LIMIT_UNITS_PER_MB,
+)
+
+metrics.describe("pydf_rate_limit_units_total", "counter", "Work units charged to clients by route")
+metrics.describe("pydf_rate_limit_rejected_total", "counter", "Requests rejected with 429 by the cost-weighted limiter")
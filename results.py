@@ -0,0 +1,254 @@
+"""
+Result files for PDF Tool API
+Operation results are written to RESULT_DIR (off the event loop) and streamed
+from disk in READ_CHUNK_SIZE reads, each in a thread, instead of iterating an
+in-memory BytesIO. Byte ranges are supported, and a result whose
+download was cut off stays at /results/{result_id} until RESULT_TTL, so the
+client can resume it instead of running the operation again.
+"""
+import asyncio
+import io
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from typing import Dict, Optional, Tuple, Union
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+
+from config import config
+from metrics import metrics
+from timing import span
+from progress import DEFER_RESULT_KEY
+from transport import SpoolFile
+
+_RESULT_ID = re.compile(r"^[0-9a-f]{32}$")
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# Bytes per read (and per http.response.body message) when sending a result
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+class ResultStore:
+    """Result files named by id, with a JSON sidecar holding the response headers"""
+
+    def __init__(self, directory: str, ttl: int):
+        self.directory = directory
+        self.ttl = ttl
+        self._ready = False
+        self._last_sweep = 0.0
+
+    def _paths(self, result_id: str) -> Optional[Tuple[str, str]]:
+        if not _RESULT_ID.match(result_id or ""):
+            return None
+        base = os.path.join(self.directory, result_id)
+        return base + ".bin", base + ".json"
+
+    def save(self, content: Union[io.BytesIO, SpoolFile], media_type: str,
+             headers: Optional[Dict[str, str]] = None) -> Tuple[str, str]:
+        """
+        Write a result to disk and free its buffer. A result a worker already
+        wrote to the spool is linked, not copied.
+
+        Returns:
+            (result_id, path)
+        """
+        if not self._ready:
+            os.makedirs(self.directory, exist_ok=True)
+            self._ready = True
+        if time.time() - self._last_sweep > 60:
+            self.sweep()
+
+        result_id = uuid.uuid4().hex
+        path, meta_path = self._paths(result_id)
+        with span("store"):
+            if isinstance(content, SpoolFile):
+                try:
+                    os.link(content.path, path)
+                except OSError:
+                    shutil.copyfile(content.path, path)
+            else:
+                with open(path, "xb") as fh:
+                    fh.write(content.getbuffer())
+            with open(meta_path, "x") as fh:
+                json.dump({"media_type": media_type, "headers": headers or {}}, fh)
+        content.close()
+        return result_id, path
+
+    def load(self, result_id: str) -> Optional[Tuple[str, str, Dict[str, str]]]:
+        """Return (path, media_type, headers) of a stored result, or None"""
+        paths = self._paths(result_id)
+        if paths is None:
+            return None
+        path, meta_path = paths
+        try:
+            with open(meta_path) as fh:
+                meta = json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return None
+        if not os.path.exists(path):
+            return None
+        return path, meta["media_type"], meta["headers"]
+
+    def discard(self, result_id: str) -> None:
+        for path in self._paths(result_id) or ():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def sweep(self) -> int:
+        """Remove results older than the TTL (downloads that were never completed)"""
+        self._last_sweep = time.time()
+        cutoff = self._last_sweep - self.ttl
+        removed = 0
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range Range header into (start, end) inclusive.
+
+    Returns:
+        None to send the whole file (no, multiple or malformed ranges)
+
+    Raises:
+        ValueError: The range cannot be satisfied
+    """
+    match = _RANGE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first == "" and last == "":
+        return None
+    if first == "":
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+class ResultFileResponse(Response):
+    """
+    Sends a result file, honouring Range/If-Range.
+
+    The file is streamed in READ_CHUNK_SIZE blocks read in a thread. It is
+    deleted once it has been sent in full; partial or interrupted downloads
+    keep it for a resume.
+    """
+
+    def __init__(self, result_id: str, path: str, media_type: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(content=None, media_type=media_type, headers=headers)
+        self.result_id = result_id
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        size = os.stat(self.path).st_size
+        etag = f'"{self.result_id}"'
+        request_headers = {key.decode("latin-1").lower(): value.decode("latin-1")
+                           for key, value in scope.get("headers", [])}
+
+        byte_range = None
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if range_header and (if_range is None or if_range == etag):
+            try:
+                byte_range = _parse_range(range_header, size)
+            except ValueError:
+                await self._send_head(send, 416, {"content-range": f"bytes */{size}", "content-length": "0"})
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        start, end = byte_range if byte_range else (0, size - 1)
+        length = end - start + 1 if size else 0
+        extra = {
+            "content-length": str(length),
+            "accept-ranges": "bytes",
+            "etag": etag,
+            "x-result-id": self.result_id,
+            "content-location": f"/results/{self.result_id}",
+        }
+        if byte_range:
+            extra["content-range"] = f"bytes {start}-{end}/{size}"
+        await self._send_head(send, 206 if byte_range else self.status_code, extra)
+
+        if scope.get("method") == "HEAD" or scope.get(DEFER_RESULT_KEY):
+            # Progress streams announce the result; the client downloads it from /results/{id}
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        completed = await self._send_file(scope, receive, send, start, length)
+        metrics.inc("pydf_result_bytes_sent_total", length if completed else 0)
+        if completed and byte_range is None:
+            result_store.discard(self.result_id)
+
+    async def _send_head(self, send, status: int, extra: Dict[str, str]) -> None:
+        headers = [(key, value) for key, value in self.raw_headers if key != b"content-length"]
+        headers += [(key.encode("latin-1"), value.encode("latin-1")) for key, value in extra.items()]
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+
+    async def _send_file(self, scope, receive, send, offset: int, length: int) -> bool:
+        """Send length bytes from offset; False if the client went away first"""
+        with open(self.path, "rb") as fh:
+            disconnected = asyncio.Event()
+
+            async def watch_disconnect():
+                while True:
+                    message = await receive()
+                    if message["type"] == "http.disconnect":
+                        disconnected.set()
+                        return
+
+            watcher = asyncio.ensure_future(watch_disconnect())
+            try:
+                fh.seek(offset)
+                remaining = length
+                while remaining > 0:
+                    chunk = await run_in_threadpool(fh.read, min(READ_CHUNK_SIZE, remaining))
+                    if not chunk or disconnected.is_set():
+                        return False
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+                if length == 0:
+                    await send({"type": "http.response.body", "body": b""})
+                return not disconnected.is_set()
+            finally:
+                watcher.cancel()
+
+
+# Create a singleton instance
+result_store = ResultStore(config.RESULT_DIR, config.RESULT_TTL)
+
+
+async def result_response(content: Union[io.BytesIO, SpoolFile], media_type: str,
+                          headers: Optional[Dict[str, str]] = None) -> ResultFileResponse:
+    """
+    Store an operation's result and return the response that sends it.
+    Awaited in place of StreamingResponse(content, media_type=..., headers=...).
+    """
+    # Writing an in-memory result blocks for its whole size: keep it off the event loop
+    result_id, path = await run_in_threadpool(result_store.save, content, media_type, headers)
+    return ResultFileResponse(result_id, path, media_type, headers)
+
+
+metrics.describe("pydf_result_bytes_sent_total", "counter", "Result bytes sent from result files")
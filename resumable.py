@@ -0,0 +1,404 @@
+"""
+Resumable uploads for PDF Tool API
+Large files are uploaded in chunks written at their offset into a preallocated
+file, so an interrupted upload resumes from the missing ranges and chunks can
+be sent in parallel. A finished upload is verified against its SHA-256 and can
+then be passed by id (upload_id / upload_ids) to any operation instead of a file.
+The endpoint input dependencies also accept stored blobs by SHA-256.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import AsyncIterator, List, Optional, Union
+
+from fastapi import File, Form, HTTPException, Request, UploadFile
+from starlette.concurrency import run_in_threadpool
+
+from config import config
+from metrics import metrics
+from validation import SNIFF_BYTES, UploadDescriptor, validator
+from blob_store import blob_store, set_owner
+from scheduler import client_key
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+
+
+def _add_range(ranges: List[List[int]], start: int, end: int) -> List[List[int]]:
+    """Insert [start, end) into sorted, non-overlapping ranges and merge neighbours"""
+    merged: List[List[int]] = []
+    for current in sorted(ranges + [[start, end]]):
+        if merged and current[0] <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], current[1])
+        else:
+            merged.append(list(current))
+    return merged
+
+
+def _missing_ranges(ranges: List[List[int]], size: int) -> List[List[int]]:
+    missing = []
+    position = 0
+    for start, end in ranges:
+        if start > position:
+            missing.append([position, start])
+        position = max(position, end)
+    if position < size:
+        missing.append([position, size])
+    return missing
+
+
+class ResumableUploadStore:
+    """
+    Upload sessions on local disk: `<id>.part` holds the bytes, `<id>.json`
+    the state (declared size and hash, received ranges). State updates are
+    guarded by flock so chunks of one upload can land on different workers.
+    """
+
+    def __init__(self, directory: str, ttl: int, chunk_size: int):
+        self.directory = directory
+        self.ttl = ttl
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def _paths(self, upload_id: str):
+        if not _UPLOAD_ID.match(upload_id or ""):
+            raise HTTPException(status_code=404, detail="Upload not found")
+        base = os.path.join(self.directory, upload_id)
+        return base + ".part", base + ".json"
+
+    def _ensure_directory(self) -> None:
+        if not self._ready:
+            os.makedirs(self.directory, exist_ok=True)
+            self._ready = True
+
+    @contextmanager
+    def _state(self, upload_id: str, write: bool = True):
+        """Load an upload's state under the lock and save it back on exit"""
+        _, meta_path = self._paths(upload_id)
+        try:
+            fh = open(meta_path, "r+")
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Upload not found")
+        with self._lock, fh:
+            if FCNTL_AVAILABLE:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                state = json.load(fh)
+                yield state
+                if write:
+                    state["updated"] = time.time()
+                    fh.seek(0)
+                    fh.truncate()
+                    json.dump(state, fh)
+                    fh.flush()
+            finally:
+                if FCNTL_AVAILABLE:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _summary(self, upload_id: str, state: dict) -> dict:
+        received = sum(end - start for start, end in state["ranges"])
+        return {
+            "upload_id": upload_id,
+            "filename": state["filename"],
+            "size": state["size"],
+            "received": received,
+            "missing": _missing_ranges(state["ranges"], state["size"]),
+            "complete": state["complete"],
+            "chunk_size": self.chunk_size,
+            "expires_at": int(state["updated"] + self.ttl),
+        }
+
+    def create(self, filename: str, size: int, sha256: Optional[str] = None) -> dict:
+        """
+        Start an upload of `size` bytes.
+
+        Args:
+            filename: Original file name
+            size: Total size in bytes
+            sha256: Expected hex digest (may instead be given when completing)
+
+        Returns:
+            Upload status with the new upload_id
+        """
+        if size <= 0:
+            raise HTTPException(status_code=400, detail="Upload size must be greater than 0")
+        if size > config.MAX_FILE_SIZE:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File size ({size / (1024 * 1024):.2f}MB) exceeds maximum allowed size "
+                       f"({config.MAX_FILE_SIZE / (1024 * 1024):.0f}MB)"
+            )
+        if sha256 is not None and not _SHA256.match(sha256.lower()):
+            raise HTTPException(status_code=400, detail="sha256 must be a 64 character hex digest")
+
+        self._ensure_directory()
+        self.sweep()
+        upload_id = uuid.uuid4().hex
+        data_path, meta_path = self._paths(upload_id)
+        with open(data_path, "xb") as fh:
+            # Sparse file of the final size: chunks are written in place at their offset
+            fh.truncate(size)
+        now = time.time()
+        state = {
+            "filename": validator.sanitize_filename(filename),
+            "original_filename": filename,
+            "size": size,
+            "sha256": sha256.lower() if sha256 else None,
+            "ranges": [],
+            "complete": False,
+            "mime_type": None,
+            "created": now,
+            "updated": now,
+        }
+        with open(meta_path, "x") as fh:
+            json.dump(state, fh)
+        return self._summary(upload_id, state)
+
+    def status(self, upload_id: str) -> dict:
+        with self._state(upload_id, write=False) as state:
+            return self._summary(upload_id, state)
+
+    async def write_chunk(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> dict:
+        """
+        Write a chunk's bytes at offset as they arrive.
+
+        Bytes written before a client disconnect are still recorded, so the
+        retry only has to send what is missing.
+        """
+        data_path, _ = self._paths(upload_id)
+        # State updates take the store's lock and the upload's flock: never on the event loop
+        size, complete = await run_in_threadpool(self._size_and_complete, upload_id)
+        if complete:
+            raise HTTPException(status_code=409, detail="Upload is already complete")
+        if offset < 0 or offset >= size:
+            raise HTTPException(status_code=400, detail=f"Upload-Offset must be between 0 and {size - 1}")
+
+        written = 0
+        fd = os.open(data_path, os.O_WRONLY)
+        try:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                if offset + written + len(chunk) > size:
+                    raise HTTPException(status_code=400, detail="Chunk extends past the declared upload size")
+                view = memoryview(chunk)
+                while view:
+                    count = os.pwrite(fd, view, offset + written)
+                    written += count
+                    view = view[count:]
+        finally:
+            os.close(fd)
+            if written:
+                await run_in_threadpool(self._record_range, upload_id, offset, offset + written)
+                metrics.inc("pydf_resumable_upload_bytes_total", written)
+
+        return await run_in_threadpool(self.status, upload_id)
+
+    def _size_and_complete(self, upload_id: str):
+        with self._state(upload_id, write=False) as state:
+            return state["size"], state["complete"]
+
+    def _record_range(self, upload_id: str, start: int, end: int) -> None:
+        with self._state(upload_id) as state:
+            state["ranges"] = _add_range(state["ranges"], start, end)
+
+    def complete(self, upload_id: str, sha256: Optional[str] = None) -> dict:
+        """
+        Verify a fully received upload against its SHA-256 and type.
+
+        Raises:
+            HTTPException: 409 while ranges are missing, 422 on a hash mismatch
+                (the received ranges are reset), 415 for a disallowed type
+        """
+        data_path, _ = self._paths(upload_id)
+        error: Optional[HTTPException] = None
+        with self._state(upload_id, write=False) as state:
+            if state["complete"]:
+                return self._summary(upload_id, state)
+            missing = _missing_ranges(state["ranges"], state["size"])
+            if missing:
+                raise HTTPException(status_code=409, detail=f"Upload is missing byte ranges: {missing[:10]}")
+            expected = (sha256 or state["sha256"] or "").lower()
+            if not _SHA256.match(expected):
+                raise HTTPException(status_code=400, detail="sha256 is required to complete the upload")
+            written = os.stat(data_path).st_mtime_ns
+
+        # Hashed without the lock, so other uploads (and this one's status) are not held up
+        digest = hashlib.sha256()
+        with open(data_path, "rb") as fh:
+            head = fh.read(config.INGEST_CHUNK_SIZE)
+            chunk = head
+            while chunk:
+                digest.update(chunk)
+                chunk = fh.read(config.INGEST_CHUNK_SIZE)
+        mime_type = validator.detect_mime_type(head)
+
+        with self._state(upload_id) as state:
+            if state["complete"]:
+                return self._summary(upload_id, state)
+            if os.stat(data_path).st_mtime_ns != written:
+                # A chunk was rewritten while hashing: the digest may not match the file
+                raise HTTPException(status_code=409, detail="Upload changed while it was verified, complete it again")
+            if digest.hexdigest() != expected:
+                # Saved with the state: the client has to send every range again
+                state["ranges"] = []
+                metrics.inc("pydf_resumable_upload_failed_total", labels={"reason": "sha256"})
+                error = HTTPException(status_code=422, detail="SHA-256 mismatch: the upload has to be sent again")
+            elif mime_type not in config.ALLOWED_FILE_TYPES:
+                metrics.inc("pydf_resumable_upload_failed_total", labels={"reason": "type"})
+                error = HTTPException(
+                    status_code=415,
+                    detail=f"Invalid file type. Detected: {mime_type}. "
+                           f"Allowed types: {', '.join(config.ALLOWED_FILE_TYPES)}"
+                )
+            else:
+                state.update(sha256=expected, mime_type=mime_type, complete=True)
+                summary = self._summary(upload_id, state)
+        if error is not None:
+            raise error
+        blob_store.add(data_path, expected)
+        return summary
+
+    def descriptor(self, upload_id: str) -> UploadDescriptor:
+        """Descriptor of a completed upload, for use as an operation's input"""
+        data_path, _ = self._paths(upload_id)
+        # Using an upload keeps it alive for another TTL
+        with self._state(upload_id) as state:
+            if not state["complete"]:
+                raise HTTPException(status_code=409, detail="Upload is not complete")
+            return UploadDescriptor(
+                filename=state["filename"],
+                original_filename=state["original_filename"],
+                mime_type=state["mime_type"],
+                size=state["size"],
+                sha256=state["sha256"],
+                path=data_path,
+            )
+
+    def delete(self, upload_id: str) -> None:
+        data_path, meta_path = self._paths(upload_id)
+        if not os.path.exists(meta_path):
+            raise HTTPException(status_code=404, detail="Upload not found")
+        for path in (meta_path, data_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def sweep(self) -> int:
+        """Remove uploads whose state was not touched for longer than the TTL"""
+        removed = 0
+        cutoff = time.time() - self.ttl
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return 0
+        names = {entry.name for entry in entries}
+        for entry in entries:
+            name, ext = os.path.splitext(entry.name)
+            try:
+                if ext == ".json" and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    if name + ".part" in names:
+                        os.remove(os.path.join(self.directory, name + ".part"))
+                    removed += 1
+                elif ext == ".part" and name + ".json" not in names and entry.stat().st_mtime < cutoff:
+                    # Left behind by a crash while creating the upload
+                    os.remove(entry.path)
+            except OSError:
+                continue
+        return removed
+
+
+# Create a singleton instance
+resumable_uploads = ResumableUploadStore(
+    directory=config.RESUMABLE_UPLOAD_DIR,
+    ttl=config.RESUMABLE_UPLOAD_TTL,
+    chunk_size=config.RESUMABLE_CHUNK_SIZE,
+)
+
+
+def blob_input(sha256: str) -> UploadDescriptor:
+    """
+    Descriptor of a stored blob, linked into the request's spool.
+
+    Raises:
+        HTTPException: 404 when the blob is not (or no longer) stored
+    """
+    sha256 = sha256.strip().lower()
+    checked_out = blob_store.checkout(sha256)
+    if checked_out is None:
+        raise HTTPException(status_code=404, detail=f"No stored blob with sha256 {sha256[:64]}")
+    path, size = checked_out
+    with open(path, "rb") as fh:
+        mime_type = validator.detect_mime_type(fh.read(SNIFF_BYTES))
+    extension = ".pdf" if mime_type == "application/pdf" else ""
+    return UploadDescriptor(
+        filename=f"{sha256[:16]}{extension}",
+        original_filename=f"{sha256[:16]}{extension}",
+        mime_type=mime_type,
+        size=size,
+        sha256=sha256,
+        path=path,
+    )
+
+
+async def upload_input(
+    request: Request,
+    file: Optional[UploadFile] = File(None),
+    upload_id: Optional[str] = Form(None),
+    blob_sha256: Optional[str] = Form(None),
+) -> Union[UploadFile, UploadDescriptor]:
+    """
+    Endpoint input: a file in the request, the id of a completed resumable
+    upload, or the SHA-256 of a stored blob
+    """
+    set_owner(client_key(request))
+    if upload_id:
+        return await run_in_threadpool(resumable_uploads.descriptor, upload_id)
+    if blob_sha256:
+        return blob_input(blob_sha256)
+    if file is None:
+        raise HTTPException(status_code=422, detail="One of file, upload_id or blob_sha256 is required")
+    return file
+
+
+def _split(values: Optional[List[str]]) -> List[str]:
+    # Repeated fields or a single comma-separated field
+    return [item.strip() for value in values or [] for item in value.split(",") if item.strip()]
+
+
+async def upload_inputs(
+    request: Request,
+    files: Optional[List[UploadFile]] = File(None),
+    upload_ids: Optional[List[str]] = Form(None),
+    blob_sha256s: Optional[List[str]] = Form(None),
+) -> List[Union[UploadFile, UploadDescriptor]]:
+    """
+    Multi-file endpoint input, in order: files in the request, then completed
+    uploads, then stored blobs
+    """
+    set_owner(client_key(request))
+    inputs: List[Union[UploadFile, UploadDescriptor]] = list(files or [])
+    for upload_id in _split(upload_ids):
+        inputs.append(await run_in_threadpool(resumable_uploads.descriptor, upload_id))
+    inputs.extend(blob_input(sha256) for sha256 in _split(blob_sha256s))
+    if not inputs:
+        raise HTTPException(status_code=422, detail="One of files, upload_ids or blob_sha256s is required")
+    return inputs
+
+
+metrics.describe("pydf_resumable_upload_bytes_total", "counter", "Bytes received in resumable upload chunks")
+metrics.describe("pydf_resumable_upload_failed_total", "counter", "Resumable uploads rejected when completing")
@@ -0,0 +1,181 @@
+"""
+Job scheduling for PDF Tool API
+Operations run through run_cancellable() take one of SCHEDULER_WORKERS slots.
+When all slots are busy, waiting jobs are ordered by weighted fair queuing:
+each job's tag is its client's previous tag (or the current virtual time)
+plus its estimated cost, so short jobs go first and a client sending a batch
+of heavy jobs only delays its own later work. Slots are per worker process.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Dict, Iterable, List, Tuple
+
+import fitz
+from fastapi import Request
+from starlette.concurrency import run_in_threadpool
+
+from config import config
+from metrics import metrics
+from memory_budget import DEFAULT_BYTES_PER_PAGE, cpu_share
+from rate_limit import OPERATION_WEIGHTS, DEFAULT_WEIGHT
+from validation import UploadDescriptor
+
+# Cost of a job before its pages (opening documents, building the response)
+BASE_COST = 1.0
+
+
+class Job:
+    """One operation waiting for or holding a slot"""
+
+    def __init__(self, client: str, operation: str, cost: float, start: float, finish: float):
+        self.client = client
+        self.operation = operation
+        self.cost = cost
+        self.start = start
+        self.finish = finish
+        self.ready: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued = time.monotonic()
+        self.running = False
+
+
+def _uploads(args: Iterable) -> List[UploadDescriptor]:
+    uploads = []
+    for arg in args:
+        if isinstance(arg, UploadDescriptor):
+            uploads.append(arg)
+        elif isinstance(arg, (list, tuple)):
+            uploads.extend(item for item in arg if isinstance(item, UploadDescriptor))
+    return uploads
+
+
+def _page_count(upload: UploadDescriptor) -> int:
+    if upload.mime_type == "application/pdf":
+        try:
+            with fitz.open(upload.path, filetype="pdf") as doc:
+                return doc.page_count
+        except Exception:
+            pass
+    return max(1, upload.size // DEFAULT_BYTES_PER_PAGE)
+
+
+def estimate_cost(operation: str, args: Iterable, count_pages: bool = True) -> float:
+    """
+    Estimated cost of an operation in work units (the rate limiter's weights).
+
+    Args:
+        operation: Route of the operation
+        args: Arguments of the operation; its UploadDescriptors are counted
+        count_pages: Open PDFs for their page count instead of guessing it from the size
+
+    Returns:
+        BASE_COST plus pages x the operation's weight
+    """
+    pages = 0
+    for upload in _uploads(args):
+        pages += _page_count(upload) if count_pages else max(1, upload.size // DEFAULT_BYTES_PER_PAGE)
+    return BASE_COST + pages * OPERATION_WEIGHTS.get(operation, DEFAULT_WEIGHT)
+
+
+def client_key(request: Request) -> str:
+    """The API key header when present, else the client IP"""
+    api_key = request.headers.get(config.SCHEDULER_CLIENT_HEADER) if config.SCHEDULER_CLIENT_HEADER else None
+    if api_key:
+        return f"key:{api_key}"
+    return f"ip:{request.client.host if request.client else '127.0.0.1'}"
+
+
+class JobScheduler:
+    """
+    Slots with a fair queue in front of them.
+
+    A job of cost c from client k gets start = max(virtual_time, finish[k])
+    and finish[k] = start + c; the waiting job with the smallest finish tag
+    runs next and advances virtual_time to its start tag.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._running = 0
+        self._queue: List[Tuple[float, int, Job]] = []
+        self._finish: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def _tag(self, client: str, cost: float) -> Tuple[float, float]:
+        start = max(self._virtual_time, self._finish.get(client, 0.0))
+        self._finish[client] = start + cost
+        return start, start + cost
+
+    async def submit(self, request: Request, args: Iterable) -> Job:
+        """
+        Queue an operation; its `ready` future is done once it holds a slot.
+        Every submitted job must be passed to release().
+        """
+        operation = request.url.path
+        client = client_key(request)
+        if self._running < self.workers and not self._queue:
+            # A slot is free: no need to open the documents for an exact count
+            cost = estimate_cost(operation, args, count_pages=False)
+        else:
+            cost = await run_in_threadpool(estimate_cost, operation, args)
+
+        job = Job(client, operation, cost, *self._tag(client, cost))
+        heapq.heappush(self._queue, (job.finish, next(self._seq), job))
+        metrics.add_gauge("pydf_scheduler_queue_depth", 1)
+        self._dispatch()
+        return job
+
+    def _dispatch(self) -> None:
+        while self._running < self.workers and self._queue:
+            _, _, job = heapq.heappop(self._queue)
+            metrics.add_gauge("pydf_scheduler_queue_depth", -1)
+            self._running += 1
+            job.running = True
+            self._virtual_time = max(self._virtual_time, job.start)
+            job.ready.set_result(None)
+            metrics.add_gauge("pydf_scheduler_running", 1)
+
+            waited = time.monotonic() - job.enqueued
+            metrics.observe("pydf_scheduler_wait_seconds", waited, {"route": job.operation})
+            metrics.observe("pydf_scheduler_job_cost", job.cost, {"route": job.operation})
+
+    def release(self, job: Job) -> None:
+        """Free the job's slot, or withdraw it from the queue if it never ran"""
+        if job.running:
+            job.running = False
+            self._running -= 1
+            metrics.add_gauge("pydf_scheduler_running", -1)
+        elif not job.ready.done():
+            # Withdrawn while waiting (client gone or the request failed)
+            job.ready.cancel()
+            self._queue = [entry for entry in self._queue if entry[2] is not job]
+            heapq.heapify(self._queue)
+            metrics.add_gauge("pydf_scheduler_queue_depth", -1)
+        # Clients whose tags are behind the virtual time have no advantage left to keep
+        if len(self._finish) > 1024:
+            self._finish = {key: tag for key, tag in self._finish.items() if tag > self._virtual_time}
+        self._dispatch()
+
+
+def _workers() -> int:
+    if not config.SCHEDULER_ENABLED:
+        return 0
+    if config.SCHEDULER_WORKERS > 0:
+        return config.SCHEDULER_WORKERS
+    return cpu_share()
+
+
+# Create a singleton instance
+scheduler = JobScheduler(_workers())
+
+metrics.describe("pydf_scheduler_queue_depth", "gauge", "Operations waiting for a scheduler slot")
+metrics.describe("pydf_scheduler_running", "gauge", "Operations holding a scheduler slot")
+metrics.describe("pydf_scheduler_wait_seconds", "histogram", "Time operations waited for a scheduler slot")
+metrics.describe("pydf_scheduler_job_cost", "histogram", "Estimated cost of scheduled operations in work units",
+                 (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000))
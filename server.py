@@ -0,0 +1,284 @@
+"""
+Preforking server for PDF Tool API
+Imports fitz and the app once in a parent process, then forks uvicorn workers
+that share those pages copy-on-write. Workers are replaced when they exit,
+after SERVER_MAX_REQUESTS requests or when their RSS passes SERVER_MAX_WORKER_RSS_MB.
+
+Run with: python server.py
+"""
+import gc
+import importlib
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from typing import Dict, Optional
+
+from config import config
+
+MB = 1024 * 1024
+
+
+def _rss_of(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def worker_count() -> int:
+    """
+    Number of workers to fork.
+
+    SERVER_WORKERS wins when set; otherwise one worker per usable CPU, capped so
+    that the workers fit in 80% of the memory limit, each counted as
+    SERVER_WORKER_MEMORY_MB plus WORKER_PROCESS_MEMORY_MB per PDF worker process
+    of its pool (the CPUs are split between the workers' pools, see
+    memory_budget.cpu_share).
+    """
+    if config.SERVER_WORKERS > 0:
+        return config.SERVER_WORKERS
+    from memory_budget import detect_cpu_limit, detect_memory_limit
+    budget = detect_memory_limit() * 0.8
+    cpus = detect_cpu_limit()
+    for workers in range(cpus, 1, -1):
+        if workers * _worker_memory(cpus, workers) <= budget:
+            return workers
+    return 1
+
+
+def _worker_memory(cpus: int, workers: int) -> int:
+    """Expected peak of one server worker and its PDF worker processes, in bytes"""
+    memory = config.SERVER_WORKER_MEMORY_MB * MB
+    if config.WORKER_PROCESSES_ENABLED:
+        pool = config.SCHEDULER_WORKERS if config.SCHEDULER_ENABLED and config.SCHEDULER_WORKERS > 0 \
+            else max(1, cpus // workers)
+        memory += pool * config.WORKER_PROCESS_MEMORY_MB * MB
+    return memory
+
+
+def _event_loop_and_parser() -> tuple:
+    """Pick uvloop/httptools when installed, else asyncio/h11"""
+    loop, http = "asyncio", "h11"
+    if sys.platform != "win32":
+        try:
+            import uvloop  # noqa: F401
+            loop = "uvloop"
+        except ImportError:
+            pass
+    try:
+        import httptools  # noqa: F401
+        http = "httptools"
+    except ImportError:
+        pass
+    return loop, http
+
+
+def _bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(config.SERVER_BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+class PreforkServer:
+    """
+    Parent process: preloads the app, binds the listening socket, forks
+    workers and keeps their number constant until it receives SIGTERM/SIGINT.
+    """
+
+    def __init__(self, host: str, port: int, workers: int):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.loop, self.http = _event_loop_and_parser()
+        self.children: Dict[int, float] = {}  # pid -> start time
+        self.app = None
+        self.sock: Optional[socket.socket] = None
+        self._stopping = False
+
+    # ------------------------------------------------------------------
+    # Parent
+    # ------------------------------------------------------------------
+
+    def preload(self) -> None:
+        """Import the app and warm MuPDF before forking so workers share the pages"""
+        started = time.perf_counter()
+        import fitz
+        from dapi import app
+        self.app = app
+
+        # The server's own modules too, or every (re)spawned worker imports them again
+        server_modules = ["uvicorn", f"uvicorn.protocols.http.{self.http}_impl", "uvicorn.lifespan.on"]
+        if self.loop == "uvloop":
+            server_modules.append("uvloop")
+        for name in server_modules + config.SERVER_PRELOAD_MODULES:
+            try:
+                importlib.import_module(name)
+            except ImportError as e:
+                print(f"Warning: Could not preload {name}: {e}")
+
+        # Touch the font and rendering paths once so their data lands in shared pages
+        doc = fitz.open()
+        page = doc.new_page(width=200, height=200)
+        page.insert_text((20, 40), "warm-up", fontsize=12)
+        page.get_pixmap(dpi=36)
+        doc.tobytes(garbage=3, deflate=True)
+        doc.close()
+
+        # Keep the garbage collector from dirtying preloaded objects in each worker
+        gc.collect()
+        gc.freeze()
+
+        from metrics import metrics
+        metrics.flush(force=True)
+        print(f"Preloaded app in {(time.perf_counter() - started) * 1000:.0f} ms, "
+              f"parent RSS {_rss_of(os.getpid()) / MB:.0f} MB")
+
+    def run(self) -> None:
+        self.preload()
+        self.sock = _bind_socket(self.host, self.port)
+        print(f"Serving on http://{self.host}:{self.port} with {self.workers} worker(s), "
+              f"loop={self.loop}, http={self.http}, max_requests={config.SERVER_MAX_REQUESTS or 'unlimited'}")
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+
+        for _ in range(self.workers):
+            self._spawn()
+
+        while not self._stopping:
+            self._reap(respawn=True)
+            self._check_memory()
+            time.sleep(0.5)
+
+        self._shutdown()
+
+    def _handle_stop(self, signum, frame) -> None:
+        self._stopping = True
+
+    def _spawn(self) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._run_worker()
+            except BaseException as e:
+                print(f"Worker {os.getpid()} crashed: {e}")
+                code = 1
+            finally:
+                # Never fall back into the parent's supervisor loop
+                os._exit(code)
+        self.children[pid] = time.monotonic()
+
+    def _reap(self, respawn: bool) -> None:
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if pid == 0:
+                return
+            started = self.children.pop(pid, None)
+            if started is None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if not respawn or self._stopping:
+                continue
+            if code != 0:
+                print(f"Worker {pid} exited with code {code}, restarting")
+                # Back off if workers die right after starting (e.g. a broken deploy)
+                if time.monotonic() - started < 5:
+                    time.sleep(1)
+            self._spawn()
+
+    def _check_memory(self) -> None:
+        """Recycle workers whose RSS grew past SERVER_MAX_WORKER_RSS_MB"""
+        if config.SERVER_MAX_WORKER_RSS_MB <= 0:
+            return
+        limit = config.SERVER_MAX_WORKER_RSS_MB * MB
+        for pid in list(self.children):
+            rss = _rss_of(pid)
+            if rss > limit:
+                print(f"Worker {pid} RSS {rss / MB:.0f} MB over {config.SERVER_MAX_WORKER_RSS_MB} MB, recycling")
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+    def _shutdown(self) -> None:
+        print(f"Shutting down {len(self.children)} worker(s)")
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        deadline = time.monotonic() + config.SERVER_GRACEFUL_TIMEOUT
+        while self.children and time.monotonic() < deadline:
+            self._reap(respawn=False)
+            time.sleep(0.1)
+        for pid in list(self.children):
+            print(f"Worker {pid} did not stop in {config.SERVER_GRACEFUL_TIMEOUT}s, killing")
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self._reap(respawn=False)
+        self.sock.close()
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+
+    def _run_worker(self) -> None:
+        import uvicorn
+        from metrics import metrics
+
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        # Counters inherited from the parent were already flushed under its pid
+        metrics.reset()
+        random.seed()
+
+        max_requests = None
+        if config.SERVER_MAX_REQUESTS > 0:
+            # Jitter so workers started together are not all recycled at once
+            max_requests = config.SERVER_MAX_REQUESTS + random.randint(0, config.SERVER_MAX_REQUESTS_JITTER)
+
+        server = uvicorn.Server(uvicorn.Config(
+            self.app,
+            loop=self.loop,
+            http=self.http,
+            lifespan="auto",
+            limit_max_requests=max_requests,
+            timeout_keep_alive=config.SERVER_KEEPALIVE_TIMEOUT,
+            timeout_graceful_shutdown=config.SERVER_GRACEFUL_TIMEOUT,
+            log_level=config.SERVER_LOG_LEVEL,
+            access_log=config.SERVER_ACCESS_LOG,
+        ))
+        server.run(sockets=[self.sock])
+        # Recycled workers exit here; keep their counters in the merged /metrics
+        metrics.flush(force=True)
+
+
+def main() -> None:
+    if not hasattr(os, "fork"):
+        # No fork (Windows): fall back to a single uvicorn process
+        import uvicorn
+        uvicorn.run("dapi:app", host=config.SERVER_HOST, port=config.SERVER_PORT)
+        return
+    # Resolved before the app is imported: the worker pools are sized from it
+    config.SERVER_WORKERS = worker_count()
+    PreforkServer(config.SERVER_HOST, config.SERVER_PORT, config.SERVER_WORKERS).run()
+
+
+if __name__ == "__main__":
+    main()
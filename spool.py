@@ -0,0 +1,99 @@
+"""
+Upload spool for PDF Tool API
+Files written while ingesting uploads live in SPOOL_DIR for the duration of the
+request that created them and are deleted when its response has been sent.
+"""
+import os
+import time
+import uuid
+from contextvars import ContextVar
+from typing import BinaryIO, List, Optional, Tuple
+
+from config import config
+
+_request_files: ContextVar[Optional[List[str]]] = ContextVar("pydf_spool_files", default=None)
+
+
+class UploadSpool:
+    """Creates spool files and removes them when their request ends"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._ready = False
+
+    def ensure_directory(self) -> None:
+        if not self._ready:
+            os.makedirs(self.directory, exist_ok=True)
+            self._ready = True
+
+    def create(self, suffix: str = "") -> Tuple[str, BinaryIO]:
+        """
+        Create a new spool file owned by the current request.
+
+        Returns:
+            (path, file object opened for binary writing)
+        """
+        self.ensure_directory()
+        path = os.path.join(self.directory, f"{os.getpid()}_{uuid.uuid4().hex}{suffix}")
+        fh = open(path, "xb")
+        self.track(path)
+        return path, fh
+
+    def track(self, path: str) -> None:
+        """Delete path when the current request ends (kept if there is no request)"""
+        files = _request_files.get()
+        if files is not None:
+            files.append(path)
+
+    @staticmethod
+    def discard(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Warning: Could not remove spool file {path}: {e}")
+
+    def sweep(self, max_age: float) -> int:
+        """Remove spool files older than max_age seconds (left by crashed workers)"""
+        removed = 0
+        cutoff = time.time() - max_age
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            try:
+                # Only top-level files: subdirectories (the blob store) manage themselves
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+
+class SpoolCleanupMiddleware:
+    """ASGI middleware that deletes the spool files a request created once it completes"""
+
+    def __init__(self, app, spool: UploadSpool):
+        self.app = app
+        self.spool = spool
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        files: List[str] = []
+        token = _request_files.set(files)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_files.reset(token)
+            for path in files:
+                self.spool.discard(path)
+
+
+# Create a singleton instance
+upload_spool = UploadSpool(config.SPOOL_DIR)
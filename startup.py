@@ -0,0 +1,137 @@
+"""
+Import timing for PDF Tool API
+Measures how long each top-level package takes to import while the app starts,
+reports the slowest ones, and logs heavy modules that are loaded lazily later.
+"""
+import builtins
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from config import config
+
+
+class ImportTimer:
+    """
+    Wraps builtins.__import__ to time the first import of each top-level package.
+
+    Times are inclusive: a package pulled in by another one is counted in both,
+    the same as the cumulative column of `python -X importtime`.
+    """
+
+    def __init__(self):
+        self.records: List[dict] = []
+        self._seen: set = set()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._original_import = None
+        self._installed_at: Optional[float] = None
+        self._ready_at: Optional[float] = None
+        self._reported = False
+
+    def install(self) -> None:
+        """Start recording imports (call before the heavy imports)"""
+        if self._original_import is not None:
+            return
+        self._installed_at = time.perf_counter()
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def uninstall(self) -> None:
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        top = name.partition(".")[0]
+        if level or not top or top in sys.modules or top in self._seen:
+            return self._original_import(name, globals, locals, fromlist, level)
+
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        with self._lock:
+            self._seen.add(top)
+        stack.append(top)
+        start = time.perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            self._record(top, elapsed, stack[-1] if stack else None)
+
+    def _record(self, module: str, seconds: float, parent: Optional[str]) -> None:
+        phase = "startup" if self._ready_at is None else "lazy"
+        with self._lock:
+            self.records.append({"module": module, "seconds": seconds, "parent": parent, "phase": phase})
+
+        if phase == "lazy" and parent is None and seconds * 1000 >= config.IMPORT_REPORT_MIN_MS:
+            print(f"Lazy import: {module} took {seconds * 1000:.1f} ms")
+            try:
+                from metrics import metrics
+                metrics.observe("pydf_import_duration_seconds", seconds, {"module": module, "phase": phase})
+            except ImportError:
+                pass
+
+    def mark_ready(self) -> None:
+        """Close the startup phase; later first-time imports are reported as lazy"""
+        if self._ready_at is None:
+            self._ready_at = time.perf_counter()
+
+    @property
+    def startup_seconds(self) -> float:
+        if self._installed_at is None:
+            return 0.0
+        return (self._ready_at or time.perf_counter()) - self._installed_at
+
+    def report(self, top: Optional[int] = None) -> Dict[str, float]:
+        """
+        Print the slowest startup imports and record them as metrics.
+
+        Args:
+            top: Number of modules to list (defaults to config.IMPORT_REPORT_TOP)
+
+        Returns:
+            Mapping module -> inclusive import seconds for the startup phase
+        """
+        self.mark_ready()
+        startup = {r["module"]: r for r in self.records if r["phase"] == "startup"}
+        ranked = sorted(startup.values(), key=lambda r: r["seconds"], reverse=True)
+        limit = top if top is not None else config.IMPORT_REPORT_TOP
+
+        rss_mb = _read_rss() / (1024 * 1024)
+        print(f"Startup: imports took {self.startup_seconds * 1000:.0f} ms, RSS {rss_mb:.0f} MB (pid {os.getpid()})")
+        for record in ranked[:limit]:
+            if record["seconds"] * 1000 < config.IMPORT_REPORT_MIN_MS:
+                break
+            via = f" (via {record['parent']})" if record["parent"] else ""
+            print(f"  {record['module']:<20} {record['seconds'] * 1000:8.1f} ms{via}")
+
+        if not self._reported:
+            self._reported = True
+            try:
+                from metrics import metrics
+                metrics.observe("pydf_startup_duration_seconds", self.startup_seconds)
+                for record in ranked:
+                    if record["parent"] is None:
+                        metrics.observe("pydf_import_duration_seconds", record["seconds"],
+                                        {"module": record["module"], "phase": "startup"})
+            except ImportError:
+                pass
+
+        return {module: record["seconds"] for module, record in startup.items()}
+
+
+def _read_rss() -> int:
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+# Global import timer instance
+import_timer = ImportTimer()
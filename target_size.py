@@ -0,0 +1,167 @@
+"""
+Compress-to-target-size for PDF Tool API
+Instead of trying compression settings until the output fits, one cheap probe
+(functions.probe_compression) measures the document's images at a grid of
+JPEG qualities and downsampling factors. The size model built from it picks
+the best image quality and DPI predicted to fit, one full compression is run
+and its size checked; if it overshoots, the model is corrected by the
+measured error and the next setting down is tried, for at most
+COMPRESS_TARGET_MAX_PASSES compressions.
+"""
+import io
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from fastapi import Request
+
+from cancellation import run_cancellable
+from config import config
+from functions import PROBE_QUALITIES, PROBE_SCALES, PdfSource, compress_pdf_with_settings, probe_compression
+from metrics import metrics
+
+# Settings are tried in order of preference: at each DPI the image quality is
+# lowered to QUALITY_FLOOR before the DPI is, and only at the lowest DPI below it
+QUALITY_STEPS = tuple(range(90, 4, -5))
+QUALITY_FLOOR = 60
+DPI_STEPS = (300, 250, 200, 150, 120, 100, 96, 72)
+
+
+def _interpolate(points: Sequence[Tuple[float, float]], x: float) -> float:
+    """Piecewise-linear value at x of (x, y) points sorted by x, clamped at both ends"""
+    if x <= points[0][0]:
+        return points[0][1]
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        if x <= x1:
+            return y0 + (y1 - y0) * (x - x0) / (x1 - x0)
+    return points[-1][1]
+
+
+def _bytes_per_pixel(bpp: Dict[Tuple[int, float], float], quality: int, scale: float) -> float:
+    """A probed image's bytes per output pixel, interpolated between the probe settings"""
+    by_scale = [(s, _interpolate([(q, bpp[(q, s)]) for q in PROBE_QUALITIES], quality)) for s in PROBE_SCALES]
+    return _interpolate(by_scale, scale)
+
+
+def target_settings(max_dpi: int) -> List[Tuple[int, int]]:
+    """(image quality, DPI) candidates, best first, DPIs capped at max_dpi"""
+    dpis = sorted({max_dpi} | {dpi for dpi in DPI_STEPS if dpi <= max_dpi}, reverse=True)
+    settings = [(quality, dpi) for dpi in dpis for quality in QUALITY_STEPS if quality >= QUALITY_FLOOR]
+    settings += [(quality, dpis[-1]) for quality in QUALITY_STEPS if quality < QUALITY_FLOOR]
+    return settings
+
+
+class SizeModel:
+    """
+    Predicted size of a compressed document: the probe's fixed part plus,
+    per image, pixels after downsampling x bytes per pixel at the quality
+    (never more than the image's current size, which compression keeps).
+    Images that were not sampled use the pixel-weighted average of those
+    that were, or their current size when none could be.
+    """
+
+    def __init__(self, probe: dict):
+        self.fixed: int = probe["fixed"]
+        self.images: List[dict] = probe["images"]
+        self.correction = 1.0
+
+        sampled = [image for image in self.images if image["bpp"]]
+        weight = sum(image["pixels"] for image in sampled)
+        self.average: Optional[Dict[Tuple[int, float], float]] = None
+        if weight:
+            self.average = {
+                key: sum(image["bpp"][key] * image["pixels"] for image in sampled) / weight
+                for key in sampled[0]["bpp"]
+            }
+
+    def predict(self, quality: int, dpi: float) -> int:
+        total = 0.0
+        for image in self.images:
+            bpp = image["bpp"] or self.average
+            if bpp is None:
+                total += image["length"]
+                continue
+            scale = min(1.0, dpi / image["dpi"])
+            size = image["pixels"] * scale * scale * _bytes_per_pixel(bpp, quality, scale) * self.correction
+            total += min(size, image["length"]) if image["length"] else size
+        return self.fixed + int(total)
+
+    def correct(self, predicted: int, measured: int) -> None:
+        """Scale the image part of later predictions by the error of this one"""
+        if predicted > self.fixed and measured > self.fixed:
+            self.correction *= (measured - self.fixed) / (predicted - self.fixed)
+
+    def solve(self, target_size: int, settings: List[Tuple[int, int]], start: int = 0) -> int:
+        """Index of the first of settings[start:] predicted to fit, else of the last one"""
+        for index in range(start, len(settings)):
+            if self.predict(*settings[index]) <= target_size:
+                return index
+        return len(settings) - 1
+
+
+async def compress_to_size(request: Request, pdf_file: PdfSource, target_size: int,
+                           compression_level: int = 50, max_dpi: int = 300, measure: bool = False,
+                           **structure) -> Tuple[io.BytesIO, dict]:
+    """
+    Compress a PDF to at most target_size bytes with the best image quality
+    and DPI that get it there.
+
+    Args:
+        request: The request the compression serves
+        pdf_file: PDF to compress
+        target_size: Size in bytes the result should not exceed
+        compression_level: Compression level whose save options are used
+        max_dpi: Highest DPI images are kept at
+        measure: Measure the bytes each compression step saves (in every pass)
+        **structure: object_streams, subset_fonts and remove_metadata (see functions._save_compressed)
+
+    Returns:
+        (compressed PDF, report) where the report has target_size, size,
+        predicted_size, passes, image_quality, dpi, target_met and saved
+        (bytes saved per step by the last pass, None unless measured); when
+        no setting fits, the result of the last pass is returned with
+        target_met False
+    """
+    probe = await run_cancellable(request, probe_compression, pdf_file,
+                                  config.COMPRESS_TARGET_PROBE_IMAGES, compression_level, **structure)
+    model = SizeModel(probe)
+    image_dpis = {image["xref"]: image["dpi"] for image in model.images}
+    settings = target_settings(max_dpi)
+
+    index = model.solve(target_size, settings)
+    passes = 0
+    while True:
+        quality, dpi = settings[index]
+        predicted = model.predict(quality, dpi)
+        result, saved = await run_cancellable(request, compress_pdf_with_settings, pdf_file, quality, dpi,
+                                              image_dpis, compression_level, measure, **structure)
+        passes += 1
+        result.seek(0, io.SEEK_END)
+        size = result.tell()
+        result.seek(0)
+        print(f"Target size pass {passes}: quality {quality}, {dpi} DPI, predicted {predicted}, got {size} bytes")
+        if passes == 1:
+            metrics.observe("pydf_compress_target_error", abs(size - predicted) / max(size, 1))
+        if size <= target_size or passes >= config.COMPRESS_TARGET_MAX_PASSES or index == len(settings) - 1:
+            break
+        model.correct(predicted, size)
+        index = model.solve(target_size, settings, index + 1)
+
+    metrics.observe("pydf_compress_target_passes", passes)
+    if size > target_size:
+        metrics.inc("pydf_compress_target_missed_total")
+    return result, {
+        "target_size": target_size,
+        "size": size,
+        "predicted_size": predicted,
+        "passes": passes,
+        "image_quality": quality,
+        "dpi": dpi,
+        "target_met": size <= target_size,
+        "saved": saved,
+    }
+
+
+metrics.describe("pydf_compress_target_passes", "histogram", "Full compressions needed to reach a target size",
+                 (1, 2, 3, 4, 5))
+metrics.describe("pydf_compress_target_error", "histogram", "Relative error of the first target-size prediction",
+                 (0.02, 0.05, 0.1, 0.2, 0.5, 1))
+metrics.describe("pydf_compress_target_missed_total", "counter", "Target-size compressions that could not reach the target")
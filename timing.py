@@ -0,0 +1,161 @@
+"""
+Per-request stage timing for PDF Tool API
+Records named spans (validate, parse, process, serialize, zip, ...) and reports them
+in a Server-Timing response header and an optional structured log line
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, List, Optional
+
+
+class RequestTimings:
+    """
+    Accumulates stage durations for one request.
+
+    Spans may nest; each stage is credited with its exclusive time, so a
+    'process' span that opens and saves a document does not double count
+    the 'parse' and 'serialize' spans inside it. Operations of one request
+    may run in several threads at once, so each thread nests its own spans.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def _stack(self) -> List[List[float]]:
+        """[start, child_time] per span open in the calling thread"""
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def push(self) -> None:
+        self._stack.append([time.perf_counter(), 0.0])
+
+    def pop(self, name: str) -> None:
+        stack = self._stack
+        start, child_time = stack.pop()
+        elapsed = time.perf_counter() - start
+        self.add(name, elapsed - child_time)
+        if stack:
+            stack[-1][1] += elapsed
+
+    def add(self, name: str, seconds: float) -> None:
+        """Credit a stage with a duration measured elsewhere"""
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + max(0.0, seconds)
+
+    def total(self) -> float:
+        return time.perf_counter() - self.start
+
+    def server_timing(self) -> str:
+        """Format stages as a Server-Timing header value (milliseconds)"""
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        entries.append(f"total;dur={self.total() * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("pydf_request_timings", default=None)
+
+
+def current_timings() -> Optional[RequestTimings]:
+    """Return the timings of the request being served, if any"""
+    return _current.get()
+
+
+@contextmanager
+def span(name: str):
+    """
+    Time a block of work as stage `name` of the current request.
+    Outside of a request (scripts, benchmarks) this is a no-op.
+    """
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    timings.push()
+    try:
+        yield
+    finally:
+        timings.pop(name)
+
+
+@contextmanager
+def timings_scope(timings: RequestTimings):
+    """Record spans into `timings` (worker processes time their part of a request this way)"""
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+def timed(name: str):
+    """Decorator form of span()"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware that opens a RequestTimings scope per request, times the
+    upload receive, and adds a Server-Timing header to the response
+    """
+
+    def __init__(self, app, log_enabled: bool = False):
+        self.app = app
+        self.log_enabled = log_enabled
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        receive_state = {"first": None, "done": False}
+
+        async def receive_wrapper():
+            if receive_state["first"] is None:
+                receive_state["first"] = time.perf_counter()
+            message = await receive()
+            if message["type"] == "http.request" and not message.get("more_body", False) and not receive_state["done"]:
+                receive_state["done"] = True
+                timings.add("receive", time.perf_counter() - receive_state["first"])
+            return message
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timings.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            _current.reset(token)
+            if self.log_enabled:
+                print(json.dumps({
+                    "event": "request_timing",
+                    "method": scope.get("method"),
+                    "path": scope.get("path"),
+                    "status": status["code"],
+                    "total_ms": round(timings.total() * 1000, 1),
+                    "stages_ms": {name: round(seconds * 1000, 1) for name, seconds in timings.stages.items()},
+                }))
@@ -0,0 +1,117 @@
+"""
+Buffer transport between requests and worker processes for PDF Tool API
+Document bytes cross the process boundary as spool files: BytesIO buffers of
+at least WORKER_SPOOL_MIN_BYTES in a task's arguments or result are written
+to SPOOL_DIR and replaced by a SpoolFile, so only a path is pickled. The
+receiving side reads (or MuPDF opens) the file directly, and a result file is
+linked into the result store instead of being copied.
+"""
+import glob
+import io
+import itertools
+import os
+import uuid
+from typing import Any, Callable, Optional
+
+from config import config
+from metrics import metrics
+from spool import upload_spool
+
+
+class SpoolFile:
+    """
+    Read-only bytes backed by a spool file; opened on first use.
+    Pickles as its path, so it doubles as the descriptor sent to workers.
+    """
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self._fh: Optional[io.BufferedReader] = None
+
+    def _file(self) -> io.BufferedReader:
+        if self._fh is None:
+            self._fh = open(self.path, "rb")
+        return self._fh
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file().read(size)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self._file().seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file().tell()
+
+    def getvalue(self) -> bytes:
+        with open(self.path, "rb") as fh:
+            return fh.read()
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def __getstate__(self):
+        return {"path": self.path, "size": self.size}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["size"])
+
+    def __repr__(self) -> str:
+        return f"SpoolFile({self.path!r}, {self.size} bytes)"
+
+
+def _map(value: Any, func: Callable[[Any], Any]) -> Any:
+    """Apply func to every leaf of nested lists, tuples and dicts"""
+    if isinstance(value, list):
+        return [_map(item, func) for item in value]
+    if isinstance(value, tuple):
+        return tuple(_map(item, func) for item in value)
+    if isinstance(value, dict):
+        return {key: _map(item, func) for key, item in value.items()}
+    return func(value)
+
+
+def new_prefix() -> str:
+    """Name prefix for the spool files of one task"""
+    return f"{os.getpid()}_{uuid.uuid4().hex}_task"
+
+
+def pack(value: Any, prefix: str) -> Any:
+    """
+    Replace large BytesIO buffers in value by SpoolFiles named prefix_<n>.
+    The buffers themselves are left to the caller (dropping value frees them).
+    """
+    counter = itertools.count()
+
+    def spool(item):
+        if not isinstance(item, io.BytesIO) or item.getbuffer().nbytes < config.WORKER_SPOOL_MIN_BYTES:
+            return item
+        upload_spool.ensure_directory()
+        path = os.path.join(upload_spool.directory, f"{prefix}_{next(counter)}")
+        with open(path, "xb") as fh:
+            size = fh.write(item.getbuffer())
+        metrics.inc("pydf_transport_spooled_bytes_total", size)
+        return SpoolFile(path, size)
+
+    return _map(value, spool)
+
+
+def adopt(value: Any) -> Any:
+    """Have the current request delete the SpoolFiles in value when it ends"""
+    def track(item):
+        if isinstance(item, SpoolFile):
+            upload_spool.track(item.path)
+        return item
+
+    return _map(value, track)
+
+
+def discard(prefix: str) -> None:
+    """Remove every spool file of a task (it failed or its worker was killed)"""
+    for path in glob.glob(os.path.join(glob.escape(upload_spool.directory), f"{glob.escape(prefix)}_*")):
+        upload_spool.discard(path)
+
+
+metrics.describe("pydf_transport_spooled_bytes_total", "counter", "Bytes handed between requests and workers as spool files")
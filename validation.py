@@ -1,12 +1,21 @@
 """
 Security and validation utilities for PDF Tool API
-Handles file type validation, size validation, and filename sanitization
+Handles file type validation, size validation, and filename sanitization,
+and single-pass ingestion of uploads into the spool
 """
+import hashlib
 import os
 import re
 from fastapi import UploadFile, HTTPException
-from typing import List
+from typing import BinaryIO, List, Union
 from config import config
+from timing import span
+from profiling import note_input, note_upload
+from spool import upload_spool
+from blob_store import blob_store
+
+# Bytes inspected to detect the file type
+SNIFF_BYTES = 2048
 
 # Try to import python-magic, fall back to basic validation if not available
 try:
@@ -17,6 +26,34 @@ except (ImportError, OSError):
     print("Warning: python-magic not available, using basic file type validation")
 
 
+class UploadDescriptor:
+    """
+    An upload after ingestion: type-checked, size-checked, hashed and written
+    to the spool in one pass. Downstream code opens `path` instead of reading
+    the upload again; the spool file is removed when the request ends.
+    """
+
+    def __init__(self, filename: str, original_filename: str, mime_type: str,
+                 size: int, sha256: str, path: str):
+        self.filename = filename
+        self.original_filename = original_filename
+        self.mime_type = mime_type
+        self.size = size
+        self.sha256 = sha256
+        self.path = path
+
+    def open(self) -> BinaryIO:
+        """Open the spooled bytes for reading"""
+        return open(self.path, "rb")
+
+    def read(self) -> bytes:
+        with self.open() as fh:
+            return fh.read()
+
+    def __repr__(self) -> str:
+        return f"UploadDescriptor({self.filename!r}, {self.mime_type}, {self.size} bytes, sha256={self.sha256[:12]})"
+
+
 class RequestValidator:
     """Validates and sanitizes incoming requests for security"""
     
@@ -58,6 +95,30 @@ class RequestValidator:
             return 'application/zip'
         
         return 'application/octet-stream'
+
+    def detect_mime_type(self, file_content: bytes) -> str:
+        """Detect the MIME type of the first SNIFF_BYTES of a file"""
+        if self.magic:
+            try:
+                return self.magic.from_buffer(file_content)
+            except Exception:
+                # Fall back to basic detection
+                pass
+        return self._detect_mime_type_basic(file_content)
+
+    def _reject_type(self, detected_mime: str, allowed_types: List[str]) -> None:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Invalid file type. Detected: {detected_mime}. Allowed types: {', '.join(allowed_types)}"
+        )
+
+    def _reject_size(self, file_size: int, max_size: int, partial: bool = False) -> None:
+        max_size_mb = max_size / (1024 * 1024)
+        size_text = f"more than {max_size_mb:.0f}MB" if partial else f"{file_size / (1024 * 1024):.2f}MB"
+        raise HTTPException(
+            status_code=413,
+            detail=f"File size ({size_text}) exceeds maximum allowed size ({max_size_mb:.0f}MB)"
+        )
     
     def validate_file_type(self, file: UploadFile, allowed_types: List[str] = None) -> bool:
         """
@@ -76,25 +137,16 @@ class RequestValidator:
         if allowed_types is None:
             allowed_types = config.ALLOWED_FILE_TYPES
         
-        # Read first 2048 bytes to detect file type
-        file_content = file.file.read(2048)
-        file.file.seek(0)  # Reset file pointer
-        
-        # Detect MIME type using magic numbers
-        if self.magic:
-            try:
-                detected_mime = self.magic.from_buffer(file_content)
-            except Exception:
-                # Fall back to basic detection
-                detected_mime = self._detect_mime_type_basic(file_content)
-        else:
-            detected_mime = self._detect_mime_type_basic(file_content)
+        with span("validate"):
+            # Read the first bytes to detect file type
+            file_content = file.file.read(SNIFF_BYTES)
+            file.file.seek(0)  # Reset file pointer
+            
+            # Detect MIME type using magic numbers
+            detected_mime = self.detect_mime_type(file_content)
         
         if detected_mime not in allowed_types:
-            raise HTTPException(
-                status_code=415,
-                detail=f"Invalid file type. Detected: {detected_mime}. Allowed types: {', '.join(allowed_types)}"
-            )
+            self._reject_type(detected_mime, allowed_types)
         
         return True
     
@@ -116,16 +168,16 @@ class RequestValidator:
             max_size = config.MAX_FILE_SIZE
         
         # Get file size
-        file.file.seek(0, 2)  # Seek to end
-        file_size = file.file.tell()
-        file.file.seek(0)  # Reset to beginning
+        with span("validate"):
+            file.file.seek(0, 2)  # Seek to end
+            file_size = file.file.tell()
+            file.file.seek(0)  # Reset to beginning
         
         if file_size > max_size:
-            max_size_mb = max_size / (1024 * 1024)
-            raise HTTPException(
-                status_code=413,
-                detail=f"File size ({file_size / (1024 * 1024):.2f}MB) exceeds maximum allowed size ({max_size_mb:.0f}MB)"
-            )
+            self._reject_size(file_size, max_size)
+        
+        # Hash the input when this request is being profiled
+        note_upload(file)
         
         return True
     
@@ -164,6 +216,84 @@ class RequestValidator:
         
         return filename
     
+    def ingest(self, file: Union[UploadFile, UploadDescriptor], allowed_types: List[str] = None,
+               max_size: int = None) -> UploadDescriptor:
+        """
+        Validate an upload and spool it in a single pass over its bytes.
+
+        The type is sniffed from the first chunk, the size limit is enforced
+        while reading (the read stops as soon as it is crossed), and the
+        SHA-256 is computed as the chunks are written to the spool. Uploads
+        that were already ingested (e.g. finished resumable uploads) are only
+        checked against the type and size limits. It blocks for the whole
+        read, hash and write, so async endpoints call it through run_in_threadpool.
+
+        Args:
+            file: The uploaded file, or the descriptor of an ingested upload
+            allowed_types: List of allowed MIME types (defaults to config)
+            max_size: Maximum file size in bytes (defaults to config)
+
+        Returns:
+            UploadDescriptor for the spooled upload
+
+        Raises:
+            HTTPException: 415 for a disallowed type, 413 when too large
+        """
+        if allowed_types is None:
+            allowed_types = config.ALLOWED_FILE_TYPES
+        if max_size is None:
+            max_size = config.MAX_FILE_SIZE
+
+        if isinstance(file, UploadDescriptor):
+            if file.mime_type not in allowed_types:
+                self._reject_type(file.mime_type, allowed_types)
+            if file.size > max_size:
+                self._reject_size(file.size, max_size)
+            note_input(file.original_filename, file.sha256, file.size)
+            return file
+
+        with span("validate"):
+            source = file.file
+            source.seek(0)
+            chunk = source.read(SNIFF_BYTES)
+            detected_mime = self.detect_mime_type(chunk)
+            if detected_mime not in allowed_types:
+                self._reject_type(detected_mime, allowed_types)
+
+            sanitized_name = self.sanitize_filename(file.filename or "")
+            path, spool = upload_spool.create(os.path.splitext(sanitized_name)[1].lower())
+            digest = hashlib.sha256()
+            size = 0
+            try:
+                with spool:
+                    while chunk:
+                        size += len(chunk)
+                        if size > max_size:
+                            self._reject_size(size, max_size, partial=True)
+                        digest.update(chunk)
+                        spool.write(chunk)
+                        chunk = source.read(config.INGEST_CHUNK_SIZE)
+            except BaseException:
+                upload_spool.discard(path)
+                raise
+            # Leave the upload readable for code that still reads it directly
+            source.seek(0)
+            sha256 = digest.hexdigest()
+            # Keep a copy by hash so the client can skip the next upload of these bytes
+            blob_store.add(path, sha256)
+
+        descriptor = UploadDescriptor(
+            filename=sanitized_name,
+            original_filename=file.filename or "",
+            mime_type=detected_mime,
+            size=size,
+            sha256=sha256,
+            path=path,
+        )
+        # Record the input when this request is being profiled
+        note_input(descriptor.original_filename, descriptor.sha256, descriptor.size)
+        return descriptor
+
     def validate_and_sanitize(self, file: UploadFile) -> str:
         """
         Perform all validation and sanitization on an uploaded file
@@ -177,16 +307,7 @@ class RequestValidator:
         Raises:
             HTTPException: If validation fails
         """
-        # Validate file type
-        self.validate_file_type(file)
-        
-        # Validate file size
-        self.validate_file_size(file)
-        
-        # Sanitize filename
-        sanitized_name = self.sanitize_filename(file.filename)
-        
-        return sanitized_name
+        return self.ingest(file).filename
 
 
 # Create a singleton instance
@@ -0,0 +1,278 @@
+"""
+Worker processes for PDF Tool API
+Operations run through run_cancellable() execute in a pool of worker
+processes instead of a thread, so a document that makes MuPDF spin can be
+stopped: each operation has a wall-clock timeout and a CPU time budget
+(RLIMIT_CPU in the worker), and a worker that overruns either is killed and
+replaced. Progress, page counts and stage timings are relayed to the request;
+document bytes travel as spool files (see transport.py).
+"""
+import atexit
+import multiprocessing
+import signal
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from config import config
+from memory_budget import (
+    MB, read_rss, cpu_share, memory_budget, note_pages, note_worker_memory, read_peak_rss,
+    reservation_scope, reset_peak_rss,
+)
+from metrics import metrics
+from progress import progress_scope, report_progress
+from rate_limit import charge_pages
+from scheduler import scheduler
+from timing import RequestTimings, current_timings, timings_scope
+from transport import adopt, discard, new_prefix, pack
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+
+# Seconds between checks for cancellation while waiting on a worker
+POLL_INTERVAL = 0.05
+
+
+class OperationTimedOut(HTTPException):
+    """The operation ran past its wall-clock timeout"""
+
+    def __init__(self, seconds: float):
+        super().__init__(status_code=504, detail=f"Operation timed out after {seconds:g} seconds")
+
+
+class OperationTooExpensive(HTTPException):
+    """The operation used up its CPU time budget (usually a malformed or hostile document)"""
+
+    def __init__(self, seconds: float):
+        super().__init__(
+            status_code=422,
+            detail=f"Document could not be processed within the CPU time limit of {seconds:g} seconds",
+        )
+
+
+class _Relay:
+    """Forwards hook calls made inside the worker to the request's process"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def report(self, stage: str, done: int, total: int) -> None:
+        self.conn.send(("progress", stage, done, total))
+
+    def add_pages(self, pages: int, document: Optional[str] = None) -> None:
+        self.conn.send(("pages", pages, document))
+
+
+def _set_cpu_budget(seconds: Optional[float]) -> None:
+    """Let the worker run `seconds` more CPU seconds before SIGXCPU ends it (None: no limit)"""
+    if not RESOURCE_AVAILABLE:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if seconds:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft = int(usage.ru_utime + usage.ru_stime + seconds + 0.999)
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+    else:
+        soft = hard
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _worker_main(conn) -> None:
+    """Run tasks received on conn until the pipe closes"""
+    # Ctrl+C is the server's to handle; workers are stopped by the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    relay = _Relay(conn)
+    while True:
+        try:
+            func, args, kwargs, cpu_limit, prefix = conn.recv()
+        except (EOFError, OSError):
+            return
+        timings = RequestTimings()
+        # The peak is measured per task: this worker's earlier tasks do not count
+        tracked = reset_peak_rss()
+        rss_start = read_rss()
+        started = time.time()
+        _set_cpu_budget(cpu_limit)
+        try:
+            with timings_scope(timings), progress_scope(relay), reservation_scope(relay):
+                message = ("result", pack(func(*args, **kwargs), f"{prefix}_out"), timings.stages)
+        except Exception as e:
+            message = ("error", e, timings.stages)
+        finally:
+            _set_cpu_budget(None)
+        peak = read_peak_rss() if tracked else None
+        try:
+            if peak is not None and rss_start is not None:
+                conn.send(("memory", started, time.time(), max(0, peak - rss_start)))
+            conn.send(message)
+        except Exception as e:
+            # Unpicklable result or exception: report it as a plain error
+            conn.send(("error", RuntimeError(f"{type(message[1]).__name__}: {message[1]} ({e})"), timings.stages))
+        metrics.flush()
+
+
+class _Worker:
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), name="pydf-worker", daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(5)
+        self.conn.close()
+
+
+class WorkerPool:
+    """
+    Up to `size` worker processes, started on first use and reused across
+    operations. A worker that times out, is cancelled or dies is discarded
+    and the next operation starts a fresh one.
+    """
+
+    def __init__(self, size: int, start_method: str = "forkserver"):
+        self.size = size
+        self.start_method = start_method
+        self._context = None
+        self._idle: List[_Worker] = []
+        self._slots = threading.BoundedSemaphore(max(1, size))
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def _get_context(self):
+        if self._context is None:
+            method = self.start_method
+            if method not in multiprocessing.get_all_start_methods():
+                method = "spawn"
+            self._context = multiprocessing.get_context(method)
+            if method == "forkserver":
+                # New workers fork from a server that already imported the PDF stack
+                self._context.set_forkserver_preload(["functions"])
+            # Idle workers hold memory no request reserves: keep it out of the admission budget
+            memory_budget.reserve_baseline(self.size * config.WORKER_PROCESS_BASELINE_MB * MB)
+        return self._context
+
+    def _checkout(self) -> _Worker:
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.process.is_alive():
+                    return worker
+                worker.kill()
+        metrics.inc("pydf_worker_starts_total")
+        return _Worker(self._get_context())
+
+    def _checkin(self, worker: _Worker) -> None:
+        with self._lock:
+            self._idle.append(worker)
+
+    def run(self, func: Callable, args: Tuple, kwargs: Dict[str, Any], wall_limit: float,
+            cpu_limit: float, check: Callable[[], None], operation: str = "") -> Any:
+        """
+        Run func(*args, **kwargs) in a worker process and wait for it.
+
+        Args:
+            func: Module-level function (sent by reference)
+            wall_limit: Seconds before the worker is killed (0 = none)
+            cpu_limit: CPU seconds the worker may use (0 = none)
+            check: Called while waiting; an exception it raises kills the worker
+            operation: Route, for metrics
+
+        Returns:
+            The function's result
+
+        Raises:
+            OperationTimedOut: Wall-clock timeout (504)
+            OperationTooExpensive: CPU budget used up (422)
+        """
+        prefix = new_prefix()
+        # Inputs are the request's spool files from here on, deleted when it ends
+        args, kwargs = adopt(pack((args, kwargs), f"{prefix}_in"))
+        with self._slots:
+            worker = self._checkout()
+            deadline = time.monotonic() + wall_limit if wall_limit else None
+            try:
+                worker.conn.send((func, args, kwargs, cpu_limit or None, prefix))
+                while True:
+                    if worker.conn.poll(POLL_INTERVAL):
+                        message = worker.conn.recv()
+                        if message[0] == "progress":
+                            report_progress(*message[1:])
+                        elif message[0] == "pages":
+                            note_pages(message[1], message[2])
+                            charge_pages(message[1])
+                        elif message[0] == "memory":
+                            note_worker_memory(*message[1:])
+                        else:
+                            break
+                        continue
+                    check()
+                    if deadline is not None and time.monotonic() > deadline:
+                        metrics.inc("pydf_worker_killed_total", labels={"route": operation, "reason": "timeout"})
+                        print(f"Operation {operation} exceeded {wall_limit:g}s, killing worker {worker.process.pid}")
+                        raise OperationTimedOut(wall_limit)
+            except EOFError:
+                # The worker died: SIGXCPU when the CPU budget ran out, otherwise a crash
+                worker.kill()
+                discard(prefix)
+                if worker.process.exitcode == -signal.SIGXCPU:
+                    metrics.inc("pydf_worker_killed_total", labels={"route": operation, "reason": "cpu"})
+                    print(f"Operation {operation} exceeded {cpu_limit:g}s of CPU time")
+                    raise OperationTooExpensive(cpu_limit)
+                metrics.inc("pydf_worker_killed_total", labels={"route": operation, "reason": "crash"})
+                raise HTTPException(status_code=500, detail=f"Worker process exited unexpectedly ({worker.process.exitcode})")
+            except BaseException:
+                worker.kill()
+                discard(prefix)
+                raise
+
+            self._checkin(worker)
+            kind, value, stages = message
+            timings = current_timings()
+            if timings is not None:
+                for name, seconds in stages.items():
+                    timings.add(name, seconds)
+            if kind == "error":
+                discard(prefix)
+                raise value
+            return adopt(value)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.kill()
+
+
+def time_limits(operation: str) -> Tuple[float, float]:
+    """(wall seconds, CPU seconds) for a route; OPERATION_TIME_LIMITS overrides the defaults"""
+    return config.OPERATION_TIME_LIMITS.get(
+        operation, (config.OPERATION_WALL_TIMEOUT, config.OPERATION_CPU_LIMIT)
+    )
+
+
+def _pool_size() -> int:
+    if not config.WORKER_PROCESSES_ENABLED:
+        return 0
+    if scheduler.enabled:
+        return scheduler.workers
+    return cpu_share()
+
+
+# Create a singleton instance
+worker_pool = WorkerPool(_pool_size(), config.WORKER_START_METHOD)
+atexit.register(worker_pool.shutdown)
+
+metrics.describe("pydf_worker_starts_total", "counter", "Worker processes started")
+metrics.describe("pydf_worker_killed_total", "counter", "Worker processes killed by route and reason (timeout/cpu/crash)")